@@ -1,39 +1,77 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, after_this_request
-from datetime import datetime
-from zoneinfo import ZoneInfo
+"""
+Baby gift list: public page, admin page, JSON API and background jobs.
+
+Run it through the app factory: `flask run` finds create_app() by itself, and
+gunicorn takes "app:create_app()" (with --preload, workers fork from a master
+that has already parsed the catalog and compiled the templates). Modules that
+are slow to import (requests, Pillow) are only imported by the code paths that
+use them, so a restart is ready to serve the public page sooner.
+"""
+from flask import (
+    Flask, Blueprint, current_app, render_template, request, redirect,
+    url_for, flash, session, make_response, send_file, abort, jsonify,
+    Response, g, stream_with_context, has_app_context,
+)
+from werkzeug.local import LocalProxy
+from werkzeug.security import safe_join
+from datetime import datetime, timedelta
 from uuid import uuid4
 from dotenv import load_dotenv
 from pathlib import Path
-import json
+import hashlib
+import mimetypes
+from contextlib import contextmanager
+from functools import partial
+import io
 import os
 import re
-import requests
 import random
-import json as pyjson
-from urllib.parse import urlparse
+import shutil
+import tempfile
+import threading
+import time
 from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
+from store import open_store, migrate_json_to_sqlite
+from notifier import TelegramDispatcher
+from page_cache import PageCache
+from extract import extract_product_metadata, metadata_complete, format_price
+from price_history import PriceHistory, format_money, sparkline_points
+from price_refresh import refresh_prices, PriceRefreshScheduler
+from retailers import RetailerRegistry
+from thumbnails import ThumbnailCache, url_key
+from event_hub import EventHub
+from bulk_import import read_items, import_items, new_product
+from fragment_cache import FragmentCache
+from compression import Compressor, precompress
+from catalog_index import CatalogIndex, SORTS, paginate
+from registries import Registry, RegistryPool, RegistryDispatcher, ENVIRON_KEY, create_registry
+from metrics import Metrics, SlowRequestSampler
+from markupsafe import Markup
+import click
 
 # Load environment variables
 load_dotenv()
 
-# Determine path prefix based on environment
-APP_PREFIX = "/baby" if os.environ.get("APP_ENV") == "pi" else ""
-
 # Base directory of the project
 BASE_DIR = Path(__file__).resolve().parent
 
-# Set up Flask app
-app = Flask(
-    __name__,
-    static_url_path=f"{APP_PREFIX}/static",
-    static_folder=str(BASE_DIR / "static"),
-    template_folder=str(BASE_DIR / "templates")
-)
-app.secret_key = os.getenv("SECRET_KEY", "dev")
-app.config["APP_PREFIX"] = APP_PREFIX
+# Routes, hooks and CLI commands; create_app() attaches them to a Flask app
+bp = Blueprint("main", __name__, cli_group=None)
+
+# Request/storage/fetch timings, exposed on /metrics (summed across gunicorn workers)
+metrics = Metrics(prefix="babylist_", snapshot_dir=os.getenv("METRICS_DIR") or BASE_DIR / "data/metrics")
+metrics.describe("http_request_duration_seconds", "histogram", "Time to build the response, by endpoint.")
+metrics.describe("store_seconds", "histogram", "Product storage reads/writes, by operation.")
+metrics.describe("fetch_seconds", "histogram", "Retailer page fetch + parse, by host, field and outcome.")
+metrics.describe("telegram_send_seconds", "histogram", "Background Telegram sends (per chat, incl. retries).")
+metrics.describe("telegram_enqueue_seconds", "histogram", "Time the request path spends queueing a notification.")
+metrics.describe("slow_requests_total", "counter", "Requests slower than SLOW_REQUEST_MS.")
 
-# Credentials
+# Log requests slower than this, with a sample of where they spent the time (0 = off)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+slow_requests = SlowRequestSampler(SLOW_REQUEST_MS / 1000, root=BASE_DIR) if SLOW_REQUEST_MS > 0 else None
+
+# Credentials (of the default registry; others have their own in registry.json)
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "password")
 
@@ -41,24 +79,35 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKE
 TELEGRAM_CHAT_IDS = [cid.strip() for cid in (os.getenv("TELEGRAM_CHAT_IDS") or "").split(",") if cid.strip()]
 NOTIFY_ENABLED = (os.getenv("NOTIFY_ENABLED", "true").lower() == "true")
 
+# Sends happen on a background thread; requests only enqueue
+telegram = TelegramDispatcher(
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_IDS,
+    api_base=os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org"),
+    coalesce_seconds=float(os.getenv("NOTIFY_COALESCE_SECONDS", "2")),
+).register_shutdown()
+telegram.on_send = lambda seconds, outcome: metrics.observe("telegram_send_seconds", seconds, outcome=outcome)
+
 # Data file path
-DATA_FILE = BASE_DIR / "data/products.json"
+DATA_FILE = Path(os.getenv("DATA_FILE") or BASE_DIR / "data/products.json")
+SQLITE_FILE = Path(os.getenv("SQLITE_PATH") or BASE_DIR / "data/products.db")
+DATA_BACKEND = os.getenv("DATA_BACKEND", "json").lower()
 os.makedirs(DATA_FILE.parent, exist_ok=True)
 
-RETAILER_MAP = {
-    r"(?:^|\.)amazon\.(co\.uk|com)$": "Amazon",
-    r"(?:^|\.)argos\.co\.uk$": "Argos",
-    r"(?:^|\.)boots\.com$": "Boots",
-    r"(?:^|\.)johnlewis\.com$": "John Lewis",
-    r"(?:^|\.)mamasandpapas\.com$": "Mamas & Papas",
-    r"(?:^|\.)mabelandfox\.com$": "Mabel & Fox",
-    r"(?:^|\.)boots\.com$": "Boots",
-    r"(?:^|\.)pippeta\.com$": "Pippeta",
-    r"(?:^|\.)currys\.co\.uk$": "Currys",
-    r"(?:^|\.)argos\.co\.uk$": "Argos",
-    r"(?:^|\.)sainsburys\.co\.uk$": "Sainsburys",
-    
-}
+# The catalog of the registry this request is for (see registries.py);
+# outside requests (background jobs, CLI without --registry) the default one
+store = LocalProxy(lambda: current_registry().store)
+
+# Retailer pages shared by the price and image fetchers
+page_cache = PageCache(
+    ttl=int(os.getenv("PAGE_CACHE_TTL", 3600)),
+    max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+    max_page_bytes=int(os.getenv("PAGE_FETCH_MAX_BYTES", 1024 * 1024)),
+    cache_dir=BASE_DIR / "data/page_cache" if os.getenv("PAGE_CACHE_PERSIST", "false").lower() == "true" else None,
+)
+
+# Known retailers (add more in data/retailers.json)
+retailers = RetailerRegistry.load(BASE_DIR / "data/retailers.json")
 
 def guess_retailer_from_url(url: str):
     try:
@@ -68,14 +117,12 @@ def guess_retailer_from_url(url: str):
         if not re.match(r'^[a-z]+://', url, flags=re.I):
             url = 'http://' + url
 
-        hostname = (urlparse(url).hostname or "").lower()
-
-        # Match against regex patterns in RETAILER_MAP
-        for pattern, name in RETAILER_MAP.items():
-            if re.search(pattern, hostname):
-                return name
+        retailer = retailers.lookup(url)
+        if retailer:
+            return retailer.name
 
         # Fallback: derive something readable from the hostname
+        hostname = (urlparse(url).hostname or "").lower()
         parts = hostname.split('.')
         if len(parts) >= 2:
             base = parts[-2]
@@ -110,20 +157,16 @@ def _escape(text: str) -> str:
 
 def current_uk_time() -> str:
     # Europe/London automatically handles GMT/BST
+    from zoneinfo import ZoneInfo  # only needed for notifications
     now = datetime.now(ZoneInfo("Europe/London"))
     return now.strftime("%Y-%m-%d %H:%M:%S %Z")
 
 def send_telegram_message(message: str) -> None:
-    """Send message to all configured chat IDs. Fail silently."""
+    """Queue message for all configured chat IDs. Never blocks; fails silently."""
     if not (NOTIFY_ENABLED and TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_IDS):
         return
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    for chat_id in TELEGRAM_CHAT_IDS:
-        try:
-            requests.post(url, json={"chat_id": chat_id, "text": message}, timeout=5)
-        except Exception:
-            # don't let notification errors affect user flow
-            pass
+    with metrics.timer("telegram_enqueue_seconds"):
+        telegram.enqueue(message)
 
 def notify_purchase(product: dict):
     """Compose and send a purchase notification."""
@@ -133,6 +176,8 @@ def notify_purchase(product: dict):
     link = product.get("link") or ""
 
     parts = [f"🎁 Marked as purchased: {name}"]
+    if current_registry().slug:
+        parts.append(f"List: {current_registry().title or current_registry().slug}")
     if retailer:
         parts.append(f"Retailer: {retailer}")
     if price:
@@ -143,89 +188,86 @@ def notify_purchase(product: dict):
 
     send_telegram_message("\n".join(parts))
 
+def notify_price_drops(drops):
+    """One Telegram message per price drop reported by the price history, for items still wanted."""
+    for drop in drops:
+        p = store.get(drop["id"])
+        if not p or p.get("purchased") or not p.get("visible", True):
+            continue
+        parts = [
+            f"📉 Price drop: {p.get('name', 'Unnamed item')}",
+            f"{format_money(drop['old'], drop['currency'])} → {format_money(drop['new'], drop['currency'])} "
+            f"(-{drop['percent']}%)" + (", the lowest seen so far" if drop["lowest"] else ""),
+        ]
+        if current_registry().slug:
+            parts.append(f"List: {current_registry().title or current_registry().slug}")
+        if p.get("link"):
+            parts.append(f"Link: {p['link']}")
+        send_telegram_message("\n".join(parts))
+
+def fetch_page_metadata(link: str, timeout=6) -> dict:
+    """
+    Fetch a product page (via the page cache) and extract its metadata.
+    The retailer's own rules, if it has any, win over the generic extractor.
+    """
+    retailer = retailers.lookup(link)
+
+    def stop_when(text):
+        if not metadata_complete(text):
+            return False
+        # Retailer rules match the body, past the <head> that's enough above
+        if retailer and retailer.rules:
+            return retailer.complete(text)
+        return True
+
+    html = page_cache.get_text(link, timeout=timeout, stop_when=stop_when)
+    meta = extract_product_metadata(html, link)
+    if retailer:
+        price = retailer.extract("price", html)
+        if price:
+            meta["price"] = price
+        image = retailer.extract("image", html)
+        if image:
+            meta["image"] = urljoin(link, image)
+    return meta
+
+def timed_fetch(field, link, timeout, label=None):
+    """
+    fetch_page_metadata(), timed by retailer host and outcome for /metrics;
+    the outcome says whether `field` was found. `label` (default `field`)
+    tells callers apart in the metric's field label.
+    """
+    import requests  # already loaded by the page cache by the time anything can time out
+    host = (urlparse(link).hostname or "unknown").lower().removeprefix("www.")
+    outcome = "error"
+    t0 = time.perf_counter()
+    try:
+        meta = fetch_page_metadata(link, timeout=timeout)
+        outcome = "success" if meta[field] else f"no_{field}"
+        return meta
+    except requests.Timeout:
+        outcome = "timeout"
+        raise
+    except requests.ConnectionError as e:
+        # A read timeout while streaming the body comes out of requests as ConnectionError(ReadTimeoutError)
+        from urllib3.exceptions import ReadTimeoutError
+        if e.args and isinstance(e.args[0], ReadTimeoutError):
+            outcome = "timeout"
+        raise
+    finally:
+        metrics.observe("fetch_seconds", time.perf_counter() - t0, host=host, field=label or field,
+                        outcome=outcome)
+
 def try_fetch_price_from_structured_data(link: str):
     """
-    Try to fetch product price from JSON-LD, OpenGraph, or itemprop-based HTML tags.
+    Try to fetch product price from retailer-specific rules, JSON-LD, OpenGraph,
+    or itemprop-based HTML tags.
     Falls back to scanning nearby visible text if no content attribute is found.
     """
     try:
-        resp = requests.get(link, timeout=6, headers={"User-Agent": "Mozilla/5.0"})
-        resp.raise_for_status()
-        html = resp.text
-
-        import re as _re
-        import json as _json
-
-        # Helper to format price
-        def _fmt_price(price, currency=None):
-            price_str = str(price).strip()
-            if currency and not price_str.startswith(currency):
-                return f"{currency} {price_str}".strip()
-            return price_str
-
-        # -------- 1) JSON-LD <script type="application/ld+json"> --------
-        blocks = _re.findall(
-            r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
-            html, flags=_re.I | _re.S
-        )
-        for txt in blocks:
-            try:
-                data = _json.loads(txt.strip())
-            except Exception:
-                continue
-            objs = data if isinstance(data, list) else [data]
-            for obj in objs:
-                offers = obj.get("offers")
-                if not offers:
-                    continue
-                offers_list = offers if isinstance(offers, list) else [offers]
-                for offer in offers_list:
-                    price = offer.get("price") or offer.get("priceSpecification", {}).get("price")
-                    currency = offer.get("priceCurrency") or offer.get("priceSpecification", {}).get("priceCurrency")
-                    if price:
-                        return _fmt_price(price, currency)
-
-        # -------- 2) Meta tags: og:price, product:price, itemprop="price" --------
-        def find_meta(content_html, key, attr="property"):
-            rgx = rf'<meta[^>]+{attr}=["\']{_re.escape(key)}["\'][^>]*content=["\']([^"\']+)["\']'
-            m = _re.search(rgx, content_html, flags=_re.I)
-            return m.group(1).strip() if m else None
-
-        price = (
-            find_meta(html, "og:price:amount", "property")
-            or find_meta(html, "product:price:amount", "property")
-            or find_meta(html, "price", "name")
-            or find_meta(html, "price", "itemprop")
-        )
-
-        currency = (
-            find_meta(html, "og:price:currency", "property")
-            or find_meta(html, "product:price:currency", "property")
-            or find_meta(html, "priceCurrency", "itemprop")
-            or find_meta(html, "currency", "name")
-        )
-
-        # -------- 3) Non-meta tags with itemprop="price" and content= --------
-        if not price:
-            m = _re.search(
-                r'<[^>]+itemprop=["\']price["\'][^>]+content=["\']([^"\']+)["\']',
-                html, flags=_re.I
-            )
-            if m:
-                price = m.group(1).strip()
-
-        # -------- 4) Last resort: Look for visible text prices --------
-        if not price:
-            m = _re.search(
-                r'<[^>]+itemprop=["\']price["\'][^>]*>([^<£€$]*[£€$]?\s?\d+[.,]?\d*)',
-                html, flags=_re.I
-            )
-            if m:
-                price = m.group(1).strip()
-
-        if price:
-            return _fmt_price(price, currency)
-
+        meta = timed_fetch("price", link, timeout=6)
+        if meta["price"]:
+            return format_price(meta["price"], meta["currency"])
         return None
     except Exception:
         return None
@@ -233,175 +275,585 @@ def try_fetch_price_from_structured_data(link: str):
 def try_fetch_image_url(link: str):
     """
     Try to fetch a product image URL from:
+      0) retailer-specific rules (see retailers.py)
       1) <meta property="og:image"> / <meta name="twitter:image"> / twitter:image:src
       2) JSON-LD Product.image (string or list)
       3) Fallback: largest <img> by width*height, excluding sprites/logos/icons
     Returns an absolute URL or None.
     """
     try:
-        resp = requests.get(link, timeout=8, headers={"User-Agent": "Mozilla/5.0 (ImageFetcher/1.0)"})
-        resp.raise_for_status()
-        html = resp.text
-        soup = BeautifulSoup(html, "html.parser")
-
-        def abs_url(u: str):
-            try:
-                return urljoin(link, u.strip())
-            except Exception:
-                return None
-
-        # 1) Open Graph / Twitter Card
-        meta_keys = [
-            ("property", "og:image"),
-            ("name", "twitter:image"),
-            ("name", "twitter:image:src"),
-        ]
-        for attr, key in meta_keys:
-            tag = soup.find("meta", attrs={attr: key})
-            if tag and tag.get("content"):
-                u = abs_url(tag["content"])
-                if u:
-                    return u
-
-        # 2) JSON-LD Product.image
-        for script in soup.find_all("script", attrs={"type": "application/ld+json"}):
-            try:
-                data = pyjson.loads(script.string or script.text or "")
-            except Exception:
-                continue
-            nodes = data if isinstance(data, list) else [data]
-            for node in nodes:
-                if not isinstance(node, dict):
-                    continue
-                # Accept Product nodes or anything with "image"
-                if "image" in node:
-                    img = node["image"]
-                    candidates = img if isinstance(img, list) else [img]
-                    for c in candidates:
-                        if isinstance(c, str):
-                            u = abs_url(c)
-                            if u:
-                                return u
-
-        # 3) Largest <img>
-        def score_img(tag):
-            # Filter out obvious non-product images
-            src = (tag.get("src") or "").lower()
-            cls = " ".join(tag.get("class", [])).lower()
-            if any(x in src for x in ["sprite", "logo", "icon", "favicon", "placeholder"]):
-                return -1
-            if any(x in cls for x in ["sprite", "logo", "icon", "avatar"]):
-                return -1
-
-            # Prefer bigger images by width*height
-            def to_int(v):
-                try:
-                    return int(re.sub(r"[^0-9]", "", str(v)))
-                except Exception:
-                    return 0
-
-            w = to_int(tag.get("width") or tag.get("data-width") or tag.get("data-image-width"))
-            h = to_int(tag.get("height") or tag.get("data-height") or tag.get("data-image-height"))
-
-            # If no dims, give a small base score
-            if w == 0 or h == 0:
-                return 100
-            return w * h
-
-        best = None
-        best_score = -1
-        for img in soup.find_all("img"):
-            src = img.get("src")
-            if not src:
-                continue
-            s = score_img(img)
-            if s > best_score:
-                best = src
-                best_score = s
-
-        if best:
-            u = abs_url(best)
-            if u:
-                return u
-
-        return None
+        return timed_fetch("image", link, timeout=8)["image"]
     except Exception:
         return None
 
 def load_products():
-    if not DATA_FILE.exists():
-        return []
-    with open(DATA_FILE, "r") as f:
-        products = json.load(f)
+    # Cached in memory; only re-parsed when products.json changes on disk
+    with metrics.timer("store_seconds", op="load_products"):
+        return store.all()
+
+price_history = LocalProxy(lambda: current_registry().price_history)
+
+def run_price_refresh(force=False, workers=None):
+    registry = current_registry()
+    summary = refresh_prices(
+        registry.store,
+        try_fetch_price_from_structured_data,
+        history=registry.price_history,
+        min_age=timedelta(0) if force else timedelta(hours=float(os.getenv("PRICE_REFRESH_MIN_AGE_HOURS", 12))),
+        max_workers=workers or int(os.getenv("PRICE_REFRESH_WORKERS", 8)),
+        per_host=int(os.getenv("PRICE_REFRESH_PER_HOST", 2)),
+        delay=float(os.getenv("PRICE_REFRESH_DELAY", 1.0)),
+    )
+    if summary["updated"]:
+        catalog_changed()
+    notify_price_drops(summary["drops"])
+    return summary
+
+def enrich_import_item(item):
+    """Product for a bulk-imported link: missing fields come from the retailer's page, fetched and parsed once."""
+    link = item["link"]
+    meta = {}
+    if not (item.get("price") and item.get("image") and item.get("name")):
+        try:
+            meta = timed_fetch("price", link, timeout=8, label="import")
+        except Exception:
+            pass
+    price = format_price(meta["price"], meta["currency"]) if meta.get("price") else None
+    return new_product(item, retailer=guess_retailer_from_url(link), price=price, image=meta.get("image"),
+                       name=meta.get("name"))
+
+def run_import(lines):
+    """Bulk import (see bulk_import.py); yields one progress line per item, then a summary."""
+    registry = current_registry()
+    saved = []
+    fetched = set()  # ids whose price came from the retailer's page rather than the upload
+
+    def enrich(item):
+        p = enrich_import_item(item)
+        if p["price"] and not item.get("price"):
+            fetched.add(p["id"])
+        return p
+
+    def on_saved(products):
+        saved.extend(products)
+        catalog_changed(*(p["id"] for p in products))
+        # Only prices actually seen on the retailer's page are observations
+        registry.price_history.record_many((p["id"], p["price"], None) for p in products if p["id"] in fetched)
+        for p in products:
+            thumbnails.prewarm(p["image"])
+
+    events = import_items(
+        read_items(lines),
+        registry.store,
+        enrich,
+        max_workers=int(os.getenv("IMPORT_WORKERS", 8)),
+        per_host=int(os.getenv("IMPORT_PER_HOST", 4)),
+        on_saved=on_saved,
+    )
+    n = 0
+    try:
+        for ev in events:
+            item = ev.get("item") or {}
+            if ev["status"] == "done":
+                c = ev["counts"]
+                yield (f"Done: {c['added']} added, {c['duplicate']} already on the list, "
+                       f"{c['skipped']} skipped, {c['failed']} failed.\n")
+                return
+            n += 1
+            line = f"{n:>4} {ev['status']:<9} {item.get('name') or item.get('link') or item}"
+            if ev["status"] == "added" and (item.get("retailer") or item.get("price")):
+                line += f" ({', '.join(v for v in (item.get('retailer'), item.get('price')) if v)})"
+            if ev.get("error"):
+                line += f": {ev['error']}"
+            yield line + "\n"
+    except ValueError as e:
+        # Bad JSON: the items read before it are kept
+        yield f"Import stopped, {len(saved)} items saved before it: {e}\n"
+
+def refresh_all_registries(app):
+    """The PRICE_REFRESH_INTERVAL job: run_price_refresh() for the default registry, then every other one on disk."""
+    summaries = {}
+    for slug in [None, *registries.slugs()]:
+        try:
+            with app.app_context(), use_registry(slug):
+                summaries[slug] = run_price_refresh()
+        except Exception:
+            # one broken registry shouldn't keep the others from being refreshed
+            app.logger.exception("price refresh failed for registry %s", slug or "(default)")
+    return summaries
+
+# Optional in-process refresh every PRICE_REFRESH_INTERVAL hours (0 = off)
+price_refresh_scheduler = PriceRefreshScheduler(
+    None,  # refresh_all_registries, bound to the app when the blueprint is registered
+    interval=float(os.getenv("PRICE_REFRESH_INTERVAL", 0)) * 3600,
+    lock_path=BASE_DIR / "data/price_refresh.lock",
+)
 
-    # Normalise new keys for older data
-    for p in products:
-        p.setdefault("visible", True)
-        p.setdefault("reserved", False)
+@bp.record_once
+def bind_price_refresh(state):
+    # The job runs on its own thread, outside any request: it needs the app to select each registry
+    price_refresh_scheduler.job = partial(refresh_all_registries, state.app)
+
+@bp.before_app_request
+def select_registry():
+    slug = request.environ.get(ENVIRON_KEY)
+    if slug is not None:
+        registry = registries.get(slug)
+        if registry is None:
+            abort(404)
+        g.registry = registry
+
+@bp.before_app_request
+def start_background_jobs():
+    price_refresh_scheduler.start()
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if slow_requests:
+        slow_requests.begin()
+
+@bp.cli.command("import-products")
+@click.argument("source", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--registry", "slug", default=None, help="Import into this registry instead of the default list.")
+def import_products_command(source, slug):
+    """Bulk import gift links from a CSV, JSON or URL-list file ("-" for stdin)."""
+    with use_registry(slug):
+        for line in run_import(source):
+            print(line, end="", flush=True)
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or "unmatched"
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - started,
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+    if slow_requests and slow_requests.end(f"{request.method} {request.full_path.rstrip('?')} -> {response.status_code}"):
+        metrics.inc("slow_requests_total", endpoint=endpoint)
+    metrics.flush()
+    return response
+
+# Public page order is reshuffled once per bucket rather than per request,
+# so repeat views within a bucket can be answered with 304 Not Modified
+SHUFFLE_BUCKET_SECONDS = int(os.getenv("SHUFFLE_BUCKET_SECONDS", 300))
+
+# Cards per page on / and /admin (0 = everything on one page)
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 60))
+
+def catalog_index():
+    """Search/filter/sort indexes of this registry, brought up to date with store.changes()."""
+    registry = current_registry()
+    registry.index.sync(registry.store)
+    return registry.index
+
+def browse_args():
+    """Search, filter and sort from the query string: ?q=&retailer=&min=&max=&sort= (bad values are ignored)."""
+    def price(name):
+        try:
+            v = float(request.args.get(name, "").replace("£", "").replace(",", "").strip())
+        except ValueError:
+            return None
+        return v if v >= 0 else None
+
+    sort = request.args.get("sort", "")
+    return {
+        "text": request.args.get("q", "").strip(),
+        "retailer": request.args.get("retailer", "").strip(),
+        "min_price": price("min"),
+        "max_price": price("max"),
+        "sort": sort if sort in SORTS else "",
+    }
+
+def browse(*groups, include_hidden=False):
+    """
+    Products for this page of a browsable list: each group (already in
+    display order) is filtered and sorted on its own, then they're joined, so
+    e.g. purchased gifts stay after the rest. The shop menu lists shops of
+    hidden products only with `include_hidden` (the admin list).
+    Returns (products, browse info for the template).
+    """
+    args = browse_args()
+    filtered = any(v not in ("", None) for v in args.values())
+    index = catalog_index()
+    products = [p for group in groups for p in (index.query(group, **args) if filtered else group)]
+    page_products, page, pages = paginate(products, request.args.get("page", 1, type=int), PAGE_SIZE)
+
+    def page_url(n):
+        query = {k: v for k, v in request.args.items() if k in ("q", "retailer", "min", "max", "sort") and v}
+        return prefixed_url_for(request.endpoint, **query, **({"page": n} if n > 1 else {}))
+
+    return page_products, {
+        "q": args["text"],
+        "retailer": args["retailer"],
+        "min": request.args.get("min", ""),
+        "max": request.args.get("max", ""),
+        "sort": args["sort"],
+        "filtered": filtered,
+        "retailers": index.retailers(include_hidden),
+        "total": len(products),
+        "page": page,
+        "pages": pages,
+        "page_url": page_url,
+        "clear_url": prefixed_url_for(request.endpoint),
+    }
+
+_fingerprints = {}
+
+def file_fingerprint(path: Path) -> str:
+    """Short content hash of a file, recomputed only when its mtime changes."""
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return ""
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    digest = hashlib.md5(path.read_bytes()).hexdigest()[:12]
+    _fingerprints[path] = (mtime, digest)
+    return digest
+
+_TEMPLATE_ASSET_RE = re.compile(r"""fingerprinted\(\s*['"]([^'"]+)['"]\s*\)""")
+_template_assets = {}  # template path -> (its fingerprint, static files it passes to fingerprinted())
+
+def page_fingerprints(template_folder, static_folder):
+    """
+    Fingerprints of every template and of every static file a template
+    passes to fingerprinted(), for the ETags of rendered pages: a change to
+    any of them changes the HTML.
+    """
+    out = []
+    for path in sorted(Path(template_folder).glob("*.html")):
+        v = file_fingerprint(path)
+        cached = _template_assets.get(path)
+        if not cached or cached[0] != v:
+            cached = _template_assets[path] = (v, sorted(set(_TEMPLATE_ASSET_RE.findall(path.read_text()))))
+        out.append(v)
+        out.extend(file_fingerprint(Path(static_folder) / name) for name in cached[1])
+    return out
+
+# Resized copies of product images, served from /img
+thumbnails = ThumbnailCache(
+    BASE_DIR / "data/thumbs",
+    widths=tuple(int(w) for w in os.getenv("THUMB_WIDTHS", "240,480").split(",")),
+    max_bytes=int(os.getenv("THUMB_CACHE_MAX_BYTES", 100 * 1024 * 1024)),
+)
 
-    return products
+@bp.app_context_processor
+def static_helpers():
+    def fingerprinted(filename):
+        # tailwind.css -> tailwind.css?v=<hash>, cached for a year by the browser
+        v = file_fingerprint(Path(current_app.static_folder) / filename)
+        return f"{filename}?v={v}" if v else filename
+
+    def thumb_url(item, width):
+        # "" means no thumbnail: hotlink item.image as before
+        if not (thumbnails.enabled and item.get("image")):
+            return ""
+        v = url_key(item["image"])[:12]
+        return prefixed_url_for("main.product_image", product_id=item["id"], width=width, v=v)
+
+    def thumb_srcset(item):
+        return ", ".join(f"{thumb_url(item, w)} {w}w" for w in thumbnails.widths)
+
+    def price_trend(item):
+        # For the admin sparkline; None until a price has been seen twice
+        summary = price_history.summary(item["id"])
+        if not summary or summary["count"] < 2:
+            return None
+        return dict(
+            summary,
+            sparkline=sparkline_points(summary["points"]),
+            low_text=format_money(summary["low"][1], summary["low"][2]),
+            high_text=format_money(summary["high"][1], summary["high"][2]),
+        )
 
-def save_products(products):
-    with open(DATA_FILE, "w") as f:
-        json.dump(products, f, indent=2)
+    return {
+        "price_trend": price_trend,
+        "registry": current_registry(),
+        "route_prefix": current_app.config["ROUTE_PREFIX"],
+        "url_prefix": current_app.config["URL_PREFIX"],
+        "fingerprinted": fingerprinted,
+        "thumb_url": thumb_url,
+        "thumb_srcset": thumb_srcset,
+        "thumb_widths": thumbnails.widths,
+    }
+
+def prefixed_url_for(endpoint, **values):
+    """url_for() plus the path prefix the Pi's reverse proxy strips (APP_ENV=pi)."""
+    return current_app.config["ROUTE_PREFIX"] + url_for(endpoint, **values)
 
 def is_logged_in():
-    return session.get("logged_in", False)
+    """Logged in as admin of the current registry."""
+    return session.get(current_registry().session_key, False)
+
+# What guests' clients get to see of a product
+PUBLIC_FIELDS = ("id", "name", "link", "image", "price", "price_value", "currency", "retailer", "purchased", "rev")
+
+def _public_product(p):
+    out = {k: p.get(k) for k in PUBLIC_FIELDS}
+    out["purchased"] = bool(out["purchased"])
+    out["rev"] = out["rev"] or 0
+    return out
+
+def public_changes(changes):
+    """store.changes() as guests see it: visible products only, hidden ones count as deleted."""
+    products = [_public_product(p) for p in changes["products"] if p.get("visible", True)]
+    deleted = changes["deleted"]
+    if not changes["full"]:
+        # A product that was hidden is gone as far as guests are concerned
+        deleted = deleted + [p["id"] for p in changes["products"] if not p.get("visible", True)]
+    return {"version": changes["version"], "full": changes["full"], "products": products, "deleted": deleted}
+
+def _live_payload(changes):
+    payload = public_changes(changes)
+    if not (payload["full"] or payload["products"] or payload["deleted"]):
+        return None
+    return payload
+
+# Live updates for open public pages (Server-Sent Events on /events)
+LIVE_UPDATES = os.getenv("LIVE_UPDATES", "true").lower() == "true"
+# Every open page holds one of the worker's gunicorn threads (THREADS, which `make serve` passes
+# as --threads), so live updates only get some of them and ordinary requests always find one free
+SERVER_THREADS = int(os.getenv("THREADS", 32))
+SSE_MAX_CLIENTS = max(1, min(int(os.getenv("SSE_MAX_CLIENTS", SERVER_THREADS * 3 // 4)), SERVER_THREADS - 1))
+sse_slots = threading.BoundedSemaphore(SSE_MAX_CLIENTS)  # per worker, shared by all registries
+
+def open_registry(slug, settings, data_dir, data_file=None, sqlite_file=None):
+    """A Registry over the files in data_dir: catalog, price history and live-update sockets."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    store = open_store(
+        settings.get("backend", DATA_BACKEND),
+        data_file or data_dir / "products.json",
+        sqlite_file or data_dir / "products.db",
+        compact_bytes=int(os.getenv("JOURNAL_COMPACT_BYTES", 256 * 1024)),
+        timer=lambda op: metrics.timer("store_seconds", op=op),
+    )
+    live_updates = EventHub(
+        store,
+        data_dir / "events",
+        render=_live_payload,
+        heartbeat=float(os.getenv("SSE_HEARTBEAT_SECONDS", 15)),
+        slots=sse_slots,
+    )
+    history = PriceHistory(
+        data_dir / "price_history",
+        raw_days=int(os.getenv("PRICE_HISTORY_RAW_DAYS", 30)),
+        drop_percent=float(os.getenv("PRICE_DROP_PERCENT", 10)),
+        legacy_path=data_dir / "price_history.jsonl",
+    )
+    return Registry(slug, settings, store, CatalogIndex(), live_updates, history)
+
+# The original list, at / as before; more registries at /r/<slug>/ (`flask create-registry`)
+default_registry = open_registry(
+    None,
+    {"admin_username": ADMIN_USERNAME, "admin_password": ADMIN_PASSWORD, "backend": DATA_BACKEND},
+    BASE_DIR / "data",
+    data_file=DATA_FILE,
+    sqlite_file=SQLITE_FILE,
+)
+REGISTRIES_DIR = Path(os.getenv("REGISTRIES_DIR") or BASE_DIR / "data/registries")
+registries = RegistryPool(default_registry, REGISTRIES_DIR, open_registry,
+                          max_open=int(os.getenv("MAX_OPEN_REGISTRIES", 16)))
+
+def current_registry():
+    """Registry of the current request (or CLI --registry); the default one otherwise."""
+    if has_app_context():
+        return g.get("registry") or default_registry
+    return default_registry
+
+@contextmanager
+def use_registry(slug):
+    """Run CLI code against registry `slug` (None = default)."""
+    registry = registries.get(slug)
+    if registry is None:
+        raise click.ClickException(f"No registry {slug!r} in {REGISTRIES_DIR}")
+    g.registry = registry
+    try:
+        yield registry
+    finally:
+        g.pop("registry", None)
+
+live_updates = LocalProxy(lambda: current_registry().live_updates)
+
+@metrics.add_collector
+def _component_metrics():
+    # Counters kept by the components themselves, read when metrics are snapshotted
+    for key, value in page_cache.stats().items():
+        yield f"page_cache_{key}", {}, value
+    yield "telegram_messages", {"outcome": "sent"}, telegram.sent
+    yield "telegram_messages", {"outcome": "failed"}, telegram.failed
+    yield "telegram_messages", {"outcome": "dropped"}, telegram.dropped
+    open_registries = registries.open_registries()
+    yield "live_update_clients", {}, sum(r.live_updates.clients for r in open_registries)
+    yield "registries_open", {}, len(open_registries)
+    for key, value in fragments.stats().items():
+        yield f"fragment_cache_{key}", {}, value
+    for key, value in compressor.stats().items():
+        yield f"compression_{key}", {}, value
+
+for _name in ("hits", "misses", "revalidated", "evictions", "bytes_saved", "early_stops", "capped"):
+    metrics.describe(f"page_cache_{_name}", "counter", f"Retailer page cache {_name.replace('_', ' ')}.")
+metrics.describe("telegram_messages", "counter", "Telegram messages by outcome.")
+for _name in ("hits", "misses", "evictions"):
+    metrics.describe(f"fragment_cache_{_name}", "counter", f"Rendered product card cache {_name}.")
+metrics.describe("fragment_cache_entries", "gauge", "Rendered product cards held by the cache.")
+metrics.describe("registries_open", "gauge", "Registries loaded in this worker (including the default).")
+for _name in ("hits", "misses"):
+    metrics.describe(f"compression_{_name}", "counter", f"Compressed response cache {_name}.")
+metrics.describe("compression_streamed", "counter", "Streamed responses compressed on the fly.")
+metrics.describe("compression_bytes_in", "counter", "Response bytes before compression.")
+metrics.describe("compression_bytes_out", "counter", "Response bytes after compression.")
+metrics.describe("compression_cached_bytes", "gauge", "Compressed bodies held for reuse.")
+
+# Rendered product cards for / and /admin (0 = render every card on every request)
+fragments = FragmentCache(max_entries=int(os.getenv("FRAGMENT_CACHE_ITEMS", 20000)))
+
+def render_fragments(kind, template_name, products):
+    """Each product through a one-product template, from the fragment cache where possible."""
+    tmpl = current_app.jinja_env.get_template(template_name)
+    ctx = {}
+    current_app.update_template_context(ctx)
+    # Everything besides the product that ends up in the HTML
+    salt = (
+        file_fingerprint(Path(current_app.template_folder) / template_name),
+        current_app.config["ROUTE_PREFIX"],
+        thumbnails.enabled,
+        thumbnails.widths,
+    )
+    # Links in a card depend on the registry it's rendered for
+    kind = (current_registry().slug, kind)
+    html = fragments.render_all(kind, salt, products, lambda p: tmpl.render(ctx, item=p))
+    return Markup("".join(html))
 
-# Routes
-@app.route("/")
-def index():
-    products = load_products()
+def catalog_changed(*product_ids):
+    """Call after every write, with the ids it touched: wakes the live-update hub in every worker."""
+    fragments.invalidate(*product_ids)
+    if LIVE_UPDATES:
+        live_updates.publish()
 
-    html_prefix = "/baby/baby" if os.environ.get("APP_ENV") == "pi" else ""
-    route_prefix = "/baby" if os.environ.get("APP_ENV") == "pi" else ""
+# Write paths shared by the HTML routes and the JSON API
 
-    # Only show visible items
-    visible_products = [p for p in products if p.get("visible", True)]
+_IDEMPOTENCY_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
 
-    unpurchased = [p for p in visible_products if not p.get("purchased", False)]
-    purchased = [p for p in visible_products if p.get("purchased", False)]
+def idempotency_key():
+    """Client-chosen key for a mark (form field or Idempotency-Key header); None if missing or malformed."""
+    key = request.form.get("idempotency_key") or request.headers.get("Idempotency-Key") or ""
+    return key if _IDEMPOTENCY_KEY_RE.match(key) else None
 
-    # Randomize unpurchased order every page load
-    random.shuffle(unpurchased)
+def mark_product_purchased(product_id, key=None):
+    """
+    Returns (product, newly_marked); product is None if it doesn't exist.
+    A compare-and-set under the store's write lock: of several guests
+    marking the same item at once exactly one wins and notifies. A retry
+    carrying the idempotency `key` of the mark that won (a double-tap, a
+    resent form) gets the same answer again, without a second notification.
+    """
+    def mark(p):
+        if p.get("purchased"):
+            return None
+        p["purchased"] = True
+        p["purchased_at"] = datetime.utcnow().isoformat()
+        if key:
+            p["purchase_key"] = key
+        return p
+
+    p, marked = store.update(product_id, mark)
+    if not p:
+        return None, False
+    if not marked:
+        return p, bool(key) and p.get("purchase_key") == key
+    catalog_changed(product_id)
+    # 🔔 send Telegram notification (best-effort)
+    notify_purchase(p)
+    return p, True
+
+def clear_product_flags(product_id):
+    def clear(p):
+        p["purchased"] = False
+        p.pop("purchased_at", None)
+        p.pop("purchase_key", None)
+        return p
+
+    p, changed = store.update(product_id, clear)
+    if changed:
+        catalog_changed(product_id)
+    return p
 
-    ordered = unpurchased + purchased
+def delete_product_and_history(product_id):
+    store.delete(product_id)
+    price_history.delete(product_id)
+    catalog_changed(product_id)
 
-    return render_template(
+# Routes
+@bp.route("/")
+def index():
+    seed = int(time.time() // SHUFFLE_BUCKET_SECONDS)
+
+    # A page carrying a flash message is one-off; everything else can be revalidated
+    cacheable = "_flashes" not in session
+    if cacheable:
+        etag = hashlib.md5("|".join([
+            current_registry().slug or "",
+            store.cache_key(),
+            str(seed),
+            current_app.config["URL_PREFIX"],
+            request.query_string.decode(),
+            *page_fingerprints(current_app.template_folder, current_app.static_folder),
+        ]).encode()).hexdigest()
+        # Weak, on the 304 as on the 200: gzip, brotli and identity bodies all carry this one tag
+        if request.if_none_match.contains_weak(etag):
+            resp = make_response("", 304)
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+
+    # Only show visible items, unpurchased first
+    unpurchased, purchased = store.public_split()
+
+    # Randomize unpurchased order (stable within a shuffle bucket)
+    random.Random(seed).shuffle(unpurchased)
+
+    # Search/filter/sort/page (?q=&retailer=&min=&max=&sort=&page=), purchased gifts still last
+    ordered, browse_info = browse(unpurchased, purchased)
+
+    resp = make_response(render_template(
         "index.html",
-        route_prefix=route_prefix,
-        url_prefix=html_prefix,
-        products=ordered
-    )
-
-@app.route("/admin", methods=["GET", "POST"])
+        cards=render_fragments("card", "_product_card.html", ordered),
+        browse=browse_info,
+        live_updates=LIVE_UPDATES,
+        catalog_version=store.version,
+    ))
+    if cacheable:
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@bp.route("/admin", methods=["GET", "POST"])
 def admin():
-    html_prefix = "/baby/baby" if os.environ.get("APP_ENV") == "pi" else ""
-    route_prefix = "/baby" if os.environ.get("APP_ENV") == "pi" else ""
-    products = load_products()
-
     if request.method == "POST":
         # --- Login ---
         if "login" in request.form:
             username = request.form.get("username")
             password = request.form.get("password")
-            if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
-                session["logged_in"] = True
+            if current_registry().check_login(username, password):
+                session[current_registry().session_key] = True
                 flash("Logged in successfully.", "info")
             else:
                 flash("Invalid credentials.", "danger")
-            return redirect(route_prefix + url_for("admin"))
+            return redirect(prefixed_url_for("main.admin"))
 
         # --- Logout ---
         if "logout" in request.form:
-            session.pop("logged_in", None)
+            session.pop(current_registry().session_key, None)
             flash("Logged out.", "info")
-            return redirect(route_prefix + url_for("admin"))
+            return redirect(prefixed_url_for("main.admin"))
 
         # --- Require auth for changes ---
         if not is_logged_in():
             flash("Please log in to manage items.", "warning")
-            return redirect(route_prefix + url_for("admin"))
+            return redirect(prefixed_url_for("main.admin"))
 
         # --- Common fields ---
         name = (request.form.get("name") or "").strip()
@@ -417,10 +869,11 @@ def admin():
                 retailer = guessed
 
         # --- Fetch price when button pressed ---
+        observed_price = None  # goes into the price history once the item is saved
         if "fetch_price" in request.form and link:
             fetched = try_fetch_price_from_structured_data(link)
             if fetched:
-                price = fetched
+                price = observed_price = fetched
                 flash("Price fetched from page.", "info")
             else:
                 flash("Couldn’t find a price on that page.", "warning")
@@ -442,56 +895,54 @@ def admin():
 
         # Inside the POST handling of /admin
         if "toggle_id" in request.form:
-            pid = request.form["toggle_id"]
-            for p in products:
-                if p["id"] == pid:
-                    current = p.get("visible", True)
-                    p["visible"] = not current
-                    flash(f"Visibility toggled: {p['name']} is now {'shown' if p['visible'] else 'hidden'}.", "info")
-                    break
-            save_products(products)
-            return redirect(route_prefix + url_for("admin"))
+            # update(), not get() + put(): a guest marking it meanwhile mustn't be undone
+            p, _ = store.update(request.form["toggle_id"], lambda p: dict(p, visible=not p.get("visible", True)))
+            if p:
+                catalog_changed(p["id"])
+                flash(f"Visibility toggled: {p['name']} is now {'shown' if p['visible'] else 'hidden'}.", "info")
+            return redirect(prefixed_url_for("main.admin"))
 
         # --- Duplicate item ---
         if "duplicate_id" in request.form:
-            pid = request.form["duplicate_id"]
-            for p in products:
-                if p.get("id") == pid:
-                    new_item = {
-                        "id": str(uuid4()),
-                        "name": p.get("name", ""),
-                        "link": p.get("link", ""),
-                        "image": p.get("image", ""),
-                        "price": p.get("price", ""),
-                        "retailer": p.get("retailer", ""),
-                        "visible": p.get("visible", True),
-                        "purchased": False,
-                        "reserved": False,
-                    }
-                    # optional: carry price_checked_at; comment out to skip
-                    if p.get("price_checked_at"):
-                        new_item["price_checked_at"] = p["price_checked_at"]
-
-                    products.append(new_item)
-                    save_products(products)
-                    flash(f"Duplicated '{p.get('name','Item')}'.", "info")
-                    # jump straight into editing the new copy
-                    return redirect(route_prefix + url_for("admin") + f"?edit={new_item['id']}")
+            p = store.get(request.form["duplicate_id"])
+            if p:
+                new_item = {
+                    "id": str(uuid4()),
+                    "name": p.get("name", ""),
+                    "link": p.get("link", ""),
+                    "image": p.get("image", ""),
+                    "price": p.get("price", ""),
+                    "retailer": p.get("retailer", ""),
+                    "visible": p.get("visible", True),
+                    "purchased": False,
+                    "reserved": False,
+                }
+                # optional: carry price_checked_at; comment out to skip
+                if p.get("price_checked_at"):
+                    new_item["price_checked_at"] = p["price_checked_at"]
+
+                store.put(new_item)
+                catalog_changed(new_item["id"])
+                thumbnails.prewarm(new_item["image"])
+                flash(f"Duplicated '{p.get('name','Item')}'.", "info")
+                # jump straight into editing the new copy
+                return redirect(prefixed_url_for("main.admin") + f"?edit={new_item['id']}")
 
         # --- Edit existing item ---
         if "edit_id" in request.form:
-            edit_id = request.form["edit_id"]
-            for p in products:
-                if p["id"] == edit_id:
-                    p["name"] = name
-                    p["link"] = link
-                    p["image"] = image
-                    p["price"] = price
-                    p["retailer"] = retailer
-                    if price:
-                        p["price_checked_at"] = datetime.utcnow().isoformat()
-                    flash("Product updated.", "info")
-                    break
+            def edit(p):
+                p.update(name=name, link=link, image=image, price=price, retailer=retailer)
+                if price:
+                    p["price_checked_at"] = datetime.utcnow().isoformat()
+                return p
+
+            if observed_price and store.get(request.form["edit_id"]):
+                price_history.record(request.form["edit_id"], observed_price)
+            p, _ = store.update(request.form["edit_id"], edit)
+            if p:
+                catalog_changed(p["id"])
+                thumbnails.prewarm(image)
+                flash("Product updated.", "info")
 
         # --- Add a new item ---
         else:
@@ -508,76 +959,292 @@ def admin():
             }
             if price:
                 new_item["price_checked_at"] = datetime.utcnow().isoformat()
-            products.append(new_item)
+            if observed_price:
+                price_history.record(product_id, observed_price)
+            store.put(new_item)
+            catalog_changed(new_item["id"])
+            thumbnails.prewarm(image)
             flash("Product added.", "info")
 
-        save_products(products)
-        return redirect(route_prefix + url_for("admin"))
+        return redirect(prefixed_url_for("main.admin"))
 
+    if not is_logged_in():
+        return render_template("admin.html", logged_in=False)
+    products, browse_info = browse(load_products(), include_hidden=True)
     return render_template(
         "admin.html",
-        route_prefix=route_prefix,
-        url_prefix=html_prefix,
-        products=products,
-        logged_in=is_logged_in()
+        editing=store.get(request.args["edit"]) if request.args.get("edit") else None,
+        rows=render_fragments("admin", "_admin_product.html", products),
+        browse=browse_info,
+        logged_in=True,
+        page_cache_stats=page_cache.stats()
     )
 
-@app.route("/mark/<product_id>", methods=["POST"])
+@bp.route("/mark/<product_id>", methods=["POST"])
 def mark_purchased(product_id):
-    route_prefix = "/baby" if os.environ.get("APP_ENV") == "pi" else ""
-    products = load_products()
-    for p in products:
-        if p["id"] == product_id:
-
-            if p.get("purchased"):
-                flash(f"'{p['name']}' was already marked as purchased.", "info")
-            else:
-                p["purchased"] = True
-                p["purchased_at"] = datetime.utcnow().isoformat()
-                flash(f"Thanks! '{p['name']}' marked as purchased.", "success")
-                # 🔔 send Telegram notification (best-effort)
-                notify_purchase(p)
-            break
+    p, marked = mark_product_purchased(product_id, idempotency_key())
+    if p:
+        if marked:
+            flash(f"Thanks! '{p['name']}' marked as purchased.", "success")
+        else:
+            flash(f"'{p['name']}' was already marked as purchased.", "info")
 
-    save_products(products)
-    return redirect(route_prefix + url_for("index"))
+    return redirect(prefixed_url_for("main.index"))
 
-@app.route("/delete/<product_id>", methods=["POST"])
+@bp.route("/delete/<product_id>", methods=["POST"])
 def delete_product(product_id):
-    route_prefix = "/baby" if os.environ.get("APP_ENV") == "pi" else ""
     if not is_logged_in():
         flash("Please log in to delete items.", "warning")
-        return redirect(route_prefix + url_for("admin"))
+        return redirect(prefixed_url_for("main.admin"))
 
-    products = load_products()
-    products = [p for p in products if p["id"] != product_id]
-    save_products(products)
+    delete_product_and_history(product_id)
     flash("Product deleted.", "warning")
-    return redirect(route_prefix + url_for("admin"))
+    return redirect(prefixed_url_for("main.admin"))
 
-@app.route("/clear/<product_id>", methods=["POST"])
+@bp.route("/admin/import", methods=["POST"])
+def import_products():
+    """Bulk import from an uploaded file or pasted text; progress is streamed back as plain text."""
+    if not is_logged_in():
+        flash("Please log in to import items.", "warning")
+        return redirect(prefixed_url_for("main.admin"))
+
+    upload = request.files.get("file")
+    if upload and upload.filename:
+        # Flask closes the upload when this view returns, before the response is streamed
+        spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        shutil.copyfileobj(upload.stream, spool)
+        spool.seek(0)
+        lines = io.TextIOWrapper(spool, encoding="utf-8-sig", errors="replace", newline="")
+    else:
+        lines = io.StringIO(request.form.get("text", ""), newline="")
+    resp = Response(stream_with_context(run_import(lines)), mimetype="text/plain")
+    resp.headers["X-Accel-Buffering"] = "no"  # show progress as it happens, not at the end
+    return resp
+
+@bp.route("/clear/<product_id>", methods=["POST"])
 def clear_flags(product_id):
-    route_prefix = "/baby" if os.environ.get("APP_ENV") == "pi" else ""
     if not is_logged_in():
         flash("Please log in to clear product status.", "warning")
-        return redirect(route_prefix + url_for("admin"))
-
-    products = load_products()
-    for p in products:
-        if p["id"] == product_id:
-            p["purchased"] = False
-            p.pop("purchased_at", None)
-            flash(f"Status for '{p['name']}' has been cleared.", "info")
-            break
-    save_products(products)
-    return redirect(route_prefix + url_for("admin"))
-
-@app.after_request
+        return redirect(prefixed_url_for("main.admin"))
+
+    p = clear_product_flags(product_id)
+    if p:
+        flash(f"Status for '{p['name']}' has been cleared.", "info")
+    return redirect(prefixed_url_for("main.admin"))
+
+@bp.route("/img/<product_id>/<int:width>")
+def product_image(product_id, width):
+    """Thumbnail of a product's image; falls back to the original URL if we can't make one."""
+    p = store.get(product_id)
+    if not p or not p.get("image") or width not in thumbnails.widths:
+        abort(404)
+    path = thumbnails.get(p["image"], width)
+    if path is None:
+        return redirect(p["image"])
+    resp = send_file(path, mimetype=thumbnails.mimetype, conditional=True, max_age=None)
+    # The URL carries ?v=<hash of the image URL>, so a changed image gets a new URL
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+# --- JSON API ---
+
+def _api_error(message, status):
+    return jsonify(error=message), status
+
+@bp.route("/api/products")
+def api_products():
+    """
+    Visible products as JSON. With ?since=<version> only what changed after
+    that version is returned; clients keep the returned "version" for next time.
+    If "full" is true the client should replace its list instead of patching it.
+    """
+    resp = jsonify(public_changes(store.changes(request.args.get("since", type=int))))
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@bp.route("/events")
+def live_events():
+    """
+    Server-Sent Events stream of catalog changes (same payload as /api/products?since=).
+    Reconnecting browsers send Last-Event-ID and get what they missed.
+    """
+    if not LIVE_UPDATES:
+        abort(404)
+    if request.method == "HEAD":
+        # Flask adds HEAD to GET routes, but a HEAD response has no body to stream
+        abort(405, valid_methods=["GET"])
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+    sub = live_updates.subscribe(since)
+    if sub is None:
+        # Worker is full; the page just stays as rendered
+        return Response("too many live connections\n", 503, mimetype="text/plain")
+    resp = Response(sub.stream(), mimetype="text/event-stream")
+    # The stream gives its slot back when it ends, but only once it has started; this covers
+    # a client that goes away before the first chunk
+    resp.call_on_close(partial(sub.hub.unsubscribe, sub))
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # don't let nginx hold events back
+    return resp
+
+@bp.route("/api/products/<product_id>/purchase", methods=["POST"])
+def api_mark_purchased(product_id):
+    p, marked = mark_product_purchased(product_id, idempotency_key())
+    if not p:
+        return _api_error("not found", 404)
+    return jsonify(product=_public_product(p), changed=marked, version=store.version)
+
+@bp.route("/api/products/<product_id>/clear", methods=["POST"])
+def api_clear_flags(product_id):
+    if not is_logged_in():
+        return _api_error("login required", 401)
+    p = clear_product_flags(product_id)
+    if not p:
+        return _api_error("not found", 404)
+    return jsonify(product=_public_product(p), version=store.version)
+
+@bp.route("/api/products/<product_id>", methods=["DELETE"])
+def api_delete_product(product_id):
+    if not is_logged_in():
+        return _api_error("login required", 401)
+    if not store.get(product_id):
+        return _api_error("not found", 404)
+    delete_product_and_history(product_id)
+    return jsonify(deleted=product_id, version=store.version)
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics; needs an admin session or the admin credentials as HTTP basic auth."""
+    auth = request.authorization
+    # Server-wide numbers, so only for the default registry's admin
+    if not (session.get(default_registry.session_key) or (auth and default_registry.check_login(auth.username, auth.password))):
+        return Response("login required\n", 401, {"WWW-Authenticate": 'Basic realm="metrics"'}, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.cli.command("migrate-sqlite")
+def migrate_sqlite_command():
+    """Copy data/products.json into the SQLite database (DATA_BACKEND=sqlite)."""
+    count = migrate_json_to_sqlite(DATA_FILE, SQLITE_FILE)
+    print(f"Migrated {count} products to {SQLITE_FILE}")
+
+@bp.cli.command("refresh-prices")
+@click.option("--force", is_flag=True, help="Ignore PRICE_REFRESH_MIN_AGE_HOURS and check everything.")
+@click.option("--workers", type=int, default=None, help="Concurrent fetches (default PRICE_REFRESH_WORKERS).")
+@click.option("--registry", "slug", default=None, help="Refresh this registry instead of the default list.")
+def refresh_prices_command(force, workers, slug):
+    """Re-fetch prices for visible, unpurchased products."""
+    with use_registry(slug):
+        summary = price_refresh_scheduler.run_once(lambda: run_price_refresh(force=force, workers=workers))
+    if summary is None:
+        print("Another refresh is already running.")
+        return
+    print(f"Checked {summary['due']} products: {summary['updated']} updated, "
+          f"{summary['failed']} without a price ({summary['seconds']}s)")
+
+@bp.cli.command("create-registry")
+@click.argument("slug")
+@click.option("--title", default=None, help='Shown instead of "Baby Gift List".')
+@click.option("--admin-username", default="admin", show_default=True)
+@click.option("--admin-password", prompt=True, hide_input=True, confirmation_prompt=True)
+@click.option("--backend", type=click.Choice(["json", "sqlite"]), default=DATA_BACKEND, show_default=True)
+def create_registry_command(slug, title, admin_username, admin_password, backend):
+    """Add a gift list, served at /r/SLUG/ with its own admin login."""
+    settings = {"title": title, "admin_username": admin_username, "admin_password": admin_password, "backend": backend}
+    try:
+        path = create_registry(REGISTRIES_DIR, slug, settings)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Created {path}; the list is at {current_app.config['ROUTE_PREFIX']}/r/{slug}/")
+
+@bp.after_app_request
 def add_no_cache_headers(response):
+    # Fingerprinted static files never change under the same URL
+    if request.endpoint == "static":
+        filename = (request.view_args or {}).get("filename", "")
+        v = request.args.get("v")
+        if v and v == file_fingerprint(Path(current_app.static_folder) / filename):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+    # Views that set their own caching policy (e.g. the ETag'd index) keep it
+    if "Cache-Control" in response.headers:
+        return response
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
     return response
 
+# gzip/brotli for HTML, JSON, CSS and friends (br needs the Brotli package)
+COMPRESSION = os.getenv("COMPRESSION", "true").lower() == "true"
+compressor = Compressor(
+    min_bytes=int(os.getenv("COMPRESS_MIN_BYTES", 1024)),
+    cache_bytes=int(float(os.getenv("COMPRESS_CACHE_MB", 16)) * 1024 * 1024),
+)
+
+@bp.before_app_request
+def serve_precompressed_static():
+    """The .br/.gz sibling written by `make tailwind-build`, when there is a fresh one the client accepts."""
+    if not COMPRESSION or request.endpoint != "static":
+        return None
+    filename = (request.view_args or {}).get("filename", "")
+    path = safe_join(current_app.static_folder, filename)
+    variant = path and compressor.static_variant(path, request.accept_encodings)
+    if not variant:
+        return None
+    sibling, encoding = variant
+    resp = send_file(sibling, mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                     conditional=True, max_age=current_app.get_send_file_max_age(filename))
+    resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+@bp.after_app_request
+def compress_response(response):
+    if COMPRESSION:
+        compressor.compress_response(response, request.accept_encodings, request.script_root + request.path)
+    return response
+
+@bp.cli.command("compress-static")
+def compress_static_command():
+    """Write .gz/.br copies of the static files, served instead of compressing per request."""
+    for path, size, sizes in precompress(current_app.static_folder):
+        packed = ", ".join(f"{enc} {n}" for enc, n in sizes.items()) or "not worth compressing"
+        print(f"{Path(path).relative_to(current_app.static_folder)}: {size} -> {packed}")
+
+def create_app(warm=True):
+    """
+    Build the Flask app. Path prefixes are resolved here, once. With `warm`
+    the catalog is loaded and the templates compiled up front, so under
+    gunicorn --preload every worker starts with them already in memory
+    (background threads are started per worker, on first use).
+    """
+    # On the Pi the app sits behind a proxy at /baby
+    on_pi = os.environ.get("APP_ENV") == "pi"
+    app_prefix = "/baby" if on_pi else ""
+    app = Flask(
+        __name__,
+        static_url_path=f"{app_prefix}/static",
+        static_folder=str(BASE_DIR / "static"),
+        template_folder=str(BASE_DIR / "templates")
+    )
+    app.secret_key = os.getenv("SECRET_KEY", "dev")
+    app.config["APP_PREFIX"] = app_prefix
+    # Prepended to redirects and form actions, and to /static links in templates
+    app.config["ROUTE_PREFIX"] = app_prefix
+    app.config["URL_PREFIX"] = "/baby/baby" if on_pi else ""
+    app.register_blueprint(bp)
+    # /r/<slug>/... serves registry <slug> through the same routes
+    app.wsgi_app = RegistryDispatcher(app.wsgi_app)
+    if slow_requests:
+        slow_requests.log = app.logger
+
+    if warm:
+        catalog_index()
+        for name in ("index.html", "admin.html", "_product_card.html", "_admin_product.html", "_browse.html",
+                     "_pager.html"):
+            app.jinja_env.get_template(name)
+        page_fingerprints(app.template_folder, app.static_folder)
+    return app
+
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0")
+    create_app().run(debug=True, host="0.0.0.0")
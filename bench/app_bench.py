@@ -0,0 +1,237 @@
+"""
+Benchmark: the Flask routes and the retailer fetch paths, against synthetic
+catalogs (bench/catalog.py) and a local stub retailer server
+(bench/stub_server.py) serving the page corpus, so nothing touches the network
+or data/products.json.
+
+Each catalog size runs in a fresh subprocess (cold imports, empty caches) and
+every scenario reports latency percentiles and throughput. Save the JSON from
+one commit with --out and pass it to --compare on the next to spot regressions.
+
+    python -m bench.app_bench [--sizes 100,1000,10000,100000] [--backend json|sqlite]
+                              [--requests N] [--budget SECONDS] [--stub-latency MS]
+                              [--json] [--out FILE] [--compare FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.catalog import write_catalog  # noqa: E402
+from bench.corpus import PAGES_DIR, load_pages  # noqa: E402
+from bench.stub_server import StubRetailerServer  # noqa: E402
+
+DEFAULT_SIZES = "100,1000,10000,100000"
+
+
+def _percentile(sorted_samples, pct):
+    # Nearest-rank
+    k = max(0, min(len(sorted_samples) - 1, round(pct / 100 * len(sorted_samples) + 0.5) - 1))
+    return sorted_samples[k]
+
+
+def measure(scenario, fn, requests, budget, **extra):
+    """Call fn(i) up to `requests` times (at least 3, at most ~`budget` seconds)."""
+    samples, errors = [], 0
+    start = time.perf_counter()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        ok = fn(i)
+        samples.append(time.perf_counter() - t0)
+        if ok is False:
+            errors += 1
+        if time.perf_counter() - start > budget and len(samples) >= 3:
+            break
+    total = time.perf_counter() - start
+    s = sorted(samples)
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    return dict(extra, scenario=scenario, n=len(s), errors=errors,
+                mean_ms=ms(sum(s) / len(s)), p50_ms=ms(_percentile(s, 50)), p90_ms=ms(_percentile(s, 90)),
+                p99_ms=ms(_percentile(s, 99)), max_ms=ms(s[-1]), rps=round(len(s) / total, 1))
+
+
+# --- child: one catalog size in a fresh process ---
+
+def run_size(size, backend, requests, budget, stub_url=None, stub_pages=()):
+    tmp = Path(tempfile.mkdtemp(prefix="bench-app-"))
+    try:
+        return _run_size(tmp, size, backend, requests, budget, stub_url, stub_pages)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _run_size(tmp, size, backend, requests, budget, stub_url, stub_pages):
+    data_file, sqlite_file = tmp / "products.json", tmp / "products.db"
+    products = write_catalog(data_file, size)
+    os.environ.update({
+        "DATA_FILE": str(data_file),
+        "SQLITE_PATH": str(sqlite_file),
+        "DATA_BACKEND": backend,
+        "LIVE_UPDATES": "false",
+        "NOTIFY_ENABLED": "false",
+        "PRICE_REFRESH_INTERVAL": "0",
+        "PAGE_CACHE_TTL": "0",  # every fetch goes to the stub server
+        "PAGE_CACHE_PERSIST": "false",
+        "METRICS_DIR": str(tmp / "metrics"),
+    })
+    from store import migrate_json_to_sqlite, open_store
+    if backend == "sqlite":
+        migrate_json_to_sqlite(data_file, sqlite_file)
+
+    t0 = time.perf_counter()
+    import app as A
+    flask_app = A.create_app()
+    startup_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    client = flask_app.test_client()
+    admin = flask_app.test_client()
+    with admin.session_transaction() as s:
+        s["logged_in"] = True
+
+    def status(resp, *expected):
+        return resp.status_code in expected
+
+    results = [dict(scenario="startup", size=size, n=1, errors=0, mean_ms=startup_ms, p50_ms=startup_ms,
+                    p90_ms=startup_ms, p99_ms=startup_ms, max_ms=startup_ms, rps=None)]
+    run = lambda name, fn, n=requests: results.append(measure(name, fn, n, budget, size=size))  # noqa: E731
+
+    run("load_products (cold)", lambda i: bool(open_store(backend, data_file, sqlite_file).all()) or size == 0)
+    run("load_products (warm)", lambda i: A.load_products() is not None)
+    run("GET /", lambda i: status(client.get("/"), 200))
+    etag = client.get("/").headers.get("ETag", "").strip('"')
+    run("GET / (304)", lambda i: status(client.get("/", headers={"If-None-Match": f'"{etag}"'}), 304, 200))
+    # Same page compressed (bytes on the wire in the report); the test client sends no Accept-Encoding otherwise
+    for enc in ("gzip", "br"):
+        headers = {"Accept-Encoding": enc}
+        wire = len(client.get("/", headers=headers).data)
+        results.append(measure(f"GET / ({enc})", lambda i: status(client.get("/", headers=headers), 200),
+                               requests, budget, size=size, bytes=wire))
+    run("GET /admin", lambda i: status(admin.get("/admin"), 200))
+    version = A.store.version
+    run("GET /api/products?since", lambda i: status(client.get(f"/api/products?since={version}"), 200))
+
+    unpurchased = [p["id"] for p in products if p["visible"] and not p["purchased"]] or [None]
+    run("POST /mark", lambda i: status(client.post(f"/mark/{unpurchased[i % len(unpurchased)]}"), 302))
+    ids = [p["id"] for p in products] or [None]
+    run("POST /admin toggle", lambda i: status(admin.post("/admin", data={"toggle_id": ids[i % len(ids)]}), 302))
+    run("POST /admin edit", lambda i: status(admin.post("/admin", data={
+        "edit_id": ids[i % len(ids)], "name": f"Edited {i}", "link": "https://www.argos.co.uk/product/1",
+        "price": "£10.00", "image": ""}), 302))
+
+    # Fetch + parse doesn't depend on the catalog, so only the first size measures it
+    for name in stub_pages:
+        url = f"{stub_url}/{name}"
+        run(f"fetch price {name}", lambda i: A.try_fetch_price_from_structured_data(url) is not None,
+            min(requests, 50))
+        run(f"fetch image {name}", lambda i: A.try_fetch_image_url(url) is not None, min(requests, 50))
+    return results
+
+
+# --- parent ---
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, backend, requests, budget, pages, stub_latency):
+    results = []
+    with StubRetailerServer(pages, latency=stub_latency) as stub:
+        for i, size in enumerate(sizes):
+            cmd = [sys.executable, "-m", "bench.app_bench", "--child", str(size), "--backend", backend,
+                   "--requests", str(requests), "--budget", str(budget)]
+            if i == 0 and pages:
+                cmd += ["--stub-url", stub.base_url, "--stub-pages", ",".join(pages)]
+            out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+            if out.returncode != 0:
+                sys.stderr.write(out.stderr)
+                raise SystemExit(f"benchmark for {size} items failed")
+            results += json.loads(out.stdout.strip().splitlines()[-1])
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "backend": backend,
+            "requests": requests,
+            "budget": budget,
+            "stub_latency_ms": round(stub_latency * 1000),
+        },
+        "results": results,
+    }
+
+
+def _print_table(report):
+    print(f"commit {report['meta']['commit']}  backend {report['meta']['backend']}")
+    print(f"{'scenario':<28}{'items':>8}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for r in report["results"]:
+        rps = r["rps"] if r["rps"] is not None else ""
+        err = f"  ({r['errors']} errors)" if r["errors"] else ""
+        print(f"{r['scenario']:<28}{r['size']:>8}{r['n']:>6}{r['p50_ms']:>10}{r['p90_ms']:>10}"
+              f"{r['p99_ms']:>10}{rps:>9}{err}")
+
+
+def _print_compare(old, new):
+    before = {(r["scenario"], r["size"]): r for r in old["results"]}
+    print(f"p50 {old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'scenario':<28}{'items':>8}{'before':>10}{'after':>10}{'ratio':>8}")
+    for r in new["results"]:
+        o = before.get((r["scenario"], r["size"]))
+        if not o:
+            continue
+        ratio = r["p50_ms"] / o["p50_ms"] if o["p50_ms"] else float("inf")
+        flag = "  slower" if ratio > 1.2 else "  faster" if ratio < 0.8 else ""
+        print(f"{r['scenario']:<28}{r['size']:>8}{o['p50_ms']:>10}{r['p50_ms']:>10}{ratio:>7.2f}x{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated catalog sizes")
+    ap.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    ap.add_argument("--requests", type=int, default=200, help="max requests per scenario")
+    ap.add_argument("--budget", type=float, default=10, help="max seconds per scenario (min 3 requests)")
+    ap.add_argument("--pages", default=str(PAGES_DIR), help="saved retailer pages for the stub server")
+    ap.add_argument("--stub-latency", type=float, default=0, help="delay per stub response, in ms")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    ap.add_argument("--out", help="also write the JSON report to this file")
+    ap.add_argument("--compare", help="JSON report from an earlier run to compare against")
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--stub-url", help=argparse.SUPPRESS)
+    ap.add_argument("--stub-pages", default="", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child is not None:
+        pages = [p for p in args.stub_pages.split(",") if p]
+        print(json.dumps(run_size(args.child, args.backend, args.requests, args.budget, args.stub_url, pages)))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    report = run(sizes, args.backend, args.requests, args.budget, load_pages(args.pages),
+                 args.stub_latency / 1000)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_table(report)
+    if args.compare:
+        print()
+        _print_compare(json.loads(Path(args.compare).read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
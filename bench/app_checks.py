@@ -0,0 +1,174 @@
+"""
+Regression checks for the routes, through Flask's test client against a
+synthetic catalog in a temp directory (your data/ is never touched):
+
+  - HEAD /events is refused, and /events responses closed before their first
+    chunk give their live-update slot back, so a GET afterwards still streams
+  - the public page's shop menu doesn't list a shop only hidden items use,
+    the admin's does, and showing the item adds it to the public one
+  - the public page's ETag changes with any asset a template fingerprints
+    (not just tailwind.css), and a 304 carries the same weak tag as the 200
+  - bulk import records only fetched prices in the price history, and
+    deleting a product deletes its history
+
+Exits non-zero if any check fails.
+
+    python -m bench.app_checks
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.catalog import write_catalog  # noqa: E402
+
+
+def check_events_slots(A, client):
+    problems = []
+    slots = A.SSE_MAX_CLIENTS
+    head = client.head("/events")
+    if head.status_code != 405:
+        problems.append(f"HEAD /events answered {head.status_code}, not 405")
+    head.close()
+    # More HEADs and abandoned GETs than there are slots; a server closes each response
+    for _ in range(slots + 2):
+        client.head("/events").close()
+        client.get("/events", buffered=False).close()
+    resp = client.get("/events", buffered=False)
+    if resp.status_code != 200:
+        problems.append(f"GET /events after HEADs and abandoned streams answered {resp.status_code}")
+    elif not next(resp.response).startswith(b"retry:"):
+        problems.append("GET /events didn't start streaming")
+    resp.close()
+    if A.default_registry.live_updates.clients:
+        problems.append(f"{A.default_registry.live_updates.clients} live-update clients left registered")
+    return problems
+
+
+def check_hidden_retailer_menu(A, client):
+    problems = []
+    shop = "Hidden Shop Ltd"
+    p = A.store.put({"id": "hidden-shop-item", "name": "Secret", "link": "https://hidden.example/1",
+                     "price": "£5.00", "image": "", "retailer": shop, "visible": False, "purchased": False})
+    A.catalog_changed(p["id"])
+    if shop.encode() in client.get("/").data:
+        problems.append("a hidden item's shop is in the public shop menu")
+    with client.session_transaction() as s:
+        s["logged_in"] = True
+    if shop.encode() not in client.get("/admin").data:
+        problems.append("a hidden item's shop is missing from the admin shop menu")
+    client.post("/admin", data={"toggle_id": p["id"]})
+    if shop.encode() not in client.get("/").data:
+        problems.append("the shop of an item made visible isn't in the public shop menu")
+    A.store.delete(p["id"])
+    A.catalog_changed(p["id"])
+    with client.session_transaction() as s:
+        s.pop("logged_in", None)
+    return problems
+
+
+def check_index_etag(A, client):
+    problems = []
+    flask_app = client.application
+    static = Path(tempfile.mkdtemp(prefix="bench-static-"))
+    old_static = flask_app.static_folder
+    try:
+        shutil.copytree(old_static, static, dirs_exist_ok=True)
+        flask_app.static_folder = str(static)
+        for encoding in ("identity", "gzip"):
+            first = client.get("/", headers={"Accept-Encoding": encoding})
+            tag = first.headers.get("ETag", "")
+            again = client.get("/", headers={"Accept-Encoding": encoding, "If-None-Match": tag})
+            if again.status_code != 304 or again.headers.get("ETag") != tag or not tag.startswith("W/"):
+                problems.append(f"{encoding}: 200 sent {tag!r}, revalidating got {again.status_code} "
+                                f"with {again.headers.get('ETag')!r}")
+        tag = client.get("/").headers.get("ETag", "")
+        (static / "favicon.ico").write_bytes((static / "favicon.ico").read_bytes() + b"\0")
+        changed = client.get("/", headers={"If-None-Match": tag})
+        if changed.status_code != 200:
+            problems.append(f"after favicon.ico changed, revalidating still got {changed.status_code}")
+    finally:
+        flask_app.static_folder = old_static
+        shutil.rmtree(static, ignore_errors=True)
+    return problems
+
+
+def check_price_history(A, client):
+    problems = []
+    history = A.default_registry.price_history
+    real_fetch = A.timed_fetch
+    # Stands in for the retailer pages
+    A.timed_fetch = lambda field, link, timeout, label=None: {
+        "price": "7.50", "currency": "GBP", "image": "", "name": "Fetched"}
+    try:
+        with client.application.test_request_context():
+            lines = list(A.run_import(["name,link,price\n", "Typed,https://typed.example/1,£3.00\n",
+                                       "Fetched,https://fetched.example/1,\n"]))
+    finally:
+        A.timed_fetch = real_fetch
+    by_link = {p["link"]: p for p in A.store.all()}
+    typed, fetched = by_link.get("https://typed.example/1"), by_link.get("https://fetched.example/1")
+    if not (typed and fetched):
+        return [f"import didn't add both items: {lines}"]
+    if history.series(typed["id"]):
+        problems.append("a price typed into the import file was recorded as observed")
+    if not history.series(fetched["id"]):
+        problems.append("a fetched import price wasn't recorded")
+    with client.session_transaction() as s:
+        s["logged_in"] = True
+    for p in (typed, fetched):
+        client.post(f"/delete/{p['id']}")
+    if history._path(fetched["id"]).exists() or history.series(fetched["id"]):
+        problems.append("deleting a product left its price history behind")
+    with client.session_transaction() as s:
+        s.pop("logged_in", None)
+    return problems
+
+
+CHECKS = [check_events_slots, check_hidden_retailer_menu, check_index_etag, check_price_history]
+
+
+def run():
+    tmp = Path(tempfile.mkdtemp(prefix="bench-checks-"))
+    try:
+        write_catalog(tmp / "products.json", 50)
+        os.environ.update({
+            "DATA_FILE": str(tmp / "products.json"),
+            "REGISTRIES_DIR": str(tmp / "registries"),
+            "DATA_BACKEND": "json",
+            "LIVE_UPDATES": "true",
+            "THREADS": "4",
+            "NOTIFY_ENABLED": "false",
+            "PRICE_REFRESH_INTERVAL": "0",
+            "PAGE_CACHE_PERSIST": "false",
+            "METRICS_DIR": str(tmp / "metrics"),
+        })
+        import app as A
+
+        A.default_registry.live_updates.bus_dir = tmp / "events"  # not the real data/
+        A.default_registry.price_history.dir = tmp / "price_history"
+        client = A.create_app(warm=False).test_client()
+        failed = 0
+        for check in CHECKS:
+            problems = check(A, client)
+            for problem in problems:
+                print(f"FAIL {check.__name__}: {problem}")
+            if not problems:
+                print(f"ok   {check.__name__}")
+            failed += bool(problems)
+        A.default_registry.live_updates.close()
+        return not failed
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    raise SystemExit(0 if run() else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Synthetic product catalogs for benchmarks, shaped like a real list: retailer
+links from retailers.py, "£" prices, some images, some purchased or hidden items.
+"""
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_NOUNS = ["Bodysuit", "Muslin Squares", "Baby Monitor", "Changing Mat", "Sleepsuit", "Bottle Set",
+          "Cot Mobile", "Swaddle", "Bath Thermometer", "Car Seat Mirror", "Play Gym", "Hooded Towel"]
+_ADJECTIVES = ["Organic", "Cotton", "Grey", "Starry", "Bamboo", "Knitted", "Rainbow", "Travel", "Deluxe"]
+_SHOPS = [("Argos", "https://www.argos.co.uk/product/{n}"),
+          ("John Lewis", "https://www.johnlewis.com/item/p{n}"),
+          ("Amazon", "https://www.amazon.co.uk/dp/B0{n:08d}"),
+          ("Boots", "https://www.boots.com/item-{n}"),
+          ("Mamas & Papas", "https://www.mamasandpapas.com/products/{n}")]
+
+
+def synthetic_catalog(n, seed=1):
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)
+    products = []
+    for i in range(n):
+        retailer, link = rng.choice(_SHOPS)
+        p = {
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "name": f"{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} {i}",
+            "link": link.format(n=rng.randint(1, 10 ** 7)),
+            "image": f"https://cdn.example/p/{i}.jpg" if rng.random() < 0.8 else "",
+            "price": f"£{rng.randint(3, 300)}.{rng.choice(['00', '49', '99'])}",
+            "retailer": retailer,
+            "visible": rng.random() < 0.95,
+            "purchased": rng.random() < 0.3,
+            "reserved": False,
+            "price_checked_at": (now - timedelta(hours=rng.randint(0, 24 * 30))).isoformat(),
+        }
+        if p["purchased"]:
+            p["purchased_at"] = (now - timedelta(hours=rng.randint(0, 24 * 30))).isoformat()
+        products.append(p)
+    return products
+
+
+def write_catalog(path, n, seed=1):
+    """Write a products.json with n synthetic items; returns the products."""
+    products = synthetic_catalog(n, seed)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(products, f, indent=2, ensure_ascii=False)
+    return products
@@ -0,0 +1,90 @@
+"""
+Retailer page corpus for benchmarks.
+
+Saved pages go in bench/pages/<name>.html (save "Page source" from the
+browser). Pages are not committed; when the directory is empty we fall back
+to synthetic pages shaped like the retailers in retailers.py: the same
+structured-data layout (JSON-LD, og: meta, itemprop) padded with realistic
+amounts of markup, scripts and images.
+"""
+import json
+import random
+import re
+from pathlib import Path
+
+PAGES_DIR = Path(__file__).resolve().parent / "pages"
+
+_CANONICAL_RE = re.compile(r'<link[^>]+rel=["\']canonical["\'][^>]*href=["\']([^"\']+)', re.I)
+
+
+def _filler(rng, kb):
+    """Nav/body markup, inline scripts and thumbnails, roughly `kb` kilobytes."""
+    out, size = [], 0
+    while size < kb * 1024:
+        kind = rng.random()
+        if kind < 0.5:
+            chunk = (f'<div class="c-{rng.randint(0, 999)}"><a href="/cat/{rng.randint(0, 99999)}">'
+                     f'Category {rng.randint(0, 999)}</a><span class="muted">Lorem ipsum dolor sit amet, '
+                     f'consectetur adipiscing elit.</span></div>\n')
+        elif kind < 0.8:
+            chunk = (f'<img src="/thumbs/{rng.randint(0, 99999)}.jpg" class="thumb" width="{rng.randint(40, 160)}" '
+                     f'height="{rng.randint(40, 160)}" alt="">\n')
+        else:
+            chunk = "<script>window.__STATE__ = " + json.dumps(
+                {"k": [rng.random() for _ in range(40)], "s": "x" * 200}) + ";</script>\n"
+        out.append(chunk)
+        size += len(chunk)
+    return "".join(out)
+
+
+def _page(head, body_top, filler, body_bottom=""):
+    return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\">{head}</head>"
+            f"<body>{body_top}{filler}{body_bottom}</body></html>")
+
+
+def synthetic_pages(seed=1):
+    rng = random.Random(seed)
+    product = {"@context": "https://schema.org", "@type": "Product", "name": "Baby Monitor",
+               "image": ["https://cdn.example/p/monitor-1200.jpg"],
+               "offers": {"@type": "Offer", "price": "89.99", "priceCurrency": "GBP",
+                          "availability": "https://schema.org/InStock"}}
+    ld = f'<script type="application/ld+json">{json.dumps(product)}</script>'
+    og = ('<meta property="og:title" content="Baby Monitor">'
+          '<meta property="og:image" content="https://cdn.example/p/monitor-og.jpg">')
+    pages = {
+        # Amazon: huge page, no JSON-LD offers, price in itemprop-less spans, hero image in the body
+        "amazon": ("https://www.amazon.co.uk/dp/B000000000", _page(
+            '<title>Amazon.co.uk: Baby Monitor</title>', _filler(rng, 600),
+            '<img id="landingImage" src="https://m.media-amazon.com/images/I/hero.jpg" width="1500" height="1500">'
+            '<span itemprop="price">£89.99</span>', _filler(rng, 1400))),
+        # Argos: JSON-LD + og in <head>
+        "argos": ("https://www.argos.co.uk/product/1234567", _page(og + ld, "", _filler(rng, 400))),
+        # John Lewis: JSON-LD under @graph near the end of the body
+        "johnlewis": ("https://www.johnlewis.com/baby-monitor/p1234", _page(
+            og, _filler(rng, 500), "", f'<script type="application/ld+json">'
+            f'{json.dumps({"@context": "https://schema.org", "@graph": [product]})}</script>')),
+        # Boots: og:price meta only
+        "boots": ("https://www.boots.com/baby-monitor-10000", _page(
+            og + '<meta property="og:price:amount" content="89.99">'
+                 '<meta property="og:price:currency" content="GBP">', "", _filler(rng, 300))),
+        # Currys: itemprop microdata in the body
+        "currys": ("https://www.currys.co.uk/products/baby-monitor-10000.html", _page(
+            '<title>Baby Monitor | Currys</title>', _filler(rng, 250),
+            '<div itemscope itemtype="https://schema.org/Product"><span itemprop="price" content="89.99">£89.99</span>'
+            '<meta itemprop="priceCurrency" content="GBP"><img src="/i/monitor.jpg" width="800" height="800"></div>',
+            _filler(rng, 250))),
+    }
+    return pages
+
+
+def load_pages(pages_dir=PAGES_DIR):
+    """{name: (base_url, html)} from saved pages, or the synthetic corpus."""
+    files = sorted(Path(pages_dir).glob("*.html")) if Path(pages_dir).is_dir() else []
+    if not files:
+        return synthetic_pages()
+    pages = {}
+    for f in files:
+        html = f.read_text(errors="replace")
+        m = _CANONICAL_RE.search(html)
+        pages[f.stem] = (m.group(1) if m else "https://example.com/", html)
+    return pages
@@ -0,0 +1,69 @@
+"""
+Benchmark: single-pass extract_product_metadata() vs the legacy price + image
+extractors, over the page corpus (see bench/corpus.py). A price/image mismatch is
+expected where the page only has JSON-LD under @graph, which the legacy
+price extractor never looked at.
+
+    python -m bench.extract_bench [--repeat N] [--pages DIR] [--json]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.corpus import PAGES_DIR, load_pages  # noqa: E402
+from bench.legacy import legacy_image, legacy_price  # noqa: E402
+from extract import extract_product_metadata, format_price  # noqa: E402
+
+
+def _time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(pages, repeat):
+    results = []
+    for name, (url, html) in pages.items():
+        legacy = _time(lambda: (legacy_price(html), legacy_image(html, url)), repeat)
+        new = _time(lambda: extract_product_metadata(html, url), repeat)
+        meta = extract_product_metadata(html, url)
+        results.append({
+            "page": name,
+            "kb": round(len(html) / 1024),
+            "legacy_ms": round(legacy * 1000, 2),
+            "single_pass_ms": round(new * 1000, 2),
+            "speedup": round(legacy / new, 1) if new else None,
+            # Both should agree; a mismatch is worth a look
+            "price_match": legacy_price(html) == (format_price(meta["price"], meta["currency"]) if meta["price"] else None),
+            "image_match": legacy_image(html, url) == meta["image"],
+        })
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--pages", default=str(PAGES_DIR))
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args()
+
+    results = run(load_pages(args.pages), args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'page':<12}{'KB':>7}{'legacy ms':>12}{'1-pass ms':>12}{'speedup':>9}  match")
+    for r in results:
+        match = "ok" if r["price_match"] and r["image_match"] else \
+            f"price={r['price_match']} image={r['image_match']}"
+        print(f"{r['page']:<12}{r['kb']:>7}{r['legacy_ms']:>12}{r['single_pass_ms']:>12}{r['speedup']:>8}x  {match}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Check: streamed page fetches still read far enough for retailer rules.
+
+fetch_page_metadata() stops downloading once the page read so far has all the
+structured data it needs, which is usually in the <head>. Retailer rules
+(retailers.py) match markup in the body instead, so with rules the download
+has to go on until they match too. This serves pages from the stub retailer
+server with complete metadata in the <head> and the rule targets hundreds of
+kilobytes into the body, and checks that
+
+  - the body-only rules win over the <head> metadata
+  - a value cut in two by where the download pauses to check isn't taken half-read
+  - a page without rules still stops early
+
+and exits non-zero if not.
+
+    python -m bench.fetch_check
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.stub_server import StubRetailerServer  # noqa: E402
+
+RULES = {
+    "price": [{"tag": "span", "attrs": {"class": "a-offscreen"}, "text": True}],
+    "image": [{"tag": "img", "attrs": {"id": "landingImage"}, "attr": "src"}],
+}
+
+
+def _page(body):
+    head = ('<meta property="og:title" content="Baby Monitor">'
+            '<meta property="og:image" content="https://cdn.example/og.jpg">'
+            '<script type="application/ld+json">' + json.dumps({
+                "@type": "Product", "name": "Baby Monitor", "image": "https://cdn.example/ld.jpg",
+                "offers": {"price": "99.99", "priceCurrency": "GBP"}}) + "</script>")
+    filler = '<div class="row"><a href="/cat/1">Category</a><span class="muted">Lorem ipsum</span></div>\n' * 4000
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8">{head}</head><body>{filler}{body}{filler}</body></html>'
+
+
+def run():
+    os.environ.update({"PAGE_CACHE_PERSIST": "false", "LIVE_UPDATES": "false", "PRICE_REFRESH_INTERVAL": "0"})
+    import app as A
+    from retailers import RETAILERS, RetailerRegistry
+
+    body = '<img id="landingImage" src="/hero.jpg" width="1500"><span class="a-offscreen">£12.34</span>'
+    # The cache checks stop_when once it has read 4, 8, 16... chunks; pad the body so
+    # the check after the rules' markup comes between "£12" and ".34"
+    at = _page(body).encode().index(b"12.34") + 2 + len("<!---->")
+    check = A.page_cache.chunk_size * 4
+    while check < at:
+        check *= 2
+    pages = {
+        "ruled": ("", _page(body)),
+        "split": ("", _page("<!--" + "x" * (check - at) + "-->" + body)),
+        "plain": ("", _page("")),
+    }
+    problems = []
+    with StubRetailerServer(pages) as server:
+        host = server.base_url.split("://")[1].split(":")[0]
+        ruled = RetailerRegistry(RETAILERS + [{"name": "Stub", "domains": [host], "rules": RULES}])
+        A.retailers = ruled
+        for name in ("ruled", "split"):
+            meta = A.fetch_page_metadata(server.url(name))
+            if meta["price"] != "£12.34" or meta["image"] != server.url("hero.jpg"):
+                problems.append(f"{name}: got price {meta['price']!r}, image {meta['image']!r} instead of the rules'")
+
+        A.retailers = RetailerRegistry(RETAILERS)
+        stops = A.page_cache.early_stops
+        meta = A.fetch_page_metadata(server.url("plain"))
+        if A.page_cache.early_stops == stops or meta["price"] != "99.99":
+            problems.append(f"plain: no early stop (price {meta['price']!r})")
+
+    for problem in problems:
+        print("FAIL:", problem)
+    if not problems:
+        print("OK: body-only retailer rules matched, pages without rules still stop early")
+    return not problems
+
+
+def main():
+    raise SystemExit(0 if run() else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Cold-start benchmark: how long a fresh process takes to import app.py, build
+the app and answer its first public page request, with the slowest imports
+from `python -X importtime`. With --ref the same is measured for another
+commit (checked out into a temp directory), for a before/after comparison.
+
+    python -m bench.importtime [--runs N] [--ref GIT_REF] [--top N] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs inside the measured checkout; older commits have a module-level `app` instead of create_app()
+_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app() if hasattr(app, "create_app") else app.app
+t2 = time.perf_counter()
+status = flask_app.test_client().get("/").status_code
+t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000,
+                  "first_request_ms": (t3 - t2) * 1000, "total_ms": (t3 - t0) * 1000, "status": status}))
+"""
+
+
+def _parse_importtime(stderr):
+    """{module: cumulative microseconds} for modules imported directly by app."""
+    out = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            out[name.strip()] = out.get(name.strip(), 0) + int(cumulative)
+    return out
+
+
+def measure(root, runs):
+    with tempfile.TemporaryDirectory(prefix="bench-import-") as tmp:
+        env = dict(os.environ,
+                   DATA_FILE=str(Path(tmp) / "products.json"),
+                   SQLITE_PATH=str(Path(tmp) / "products.db"),
+                   METRICS_DIR=str(Path(tmp) / "metrics"),
+                   NOTIFY_ENABLED="false",
+                   PRICE_REFRESH_INTERVAL="0")
+        timings, modules = [], []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE], cwd=root, env=env,
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                sys.stderr.write(out.stderr[-2000:])
+                raise SystemExit(f"probe failed in {root}")
+            timings.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            modules.append(_parse_importtime(out.stderr))
+    # -X importtime itself adds overhead, so compare runs with each other, not with production
+    result = {k: round(statistics.median(t[k] for t in timings), 1)
+              for k in ("import_ms", "create_app_ms", "first_request_ms", "total_ms")}
+    names = set().union(*modules)
+    result["modules_ms"] = {n: round(statistics.median(m.get(n, 0) for m in modules) / 1000, 1) for n in names}
+    return result
+
+
+def checkout(ref, dest):
+    """Files of `ref` (not the working tree) extracted into dest."""
+    data = subprocess.run(["git", "archive", "--format=tar", ref], cwd=ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=BytesIO(data)) as tar:
+        tar.extractall(dest)
+
+
+def _print(label, r, top):
+    print(f"{label}: import {r['import_ms']}ms, create_app {r['create_app_ms']}ms, "
+          f"first request {r['first_request_ms']}ms, total {r['total_ms']}ms")
+    mods = sorted(((ms, n) for n, ms in r["modules_ms"].items() if n not in ("app", "site")), reverse=True)
+    print("  slowest imports: " + ", ".join(f"{n} {ms}ms" for ms, n in mods[:top]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--ref", help="also measure this git ref (e.g. HEAD~1) for comparison")
+    ap.add_argument("--top", type=int, default=8, help="how many of the slowest imports to list")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args()
+
+    report = {"current": measure(ROOT, args.runs)}
+    if args.ref:
+        with tempfile.TemporaryDirectory(prefix="bench-ref-") as tmp:
+            checkout(args.ref, tmp)
+            report[args.ref] = measure(tmp, args.runs)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    if args.ref:
+        _print(args.ref, report[args.ref], args.top)
+    _print("current", report["current"], args.top)
+    if args.ref:
+        before, after = report[args.ref]["total_ms"], report["current"]["total_ms"]
+        print(f"cold start: {before}ms -> {after}ms ({after - before:+.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+The price/image extractors as they were before extract.py, kept verbatim
+(minus the HTTP fetch) as the baseline for benchmarks.
+"""
+import json as pyjson
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+
+def legacy_price(html: str):
+    import re as _re
+    import json as _json
+
+    def _fmt_price(price, currency=None):
+        price_str = str(price).strip()
+        if currency and not price_str.startswith(currency):
+            return f"{currency} {price_str}".strip()
+        return price_str
+
+    blocks = _re.findall(
+        r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+        html, flags=_re.I | _re.S
+    )
+    for txt in blocks:
+        try:
+            data = _json.loads(txt.strip())
+        except Exception:
+            continue
+        objs = data if isinstance(data, list) else [data]
+        for obj in objs:
+            offers = obj.get("offers")
+            if not offers:
+                continue
+            offers_list = offers if isinstance(offers, list) else [offers]
+            for offer in offers_list:
+                price = offer.get("price") or offer.get("priceSpecification", {}).get("price")
+                currency = offer.get("priceCurrency") or offer.get("priceSpecification", {}).get("priceCurrency")
+                if price:
+                    return _fmt_price(price, currency)
+
+    def find_meta(content_html, key, attr="property"):
+        rgx = rf'<meta[^>]+{attr}=["\']{_re.escape(key)}["\'][^>]*content=["\']([^"\']+)["\']'
+        m = _re.search(rgx, content_html, flags=_re.I)
+        return m.group(1).strip() if m else None
+
+    price = (
+        find_meta(html, "og:price:amount", "property")
+        or find_meta(html, "product:price:amount", "property")
+        or find_meta(html, "price", "name")
+        or find_meta(html, "price", "itemprop")
+    )
+    currency = (
+        find_meta(html, "og:price:currency", "property")
+        or find_meta(html, "product:price:currency", "property")
+        or find_meta(html, "priceCurrency", "itemprop")
+        or find_meta(html, "currency", "name")
+    )
+    if not price:
+        m = _re.search(
+            r'<[^>]+itemprop=["\']price["\'][^>]+content=["\']([^"\']+)["\']',
+            html, flags=_re.I
+        )
+        if m:
+            price = m.group(1).strip()
+    if not price:
+        m = _re.search(
+            r'<[^>]+itemprop=["\']price["\'][^>]*>([^<£€$]*[£€$]?\s?\d+[.,]?\d*)',
+            html, flags=_re.I
+        )
+        if m:
+            price = m.group(1).strip()
+    if price:
+        return _fmt_price(price, currency)
+    return None
+
+
+def legacy_image(html: str, link: str):
+    soup = BeautifulSoup(html, "html.parser")
+
+    def abs_url(u: str):
+        try:
+            return urljoin(link, u.strip())
+        except Exception:
+            return None
+
+    for attr, key in [("property", "og:image"), ("name", "twitter:image"), ("name", "twitter:image:src")]:
+        tag = soup.find("meta", attrs={attr: key})
+        if tag and tag.get("content"):
+            u = abs_url(tag["content"])
+            if u:
+                return u
+
+    for script in soup.find_all("script", attrs={"type": "application/ld+json"}):
+        try:
+            data = pyjson.loads(script.string or script.text or "")
+        except Exception:
+            continue
+        nodes = data if isinstance(data, list) else [data]
+        for node in nodes:
+            if not isinstance(node, dict):
+                continue
+            if "image" in node:
+                img = node["image"]
+                candidates = img if isinstance(img, list) else [img]
+                for c in candidates:
+                    if isinstance(c, str):
+                        u = abs_url(c)
+                        if u:
+                            return u
+
+    def score_img(tag):
+        src = (tag.get("src") or "").lower()
+        cls = " ".join(tag.get("class", [])).lower()
+        if any(x in src for x in ["sprite", "logo", "icon", "favicon", "placeholder"]):
+            return -1
+        if any(x in cls for x in ["sprite", "logo", "icon", "avatar"]):
+            return -1
+
+        def to_int(v):
+            try:
+                return int(re.sub(r"[^0-9]", "", str(v)))
+            except Exception:
+                return 0
+
+        w = to_int(tag.get("width") or tag.get("data-width") or tag.get("data-image-width"))
+        h = to_int(tag.get("height") or tag.get("data-height") or tag.get("data-image-height"))
+        if w == 0 or h == 0:
+            return 100
+        return w * h
+
+    best = None
+    best_score = -1
+    for img in soup.find_all("img"):
+        src = img.get("src")
+        if not src:
+            continue
+        s = score_img(img)
+        if s > best_score:
+            best = src
+            best_score = s
+    if best:
+        return abs_url(best)
+    return None
@@ -0,0 +1,221 @@
+"""
+Stress check: hundreds of guests marking gifts at the same moment.
+
+Builds a synthetic catalog in a temp directory, then several worker processes
+(like gunicorn workers, all on the same data files) each release a burst of
+threads at once, every thread POSTing to /api/products/<id>/purchase for a
+handful of shared items: most with a fresh idempotency key, some resending
+the key of their previous attempt (a double-tap), while an admin thread keeps
+editing the same items and a price refresh keeps running over them (with a
+stub fetch). Afterwards it checks that
+
+  - every item someone tried to mark is purchased (no purchase overwritten)
+  - exactly one notification went out per item
+  - every resend of a winning key was answered as a success
+  - the admin edits weren't lost either
+  - the refresh wrote prices while all that went on
+
+and exits non-zero if not.
+
+    python -m bench.purchase_stress [--items 50] [--marks 400] [--processes 4]
+                                    [--threads 32] [--backend json|sqlite]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.catalog import write_catalog  # noqa: E402
+
+REFRESHED_PRICE = "£9.99"
+
+
+def _setup(tmp, items, backend):
+    data_file, sqlite_file = tmp / "products.json", tmp / "products.db"
+    products = write_catalog(data_file, items)
+    # Everyone starts unpurchased and visible
+    for p in products:
+        p.update(purchased=False, visible=True)
+        p.pop("purchased_at", None)
+    data_file.write_text(json.dumps(products))
+    os.environ.update({
+        "DATA_FILE": str(data_file),
+        "SQLITE_PATH": str(sqlite_file),
+        "DATA_BACKEND": backend,
+        "REGISTRIES_DIR": str(tmp / "registries"),
+        "LIVE_UPDATES": "false",
+        "NOTIFY_ENABLED": "false",
+        "PRICE_REFRESH_INTERVAL": "0",
+        "PRICE_REFRESH_DELAY": "0",
+        "PAGE_CACHE_PERSIST": "false",
+        "METRICS_DIR": str(tmp / "metrics"),
+    })
+    if backend == "sqlite":
+        from store import migrate_json_to_sqlite
+        migrate_json_to_sqlite(data_file, sqlite_file)
+    return [p["id"] for p in products]
+
+
+def _worker(worker, tmp, ids, marks, threads, seed, results):
+    """One 'gunicorn worker': a burst of `marks` purchases over `threads` threads, plus an admin editing and a price refresh."""
+    import app as A
+
+    notified = []
+    A.notify_purchase = lambda p: notified.append(p["id"])  # count instead of sending
+
+    def fetch_price(link):
+        time.sleep(0.005)  # long enough for marks to land between the fetch and the write
+        return REFRESHED_PRICE
+
+    A.try_fetch_price_from_structured_data = fetch_price
+    A.default_registry.price_history.dir = tmp / "price_history"  # not the real data/
+    flask_app = A.create_app(warm=False)
+    rng = random.Random(seed)
+    plan = []  # (product id, key, resend of the previous attempt?)
+    for _ in range(marks):
+        if plan and rng.random() < 0.2:
+            pid, key, _ = plan[-1]
+            plan.append((pid, key, True))
+        else:
+            plan.append((rng.choice(ids), uuid.uuid4().hex, False))
+
+    start = threading.Barrier(threads + 3)  # guests, the admin, the refresh and us
+    lock = threading.Lock()
+    answers, errors = [], []
+
+    def guest(n):
+        client = flask_app.test_client()
+        start.wait()
+        for pid, key, resend in plan[n::threads]:
+            resp = client.post(f"/api/products/{pid}/purchase", headers={"Idempotency-Key": key})
+            with lock:
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+                else:
+                    answers.append((pid, key, resend, resp.get_json()["changed"]))
+
+    edits = []
+
+    def admin():
+        client = flask_app.test_client()
+        with client.session_transaction() as s:
+            s["logged_in"] = True
+        start.wait()
+        for i in range(max(1, marks // 10)):
+            pid = rng.choice(ids)
+            name = f"Edited by worker {worker} #{i}"
+            client.post("/admin", data={"edit_id": pid, "name": name, "link": "https://www.argos.co.uk/product/1",
+                                        "price": "£10.00", "image": ""})
+            edits.append((pid, name))
+
+    refreshed = []
+    done = threading.Event()
+
+    def refresh():
+        start.wait()
+        with flask_app.app_context():
+            while not done.is_set():
+                refreshed.append(A.run_price_refresh(force=True)["updated"])
+
+    pool = [threading.Thread(target=guest, args=(n,)) for n in range(threads)]
+    pool.append(threading.Thread(target=admin))
+    refresher = threading.Thread(target=refresh)
+    refresher.start()
+    for t in pool:
+        t.start()
+    t0 = time.perf_counter()
+    start.wait()
+    for t in pool:
+        t.join()
+    seconds = time.perf_counter() - t0
+    done.set()
+    refresher.join()
+    results.put({"worker": worker, "answers": answers, "errors": errors, "notified": notified,
+                 "edits": edits, "refreshed": sum(refreshed), "seconds": seconds})
+
+
+def run(items, marks, processes, threads, backend):
+    tmp = Path(tempfile.mkdtemp(prefix="bench-stress-"))
+    try:
+        ids = _setup(tmp, items, backend)
+        # Fork so every worker has its own store instance on the same files, as under gunicorn
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(w, tmp, ids, marks, threads, w, results)) for w in range(processes)]
+        for p in procs:
+            p.start()
+        reports = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+        from store import open_store
+        final = {p["id"]: p for p in open_store(backend, tmp / "products.json", tmp / "products.db").all()}
+        return _check(reports, final)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _check(reports, final):
+    answers = [a for r in reports for a in r["answers"]]
+    notified = [pid for r in reports for pid in r["notified"]]
+    tried = {pid for pid, _, _, _ in answers}
+    problems = []
+
+    lost = sorted(pid for pid in tried if not final[pid].get("purchased"))
+    if lost:
+        problems.append(f"{len(lost)} purchases lost")
+    twice = sorted({pid for pid in notified if notified.count(pid) > 1})
+    if twice or set(notified) != tried:
+        problems.append(f"{len(notified)} notifications for {len(tried)} items ({len(twice)} sent twice)")
+    winners = {final[pid].get("purchase_key") for pid in tried}
+    bad_resends = [a for a in answers if a[2] and a[1] in winners and not a[3]]
+    if bad_resends:
+        problems.append(f"{len(bad_resends)} resends of a winning key not answered as a success")
+    # The last edit of each item may have been by any worker; it just mustn't have been undone by a mark
+    edited = {pid for r in reports for pid, _ in r["edits"]}
+    unedited = sorted(pid for pid in edited if not final[pid]["name"].startswith("Edited by worker"))
+    if unedited:
+        problems.append(f"{len(unedited)} admin edits lost")
+    refreshed = sum(r["refreshed"] for r in reports)
+    if not refreshed:
+        problems.append("the price refresh wrote nothing")
+    errors = sum(len(r["errors"]) for r in reports)
+    if errors:
+        problems.append(f"{errors} requests failed")
+
+    seconds = max(r["seconds"] for r in reports)
+    print(f"{len(answers)} marks on {len(tried)} items from {len(reports)} workers in {seconds:.2f}s "
+          f"({len(answers) / seconds:.0f}/s), {len(edited)} items edited and {refreshed} prices refreshed meanwhile")
+    print(f"{len(notified)} notifications, {sum(1 for a in answers if a[2])} resends")
+    for problem in problems:
+        print("FAIL:", problem)
+    if not problems:
+        print("OK: no lost purchases, one notification per item")
+    return not problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--items", type=int, default=50, help="items being marked (fewer = more contention)")
+    ap.add_argument("--marks", type=int, default=400, help="purchase requests per worker")
+    ap.add_argument("--processes", type=int, default=4, help="worker processes sharing the data files")
+    ap.add_argument("--threads", type=int, default=32, help="concurrent requests per worker")
+    ap.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    args = ap.parse_args()
+    ok = run(args.items, args.marks, args.processes, args.threads, args.backend)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Local HTTP server that plays the part of the retailers: serves the page
+corpus (bench/corpus.py) at /<name>, optionally after a fixed delay, so fetch
+and parse latency can be measured offline and repeatably.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubRetailerServer:
+    def __init__(self, pages, latency=0.0, host="127.0.0.1", port=0):
+        self.pages = {name: html.encode("utf-8") for name, (url, html) in pages.items()}
+        self.latency = latency
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = server.pages.get(self.path.lstrip("/").split("?")[0])
+                if server.latency:
+                    time.sleep(server.latency)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client stopped reading early (streamed fetch); that's the point
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, name):
+        return f"{self.base_url}/{name}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-retailer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,200 @@
+"""
+Bulk import of gift links: CSV, JSON or a plain list of URLs.
+
+read_items() parses the upload as it is read, so items start being fetched
+before the whole file has been parsed:
+
+  - JSON: an array of objects (or one object per line), decoded object by
+    object rather than with one json.load()
+  - CSV: needs a header row with a `link` (or `url`) column; `name`, `price`,
+    `image` and `retailer` columns are used when present
+  - anything else: every http(s) URL found, one item each (e.g. a list pasted
+    from another registry)
+
+import_items() skips links already on the list (or earlier in the same
+upload) using an index of normalised links, fills in the missing fields on a
+bounded thread pool with at most `per_host` fetches in flight per retailer,
+and yields a progress event as each item finishes. New products are written
+with one put_many() per `save_every` of them, and the rest when the import
+ends, also when it ends early (a bad upload, or the generator closed because
+the browser went away), so nothing already fetched is lost.
+"""
+import csv
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from itertools import chain
+from urllib.parse import urlparse
+from uuid import uuid4
+
+from page_cache import normalise_url
+from price_refresh import HostLimiter
+
+FIELDS = ("name", "link", "price", "image", "retailer")
+# Other spellings seen in exports from other registries
+_ALIASES = {"url": "link", "href": "link", "product_url": "link", "title": "name", "product": "name",
+            "image_url": "image", "img": "image", "store": "retailer", "shop": "retailer"}
+_URL_RE = re.compile(r"https?://[^\s,;\"'<>]+", re.I)
+
+
+def _clean(row):
+    item = {}
+    for key, value in row.items():
+        if not isinstance(key, str):
+            continue
+        key = key.strip().lower()
+        key = _ALIASES.get(key, key)
+        if key in FIELDS and key not in item and value not in (None, ""):
+            item[key] = str(value).strip()
+    return item
+
+
+def _iter_json(lines):
+    """Objects from a JSON array or JSON lines, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    buf, started = "", False
+    for line in lines:
+        buf += line
+        while True:
+            buf = buf.lstrip()
+            if not started and buf.startswith("["):
+                buf, started = buf[1:], True
+                continue
+            if buf.startswith((",", "]")):
+                buf = buf[1:]
+                continue
+            if not buf:
+                break
+            try:
+                obj, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                break  # incomplete object: read more
+            buf = buf[end:]
+            if isinstance(obj, dict):
+                yield obj
+            elif isinstance(obj, str):
+                yield {"link": obj}
+    if buf.strip():
+        raise ValueError("JSON input ends in the middle of an item")
+
+
+def read_items(lines):
+    """Dicts with (some of) FIELDS from an iterable of text lines; the format is sniffed from the first line."""
+    lines = iter(lines)
+    first = ""
+    for first in lines:
+        if first.strip():
+            break
+    rest = chain([first], lines)
+    head = first.lstrip("\ufeff").lstrip()
+    if head.startswith(("[", "{")):
+        rows = _iter_json(rest)
+    elif "link" in {_ALIASES.get(c.strip(), c.strip()) for c in next(csv.reader([head.lower()]), [])}:
+        rows = csv.DictReader(rest)
+    else:
+        rows = ({"link": url} for line in rest for url in _URL_RE.findall(line))
+    for row in rows:
+        yield _clean(row)
+
+
+def import_items(items, store, enrich, max_workers=8, per_host=4, delay=0.0, max_pending=64, save_every=25,
+                 on_saved=None):
+    """
+    Add the new items in `items` to `store`. `enrich(item)` fills in missing
+    fields (it runs on the pool, so it may fetch). `on_saved(products)` is
+    called after each batch is written. Yields progress events:
+
+      {"status": "added" | "duplicate" | "skipped" | "failed", "item": ..., "error": ...}
+
+    and finally {"status": "done", "added": [...products], "counts": {...}}.
+    """
+    seen = {normalise_url(p["link"]) for p in store.all() if p.get("link")}
+    limiter = HostLimiter(per_host=per_host, delay=delay)
+    counts = {"added": 0, "duplicate": 0, "skipped": 0, "failed": 0}
+    added, unsaved, pending = [], [], set()
+    outstanding = set()  # submitted, not yet reported
+
+    def save():
+        if unsaved:
+            batch = list(unsaved)
+            store.put_many(batch)
+            unsaved.clear()
+            if on_saved:
+                on_saved(batch)
+
+    def work(item):
+        host = (urlparse(item["link"]).hostname or "").lower()
+        return limiter.run(host, enrich, item)
+
+    def finished(futures):
+        for fut in futures:
+            outstanding.discard(fut)
+            item = fut.item
+            try:
+                product = fut.result()
+            except Exception as e:
+                counts["failed"] += 1
+                yield {"status": "failed", "item": item, "error": str(e) or type(e).__name__}
+                continue
+            added.append(product)
+            unsaved.append(product)
+            counts["added"] += 1
+            if len(unsaved) >= save_every:
+                save()
+            yield {"status": "added", "item": product}
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for item in items:
+            link = item.get("link", "")
+            if not re.match(r"^https?://", link, flags=re.I):
+                counts["skipped"] += 1
+                yield {"status": "skipped", "item": item, "error": "no http(s) link"}
+                continue
+            key = normalise_url(link)
+            if key in seen:
+                counts["duplicate"] += 1
+                yield {"status": "duplicate", "item": item}
+                continue
+            seen.add(key)
+            fut = pool.submit(work, item)
+            fut.item = item
+            pending.add(fut)
+            outstanding.add(fut)
+            # Keep parsing and fetching overlapped, without queueing the whole upload
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+            else:
+                done = {f for f in pending if f.done()}
+                pending -= done
+                yield from finished(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    finally:
+        # Stopping early drops the queued fetches; everything that finished is saved either way
+        pool.shutdown(cancel_futures=True)
+        for fut in outstanding:
+            if not fut.cancelled() and fut.exception() is None:
+                added.append(fut.result())
+                unsaved.append(fut.result())
+        save()
+    yield {"status": "done", "added": added, "counts": counts}
+
+
+def new_product(item, retailer=None, price=None, image=None, name=None):
+    """A product dict for an imported item; fields given in the upload win over fetched ones."""
+    price = item.get("price") or price or ""
+    return {
+        "id": str(uuid4()),
+        "name": item.get("name") or name or item["link"],
+        "link": item["link"],
+        "image": item.get("image") or image or "",
+        "price": price,
+        "retailer": item.get("retailer") or retailer,
+        "purchased": False,
+        "reserved": False,
+        **({"price_checked_at": datetime.utcnow().isoformat()} if price else {}),
+    }
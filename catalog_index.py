@@ -0,0 +1,195 @@
+"""
+Search, filter and sort indexes over the catalog, for browsing big lists.
+
+CatalogIndex keeps, for every product in the store:
+
+  - an inverted index of name/retailer words (lowercased, accents folded) ->
+    product ids, plus the sorted vocabulary, so "bab mon" finds "Baby Monitor"
+    by prefix with a bisect per word
+  - retailer (casefolded) -> ids, and how many of them are visible, so the
+    public page's shop menu leaves out shops only hidden items use
+  - a sorted array of (price_value, id), for price ranges
+
+sync(store) brings it up to date: the first call indexes the whole catalog,
+later ones only re-index what store.changes(since) reports, so a write costs
+the next page view a few set operations rather than a rebuild. Prices are
+compared as plain numbers whatever their currency, which is fine for a list
+bought from one country's shops.
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+
+_WORD_RE = re.compile(r"\w+")
+_MAX_ID = "\U0010ffff"
+
+SORTS = ("price", "-price", "name")
+
+
+def _words(text):
+    text = str(text or "").casefold()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return _WORD_RE.findall(text)
+
+
+def _name_key(p):
+    return str(p.get("name") or "").casefold()
+
+
+class CatalogIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None  # store.cache_key() we're up to date with
+        self._version = None  # store.version of the last changes() applied
+        self._reset()
+        # Counters
+        self.rebuilds = 0
+        self.updates = 0
+
+    def _reset(self):
+        # id -> (words, retailer key, price, visible) as indexed; changes() only
+        # has the new version of a product, so this is what has to be taken out again
+        self.entries = {}
+        self.words = {}  # word -> set of ids
+        self.vocabulary = []  # sorted words
+        self.by_retailer = {}  # casefolded retailer -> set of ids
+        self.retailer_names = {}  # casefolded retailer -> name as shown
+        self.visible_retailers = {}  # casefolded retailer -> number of its products that are visible
+        self.prices = []  # sorted (price_value, id)
+
+    # --- keeping up with the store ---
+
+    def sync(self, store):
+        key = store.cache_key()
+        if key == self._key:
+            return
+        with self._lock:
+            if key == self._key:
+                return
+            changes = store.changes(self._version)
+            if changes["full"]:
+                self._reset()
+                for p in changes["products"]:
+                    self._add(p, bulk=True)
+                self.vocabulary.sort()
+                self.prices.sort()
+                self.rebuilds += 1
+            else:
+                for p in changes["products"]:
+                    self._remove(p["id"])
+                    self._add(p)
+                for pid in changes["deleted"]:
+                    self._remove(pid)
+                self.updates += 1
+            self._version = changes["version"]
+            self._key = key
+
+    def _add(self, p, bulk=False):
+        pid = p["id"]
+        words = frozenset(_words(p.get("name")) + _words(p.get("retailer")))
+        retailer = (p.get("retailer") or "").strip()
+        price = p.get("price_value")
+        visible = bool(p.get("visible", True))
+        self.entries[pid] = (words, retailer.casefold(), price, visible)
+        for w in words:
+            ids = self.words.get(w)
+            if ids is None:
+                ids = self.words[w] = set()
+                if bulk:
+                    self.vocabulary.append(w)  # sorted once at the end
+                else:
+                    insort(self.vocabulary, w)
+            ids.add(pid)
+        if retailer:
+            self.by_retailer.setdefault(retailer.casefold(), set()).add(pid)
+            self.retailer_names.setdefault(retailer.casefold(), retailer)
+            if visible:
+                key = retailer.casefold()
+                self.visible_retailers[key] = self.visible_retailers.get(key, 0) + 1
+        if price is not None:
+            if bulk:
+                self.prices.append((price, pid))
+            else:
+                insort(self.prices, (price, pid))
+
+    def _remove(self, pid):
+        entry = self.entries.pop(pid, None)
+        if entry is None:
+            return
+        words, retailer, price, visible = entry
+        for w in words:
+            ids = self.words[w]
+            ids.discard(pid)
+            if not ids:
+                del self.words[w]
+                del self.vocabulary[bisect_left(self.vocabulary, w)]
+        if retailer:
+            ids = self.by_retailer[retailer]
+            ids.discard(pid)
+            if not ids:
+                del self.by_retailer[retailer], self.retailer_names[retailer]
+            if visible:
+                self.visible_retailers[retailer] -= 1
+                if not self.visible_retailers[retailer]:
+                    del self.visible_retailers[retailer]
+        if price is not None:
+            del self.prices[bisect_left(self.prices, (price, pid))]
+
+    # --- querying ---
+
+    def retailers(self, include_hidden=False):
+        """Retailer names for a filter menu, alphabetically; only those of visible products unless `include_hidden`."""
+        with self._lock:
+            keys = self.retailer_names if include_hidden else self.visible_retailers
+            return sorted((self.retailer_names[k] for k in keys), key=str.casefold)
+
+    def _prefix(self, word):
+        ids = set()
+        i = bisect_left(self.vocabulary, word)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+            ids |= self.words[self.vocabulary[i]]
+            i += 1
+        return ids
+
+    def match(self, text="", retailer="", min_price=None, max_price=None):
+        """Ids matching every given filter, or None when there are no filters."""
+        with self._lock:
+            sets = [self._prefix(w) for w in _words(text)]
+            if retailer:
+                sets.append(set(self.by_retailer.get(retailer.strip().casefold(), ())))
+            if min_price is not None or max_price is not None:
+                lo = 0 if min_price is None else bisect_left(self.prices, (min_price,))
+                hi = len(self.prices) if max_price is None else bisect_right(self.prices, (max_price, _MAX_ID))
+                sets.append({pid for _, pid in self.prices[lo:hi]})
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def query(self, products, text="", retailer="", min_price=None, max_price=None, sort=""):
+        """
+        `products` (already in display order) narrowed to the matches and
+        reordered by `sort`: "price", "-price" or "name" ("" keeps the order).
+        Products without a price go last when sorting by price.
+        """
+        ids = self.match(text, retailer, min_price, max_price)
+        if ids is not None:
+            products = [p for p in products if p["id"] in ids]
+        if sort in ("price", "-price"):
+            priced = [p for p in products if p.get("price_value") is not None]
+            priced.sort(key=lambda p: p["price_value"], reverse=sort == "-price")
+            products = priced + [p for p in products if p.get("price_value") is None]
+        elif sort == "name":
+            products = sorted(products, key=_name_key)
+        return products
+
+
+def paginate(items, page, per_page):
+    """(items on `page`, page, number of pages); out-of-range pages are clamped. per_page 0 = one page."""
+    if not per_page:
+        return items, 1, 1
+    pages = max(1, -(-len(items) // per_page))
+    page = min(max(1, page), pages)
+    return items[(page - 1) * per_page:page * per_page], page, pages
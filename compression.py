@@ -0,0 +1,250 @@
+"""
+gzip/brotli for responses, without compressing the same bytes twice.
+
+Upload bandwidth is what limits the Pi when a link to the list goes round a
+big group chat, and the pages compress very well (every card repeats the
+same markup and long retailer URLs). Compressor.compress_response():
+
+  - picks br or gzip from Accept-Encoding (q-values honoured; br only when
+    the Brotli package is installed) and adds Vary: Accept-Encoding
+  - leaves alone small bodies (`min_bytes`), anything already encoded or not
+    text-like (images are compressed already), partial responses and
+    Server-Sent Events
+  - compresses a response that has an ETag once per (path, ETag, encoding)
+    and keeps the result in an LRU bounded by bytes, so repeat views of the
+    same page version are a dict lookup. The ETag is made weak, as the bytes
+    on the wire differ from the identity ones
+  - compresses other streamed responses chunk by chunk with a sync flush, so
+    e.g. bulk import progress lines still arrive as they're written
+
+Static files can be compressed ahead of time instead: precompress() writes
+.gz/.br siblings (`make tailwind-build` does), and static_variant() picks the
+one to send in place of the original, which costs no CPU per request.
+"""
+import gzip
+import importlib.util
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml",
+                      "application/manifest+json", "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon")
+PRECOMPRESS_SUFFIXES = (".css", ".js", ".svg", ".html", ".json", ".txt", ".xml", ".ico", ".map")
+SIBLING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def has_brotli():
+    return importlib.util.find_spec("brotli") is not None
+
+
+def compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES) and mimetype != "text/event-stream"
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        import brotli
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class _Stream:
+    """Incremental encoder; every chunk() is flushed so it can be sent right away."""
+
+    def __init__(self, encoding, level):
+        if encoding == "br":
+            import brotli
+            self._br = brotli.Compressor(quality=level)
+            self._zlib = None
+        else:
+            self._br = None
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data):
+        if self._br is not None:
+            return self._br.process(data) + self._br.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def end(self):
+        if self._br is not None:
+            return self._br.finish()
+        return self._zlib.flush()
+
+
+class Compressor:
+    def __init__(self, min_bytes=1024, gzip_level=6, brotli_quality=5, cache_bytes=16 * 1024 * 1024):
+        self.min_bytes = min_bytes
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+        self.cache_bytes = cache_bytes
+        self.encodings = ("br", "gzip") if has_brotli() else ("gzip",)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (path, etag, encoding) -> bytes, least recently used first
+        self._cached = 0
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.streamed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress_response(self, response, accept, path=""):
+        """
+        Compress a werkzeug response in place for a client whose
+        Accept-Encoding parsed to `accept` (request.accept_encodings).
+        `path` keeps cached bodies of different URLs apart.
+        """
+        if not compressible(response.mimetype) or "Content-Encoding" in response.headers:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = accept.best_match(self.encodings)
+        if encoding is None:
+            return response
+        length = response.content_length
+        if length is not None and length < self.min_bytes:
+            return response
+
+        etag, _ = response.get_etag()
+        if response.is_streamed and not etag:
+            self._stream(response, encoding)
+            return response
+
+        if response.is_sequence:
+            body = response.get_data()
+        else:
+            # A file from send_file(): small enough to read whole
+            try:
+                body = b"".join(response.response)
+            finally:
+                if hasattr(response.response, "close"):
+                    response.response.close()
+            response.direct_passthrough = False
+        if len(body) < self.min_bytes:
+            response.set_data(body)
+            return response
+
+        key = (path, etag, encoding) if etag else None
+        data = self._get(key)
+        if data is None:
+            data = compress(body, encoding, self.levels[encoding])
+            self._put(key, data)
+        with self._lock:
+            self.bytes_in += len(body)
+            self.bytes_out += len(data)
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, response, encoding):
+        source = response.response
+        stream = _Stream(encoding, self.levels[encoding])
+
+        def chunks():
+            size_in = size_out = 0
+            try:
+                for data in source:
+                    if isinstance(data, str):
+                        data = data.encode()
+                    if not data:
+                        continue
+                    out = stream.chunk(data)
+                    size_in += len(data)
+                    size_out += len(out)
+                    yield out
+                out = stream.end()
+                size_out += len(out)
+                yield out
+            finally:
+                if hasattr(source, "close"):
+                    source.close()
+                with self._lock:
+                    self.bytes_in += size_in
+                    self.bytes_out += size_out
+
+        response.response = chunks()
+        response.direct_passthrough = False
+        response.headers.pop("Content-Length", None)
+        response.headers["Content-Encoding"] = encoding
+        with self._lock:
+            self.streamed += 1
+
+    def _get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            data = self._cache.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def _put(self, key, data):
+        if key is None or len(data) > self.cache_bytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = data
+            self._cached += len(data)
+            while self._cached > self.cache_bytes:
+                self._cached -= len(self._cache.popitem(last=False)[1])
+
+    def static_variant(self, path, accept):
+        """(sibling path, encoding) of an up-to-date precompressed copy of `path` the client accepts, or None."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        fresh = {}
+        for encoding in self.encodings:
+            sibling = Path(f"{path}{SIBLING_SUFFIXES[encoding]}")
+            try:
+                # precompress() stamps siblings with the original's mtime; anything else is stale
+                if os.stat(sibling).st_mtime == mtime:
+                    fresh[encoding] = sibling
+            except OSError:
+                continue
+        encoding = accept.best_match(list(fresh)) if fresh else None
+        return (fresh[encoding], encoding) if encoding else None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "streamed": self.streamed,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out, "cached_bytes": self._cached}
+
+
+def precompress(directory, suffixes=PRECOMPRESS_SUFFIXES, min_bytes=256):
+    """
+    Write .gz (and, with Brotli installed, .br) next to every file in
+    `directory` with one of `suffixes`, at the highest levels since this runs
+    once per build. Siblings that wouldn't save anything are removed.
+    Returns [(path, original size, {encoding: size})].
+    """
+    encodings = ("br", "gzip") if has_brotli() else ("gzip",)
+    levels = {"gzip": 9, "br": 11}
+    report = []
+    for path in sorted(Path(directory).rglob("*")):
+        if not path.is_file() or path.suffix.lower() not in suffixes:
+            continue
+        data = path.read_bytes()
+        st = path.stat()
+        sizes = {}
+        for encoding in encodings:
+            sibling = Path(f"{path}{SIBLING_SUFFIXES[encoding]}")
+            packed = compress(data, encoding, levels[encoding]) if len(data) >= min_bytes else None
+            if packed is None or len(packed) >= len(data):
+                sibling.unlink(missing_ok=True)
+                continue
+            tmp = sibling.with_name(sibling.name + ".tmp")
+            tmp.write_bytes(packed)
+            os.utime(tmp, (st.st_atime, st.st_mtime))
+            os.replace(tmp, sibling)
+            sizes[encoding] = len(packed)
+        report.append((path, len(data), sizes))
+    return report
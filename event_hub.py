@@ -0,0 +1,247 @@
+"""
+Live updates for the public page over Server-Sent Events.
+
+Every gunicorn worker runs one hub thread. Connected browsers each get a small
+queue; the hub thread is the only thing that touches the store, so a hundred
+idle pages cost a hundred blocked queue.get() calls and nothing else.
+
+Workers wake each other through a directory of Unix datagram sockets
+(data/events/<pid>.sock): after a write, publish() sends a one-byte nudge to
+every socket in it. The nudge carries no data; the woken hub asks the store
+for changes(since=<last version it saw>) and broadcasts that, so a lost nudge
+only delays an update until the next `poll` interval, and writes made outside
+the web workers (flask refresh-prices, another machine's cron) still show up.
+
+Events use the catalog version as their id, so a browser that reconnects
+sends Last-Event-ID and gets exactly what it missed.
+
+Each open stream also holds a server thread for as long as the page is open,
+so the number of clients is capped by `slots`, a semaphore the hubs of all
+registries in a worker can share.
+"""
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from pathlib import Path
+
+_CLOSE = object()
+
+
+class Subscription:
+    def __init__(self, hub, max_queue):
+        self.hub = hub
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+        self.backlog = ""  # what the client missed before subscribing
+
+    def stream(self):
+        """SSE text chunks for this client; heartbeats keep proxies from closing it."""
+        try:
+            yield f"retry: {self.hub.retry_ms}\n\n" + self.backlog
+            while not self.closed:
+                try:
+                    msg = self.queue.get(timeout=self.hub.heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if msg is _CLOSE:
+                    break
+                yield msg
+        finally:
+            self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, store, bus_dir, render, heartbeat=15, poll=5, max_clients=200, max_queue=50,
+                 retry_ms=3000, slots=None):
+        """
+        `render(changes)` turns a store.changes() result into the event payload
+        (a JSON-able dict), or None when nothing in it is worth sending.
+        `slots` (a threading.BoundedSemaphore) limits clients together with
+        other hubs; without it this hub takes at most `max_clients`.
+        """
+        self.store = store
+        self.bus_dir = Path(bus_dir)
+        self.render = render
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.slots = slots or threading.BoundedSemaphore(max_clients)
+        self.max_queue = max_queue
+        self.retry_ms = retry_ms
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._thread = None
+        self._pid = None
+        self._sock = None
+        self._version = None
+        self._closed = False
+        # Counters
+        self.published = 0
+        self.broadcasts = 0
+        self.dropped_clients = 0
+
+    # --- bus ---
+
+    def _sock_path(self, pid):
+        return self.bus_dir / f"{pid}.sock"
+
+    def _bind(self):
+        self.bus_dir.mkdir(parents=True, exist_ok=True)
+        path = self._sock_path(os.getpid())
+        path.unlink(missing_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(str(path))
+        sock.settimeout(self.poll)
+        return sock
+
+    def publish(self):
+        """Tell every worker's hub (including ours) that the catalog changed."""
+        self.published += 1
+        try:
+            paths = list(self.bus_dir.glob("*.sock"))
+        except OSError:
+            return
+        if not paths:
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.setblocking(False)
+            for path in paths:
+                try:
+                    s.sendto(b"!", str(path))
+                except BlockingIOError:
+                    pass  # its buffer is full of nudges already
+                except (ConnectionRefusedError, FileNotFoundError):
+                    path.unlink(missing_ok=True)  # left behind by a dead worker
+                except OSError:
+                    pass
+
+    def close(self):
+        """Stop this worker's hub thread and end its streams (clients reconnect)."""
+        with self._lock:
+            self._closed = True
+            clients, self._clients = list(self._clients), set()
+            sock, self._sock = self._sock, None
+            mine = self._thread is not None and self._pid == os.getpid()
+        for sub in clients:
+            sub.closed = True
+            self.slots.release()
+            try:
+                sub.queue.put_nowait(_CLOSE)
+            except queue.Full:
+                pass
+        if sock is not None and mine:
+            self._sock_path(os.getpid()).unlink(missing_ok=True)
+            sock.close()
+
+    # --- clients ---
+
+    def _ensure_started(self):
+        # Threads (and the bound socket) don't survive fork: one per worker process
+        with self._lock:
+            if self._closed or (self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()):
+                return
+            self._pid = os.getpid()
+            for _ in self._clients:
+                self.slots.release()  # the parent's streams; their threads didn't come with us
+            self._clients = set()
+            self._version = self.store.version
+            self._sock = self._bind()
+            self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+            self._thread.start()
+
+    def subscribe(self, since=None):
+        """
+        New Subscription, or None if the worker has no slot free.
+        With `since` (a catalog version) the stream starts with what was missed.
+        """
+        self._ensure_started()
+        sub = Subscription(self, self.max_queue)
+        with self._lock:
+            if self._closed or not self.slots.acquire(blocking=False):
+                return None
+            self._clients.add(sub)
+        if since is not None:
+            changes = self.store.changes(since)
+            if changes["version"] != since:
+                sub.backlog = self._format(changes)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.closed = True
+        with self._lock:
+            if sub in self._clients:
+                self._clients.remove(sub)
+                self.slots.release()
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    # --- hub thread ---
+
+    def _format(self, changes):
+        payload = self.render(changes)
+        if payload is None:
+            return ""
+        data = json.dumps(payload, separators=(",", ":"))
+        return f"id: {changes['version']}\nevent: changes\ndata: {data}\n\n"
+
+    def _broadcast(self, msg):
+        with self._lock:
+            clients = list(self._clients)
+        self.broadcasts += 1
+        for sub in clients:
+            try:
+                sub.queue.put_nowait(msg)
+            except queue.Full:
+                # Too far behind: drop it; the browser reconnects with Last-Event-ID
+                self.dropped_clients += 1
+                self.unsubscribe(sub)
+                try:
+                    sub.queue.get_nowait()
+                    sub.queue.put_nowait(_CLOSE)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _check(self):
+        if self.store.version == self._version:
+            return
+        changes = self.store.changes(self._version)
+        self._version = changes["version"]
+        msg = self._format(changes)
+        if msg:
+            self._broadcast(msg)
+
+    def _run(self):
+        sock = self._sock
+        while not self._closed:
+            try:
+                sock.recv(64)
+                # Drain nudges that piled up meanwhile: one store read covers them all
+                sock.setblocking(False)
+                try:
+                    while sock.recv(64):
+                        pass
+                except (BlockingIOError, OSError):
+                    pass
+                sock.settimeout(self.poll)
+            except socket.timeout:
+                if not self._closed and not self._sock_path(os.getpid()).exists():
+                    # Socket file removed under us (e.g. data/ wiped): nobody can reach us, rebind
+                    try:
+                        sock.close()
+                        sock = self._sock = self._bind()
+                    except OSError:
+                        time.sleep(self.poll)
+            except OSError:
+                if self._closed:
+                    break
+                time.sleep(self.poll)
+            try:
+                self._check()
+            except Exception:
+                # Never let a bad read kill the hub; try again on the next wake-up
+                pass
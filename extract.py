@@ -0,0 +1,292 @@
+"""
+Single-pass product metadata extraction.
+
+extract_product_metadata() walks the tags we care about (<meta>, <img>,
+<script> and anything with itemprop=) with one regex scan over the document,
+decodes each JSON-LD block once, and returns price, currency, image, name and
+availability together. It stops scanning as soon as every top-priority source
+has been seen (JSON-LD offer price, og:image, a product name), which on most
+retailer pages is somewhere in <head>.
+
+Source priority matches the old per-field fetchers:
+  price:    JSON-LD offers > og:price:amount > product:price:amount
+            > meta name=price > meta itemprop=price > itemprop=price content
+            > itemprop=price visible text
+  currency: JSON-LD priceCurrency > og/product:price:currency
+            > itemprop=priceCurrency > meta name=currency
+  image:    og:image > twitter:image > twitter:image:src > JSON-LD image
+            > largest <img> (excluding sprites/logos/icons)
+"""
+import html as htmllib
+import json
+import re
+from urllib.parse import urljoin
+
+_TAG_RE = re.compile(
+    r"<(?:"
+    r"(?P<void>meta|img)\b(?P<vattrs>[^>]*)>"
+    r"|script\b(?P<sattrs>[^>]*)>(?P<sbody>.*?)</script\s*>"
+    r"|title\b[^>]*>(?P<title>[^<]*)"
+    r"|(?P<tag>[a-z][a-z0-9]*)\b(?P<iattrs>[^>]*\bitemprop\s*=[^>]*)>(?P<itext>[^<]*)"
+    r")",
+    re.I | re.S,
+)
+_ATTR_RE = re.compile(r"""([a-zA-Z_:][-a-zA-Z0-9_:.]*)\s*(?:=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+)))?""")
+_VISIBLE_PRICE_RE = re.compile(r"[^£€$]*[£€$]?\s?\d+[.,]?\d*")
+
+# (attribute, key) -> rank; lower wins
+_META_PRICE = {("property", "og:price:amount"): 1, ("property", "product:price:amount"): 2,
+               ("name", "price"): 3, ("itemprop", "price"): 4}
+_META_CURRENCY = {("property", "og:price:currency"): 1, ("property", "product:price:currency"): 2,
+                  ("itemprop", "pricecurrency"): 3, ("name", "currency"): 4}
+_META_IMAGE = {("property", "og:image"): 1, ("name", "twitter:image"): 2, ("name", "twitter:image:src"): 3}
+_META_NAME = {("property", "og:title"): 1, ("name", "twitter:title"): 2}
+_META_AVAILABILITY = {("property", "og:availability"): 1, ("property", "product:availability"): 2}
+
+# JSON-LD beats every meta source
+_JSONLD = 0
+# Ranks for the body-only fallbacks
+_ITEMPROP_CONTENT = 5
+_ITEMPROP_TEXT = 6
+_JSONLD_IMAGE = 4
+_TITLE_TAG = 3
+
+_SKIP_IMG = ("sprite", "logo", "icon", "favicon", "placeholder")
+_SKIP_IMG_CLASS = ("sprite", "logo", "icon", "avatar")
+
+
+def parse_attrs(raw: str) -> dict:
+    out = {}
+    for m in _ATTR_RE.finditer(raw):
+        key = m.group(1).lower()
+        if key not in out:
+            val = m.group(2) if m.group(2) is not None else m.group(3) if m.group(3) is not None else m.group(4)
+            out[key] = htmllib.unescape(val or "")
+    return out
+
+
+def format_price(price, currency=None) -> str:
+    price_str = str(price).strip()
+    if currency and not price_str.startswith(currency):
+        return f"{currency} {price_str}".strip()
+    return price_str
+
+
+_CURRENCY_SYMBOLS = {"£": "GBP", "€": "EUR", "$": "USD"}
+_PRICE_NUMBER_RE = re.compile(r"\d[\d.,\s]*")
+_SIMPLE_PRICE_RE = re.compile(r"([£€$]?)(\d+(?:\.\d+)?)")
+_CURRENCY_CODE_RE = re.compile(r"\b(GBP|EUR|USD|CAD|AUD|NZD|CHF|SEK|NOK|DKK|PLN|JPY)\b")
+
+
+def parse_price(price):
+    """
+    (amount, currency) from a stored price such as "GBP 250.00", "£19.99",
+    "1,299.00" or "12,50 €"; either part is None when it can't be found.
+    """
+    if price is None or isinstance(price, bool):
+        return None, None
+    if isinstance(price, (int, float)):
+        return float(price), None
+    text = str(price).strip()
+    m = _SIMPLE_PRICE_RE.fullmatch(text)
+    if m:
+        # The usual "£19.99" / "19.99"
+        return float(m.group(2)), _CURRENCY_SYMBOLS.get(m.group(1))
+    currency = next((code for sym, code in _CURRENCY_SYMBOLS.items() if sym in text), None)
+    if currency is None:
+        m = _CURRENCY_CODE_RE.search(text.upper())
+        currency = m.group(1) if m else None
+    m = _PRICE_NUMBER_RE.search(text)
+    if not m:
+        return None, None
+    num = re.sub(r"\s", "", m.group(0)).rstrip(".,")
+    if "," in num and "." in num:
+        # Whichever comes last is the decimal point
+        if num.rfind(",") > num.rfind("."):
+            num = num.replace(".", "").replace(",", ".")
+        else:
+            num = num.replace(",", "")
+    elif "," in num:
+        # "12,50" is a decimal comma, "1,299" a thousands separator
+        head, _, tail = num.rpartition(",")
+        num = f"{head.replace(',', '')}.{tail}" if len(tail) == 2 and "," not in head else num.replace(",", "")
+    elif num.count(".") > 1:
+        num = num.replace(".", "")
+    try:
+        return float(num), currency
+    except ValueError:
+        return None, currency
+
+
+def _to_int(v):
+    try:
+        return int(re.sub(r"[^0-9]", "", str(v)))
+    except Exception:
+        return 0
+
+
+def _img_score(a: dict) -> int:
+    src = (a.get("src") or "").lower()
+    cls = (a.get("class") or "").lower()
+    if any(x in src for x in _SKIP_IMG) or any(x in cls for x in _SKIP_IMG_CLASS):
+        return -1
+    w = _to_int(a.get("width") or a.get("data-width") or a.get("data-image-width"))
+    h = _to_int(a.get("height") or a.get("data-height") or a.get("data-image-height"))
+    # If no dims, give a small base score
+    if w == 0 or h == 0:
+        return 100
+    return w * h
+
+
+def _jsonld_nodes(data):
+    """Top-level nodes of a JSON-LD block, including anything under @graph."""
+    nodes = data if isinstance(data, list) else [data]
+    for node in nodes:
+        if not isinstance(node, dict):
+            continue
+        yield node
+        graph = node.get("@graph")
+        if isinstance(graph, list):
+            for g in graph:
+                if isinstance(g, dict):
+                    yield g
+
+
+class _Result:
+    """Best value seen so far for each field, with the rank of its source."""
+
+    FIELDS = ("price", "currency", "image", "name", "availability")
+
+    def __init__(self):
+        self.best = {f: (99, None) for f in self.FIELDS}
+
+    def offer(self, field, rank, value):
+        if value is None:
+            return
+        value = str(value).strip()
+        if value and rank < self.best[field][0]:
+            self.best[field] = (rank, value)
+
+    def rank(self, field):
+        return self.best[field][0]
+
+    def value(self, field):
+        return self.best[field][1]
+
+
+def extract_product_metadata(html: str, base_url: str = "") -> dict:
+    """
+    Extract product metadata from a page in one pass.
+    Returns {"price", "currency", "image", "name", "availability"}; missing fields are None.
+    `price` is the raw amount; use format_price(price, currency) for display.
+    """
+    return _extract(html, base_url)[0]
+
+
+def metadata_complete(html: str) -> bool:
+    """
+    True once `html` (possibly just the start of a page) already holds every
+    top-priority source, so reading the rest of the page can't change the result.
+    Used to stop streaming downloads early.
+    """
+    return _extract(html)[1]
+
+
+def _extract(html, base_url=""):
+    r = _Result()
+    complete = False
+    best_img, best_img_score = None, -1
+
+    for m in _TAG_RE.finditer(html):
+        void = m.group("void")
+        if void:
+            a = parse_attrs(m.group("vattrs"))
+            if void.lower() == "meta":
+                content = a.get("content")
+                if not content:
+                    continue
+                for attr in ("property", "name", "itemprop"):
+                    key = (attr, (a.get(attr) or "").lower())
+                    r.offer("price", _META_PRICE.get(key, 99), content)
+                    r.offer("currency", _META_CURRENCY.get(key, 99), content)
+                    r.offer("image", _META_IMAGE.get(key, 99), content)
+                    r.offer("name", _META_NAME.get(key, 99), content)
+                    r.offer("availability", _META_AVAILABILITY.get(key, 99), content)
+            elif a.get("src"):
+                score = _img_score(a)
+                if score > best_img_score:
+                    best_img, best_img_score = a["src"], score
+
+        elif m.group("sbody") is not None:
+            if "application/ld+json" not in m.group("sattrs").lower():
+                continue
+            try:
+                data = json.loads(m.group("sbody").strip())
+            except Exception:
+                continue
+            for node in _jsonld_nodes(data):
+                if r.rank("price") > _JSONLD and node.get("offers"):
+                    offers = node["offers"]
+                    for offer in offers if isinstance(offers, list) else [offers]:
+                        if not isinstance(offer, dict):
+                            continue
+                        spec = offer.get("priceSpecification")
+                        spec = spec if isinstance(spec, dict) else {}
+                        price = offer.get("price") or offer.get("lowPrice") or spec.get("price")
+                        if price:
+                            r.offer("price", _JSONLD, price)
+                            r.offer("currency", _JSONLD, offer.get("priceCurrency") or spec.get("priceCurrency"))
+                            availability = offer.get("availability")
+                            if isinstance(availability, str):
+                                r.offer("availability", _JSONLD, availability.rsplit("/", 1)[-1])
+                            break
+                    if node.get("name") and isinstance(node["name"], str):
+                        r.offer("name", _JSONLD, node["name"])
+                if "image" in node:
+                    img = node["image"]
+                    for c in img if isinstance(img, list) else [img]:
+                        if isinstance(c, dict):
+                            c = c.get("url")
+                        if isinstance(c, str) and c.strip():
+                            r.offer("image", _JSONLD_IMAGE, c)
+                            break
+
+        elif m.group("title") is not None:
+            r.offer("name", _TITLE_TAG, htmllib.unescape(m.group("title")))
+
+        elif m.group("tag"):
+            a = parse_attrs(m.group("iattrs"))
+            prop = (a.get("itemprop") or "").lower()
+            if prop == "pricecurrency":
+                r.offer("currency", 3, a.get("content"))
+                continue
+            if prop != "price":
+                continue
+            if a.get("content"):
+                r.offer("price", _ITEMPROP_CONTENT, a["content"])
+            else:
+                t = _VISIBLE_PRICE_RE.match(m.group("itext"))
+                if t:
+                    r.offer("price", _ITEMPROP_TEXT, t.group(0))
+
+        # Every field has come from its top-priority source: nothing later can win
+        if r.rank("price") == _JSONLD and r.rank("image") == 1 and r.rank("name") <= 1:
+            complete = True
+            break
+
+    image = r.value("image")
+    if image is None and best_img:
+        image = best_img
+    if image:
+        try:
+            image = urljoin(base_url, image.strip())
+        except Exception:
+            image = None
+
+    return {
+        "price": r.value("price"),
+        "currency": r.value("currency"),
+        "image": image or None,
+        "name": r.value("name"),
+        "availability": r.value("availability"),
+    }, complete
@@ -0,0 +1,88 @@
+"""
+Rendered HTML for single products, so a page render is mostly string joins.
+
+The public page and the admin list render one card per product, and almost
+all of them are the same as last time. FragmentCache keeps each product's
+card per template, keyed by product id and checked against the product's
+content (its fields as a tuple, compared by value): an entry whose product
+changed since it was rendered is simply a miss, so workers never serve a
+stale card even when the write happened in another worker. Write routes also
+drop the entries of the products they touched, so the memory goes right away.
+
+Anything that isn't in the product but ends up in the HTML (the template
+files, URL prefixes, thumbnail widths) goes into a `salt`; when the salt
+changes every entry of that template is dropped.
+"""
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (kind, product id) -> (content, html), least recently used first
+        self._salts = {}  # kind -> salt the current entries were rendered with
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def content(product):
+        return tuple(product.items())
+
+    def render_all(self, kind, salt, products, render):
+        """HTML for each product, in order; `render(product)` fills in the misses."""
+        if not self.max_entries:
+            return [render(p) for p in products]
+        with self._lock:
+            if self._salts.get(kind) != salt:
+                for key in [k for k in self._entries if k[0] == kind]:
+                    del self._entries[key]
+                self._salts[kind] = salt
+            entries = self._entries
+            out, missing = [], []
+            for p in products:
+                key = (kind, p["id"])
+                entry = entries.get(key)
+                if entry is not None and entry[0] == self.content(p):
+                    entries.move_to_end(key)
+                    out.append(entry[1])
+                else:
+                    missing.append(len(out))
+                    out.append(None)
+            self.hits += len(out) - len(missing)
+            self.misses += len(missing)
+
+        # Render outside the lock; two requests racing on the same miss just both render it
+        rendered = [(products[i], render(products[i])) for i in missing]
+        for (p, html), i in zip(rendered, missing):
+            out[i] = html
+        if rendered:
+            with self._lock:
+                if self._salts.get(kind) == salt:
+                    for p, html in rendered:
+                        self._entries[(kind, p["id"])] = (self.content(p), html)
+                        self._entries.move_to_end((kind, p["id"]))
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+        return out
+
+    def invalidate(self, *product_ids):
+        """Forget the given products' fragments (every template)."""
+        with self._lock:
+            kinds = list(self._salts)
+            for pid in product_ids:
+                for kind in kinds:
+                    self._entries.pop((kind, pid), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._salts.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self._entries)}
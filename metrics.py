@@ -0,0 +1,278 @@
+"""
+In-process metrics with Prometheus text output.
+
+Counters and histograms live in a plain dict per process, guarded by one
+lock; recording is a dict lookup and a few additions. With several gunicorn
+workers each process writes its numbers to data/metrics/<pid>.json every few
+seconds, and /metrics adds up the files of all live workers, so a scrape sees
+the whole server rather than whichever worker answered it.
+
+Collectors are callables that return extra (name, labels, value) samples read
+from other objects (page cache, Telegram dispatcher) at snapshot time.
+
+SlowRequestSampler is a tiny sampling profiler: a background thread looks at
+the stacks of requests that have been running longer than half the threshold,
+so a slow request can be logged together with where it spent its time.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# Seconds; tuned for a small Flask app (sub-ms cache hits up to the 6s fetch timeout)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 6, 10)
+
+log = logging.getLogger(__name__)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")  # noqa: E731
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class Metrics:
+    def __init__(self, prefix="", buckets=DEFAULT_BUCKETS, snapshot_dir=None, snapshot_interval=5):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._help = {}  # name -> (type, help)
+        self._collectors = []
+        self._last_flush = 0.0
+        self._pid = os.getpid()
+
+    def describe(self, name, kind, help_text):
+        self._help[self.prefix + name] = (kind, help_text)
+
+    def add_collector(self, fn):
+        """fn() -> iterable of (name, labels dict, value); reported as gauges. Usable as a decorator."""
+        self._collectors.append(fn)
+        return fn
+
+    def _check_fork(self):
+        # A forked worker starts with the parent's numbers; they're the parent's to report
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._counters, self._histograms = {}, {}
+
+    # --- recording ---
+
+    def inc(self, name, value=1, **labels):
+        key = (self.prefix + name, _labels_key(labels))
+        with self._lock:
+            self._check_fork()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (self.prefix + name, _labels_key(labels))
+        with self._lock:
+            self._check_fork()
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[i] += 1
+                    break
+            h[-2] += seconds
+            h[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    # --- snapshots across workers ---
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            counters = [[n, list(map(list, k)), v] for (n, k), v in self._counters.items()]
+            histograms = [[n, list(map(list, k)), list(h)] for (n, k), h in self._histograms.items()]
+        gauges = []
+        for fn in self._collectors:
+            try:
+                for name, labels, value in fn():
+                    gauges.append([self.prefix + name, list(map(list, _labels_key(labels))), value])
+            except Exception:
+                log.exception("metrics collector failed")
+        return {"buckets": list(self.buckets), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def flush(self, force=False):
+        """Write this worker's snapshot for the others to read (at most every snapshot_interval)."""
+        if not self.snapshot_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.snapshot_interval:
+            return
+        self._last_flush = now
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            path = self.snapshot_dir / f"{os.getpid()}.json"
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.snapshot()))
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _snapshots(self):
+        if not self.snapshot_dir:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snaps = []
+        for f in self.snapshot_dir.glob("*.json"):
+            try:
+                pid = int(f.stem)
+                if pid != os.getpid():
+                    os.kill(pid, 0)
+                snaps.append(json.loads(f.read_text()))
+            except ProcessLookupError:
+                f.unlink(missing_ok=True)  # worker is gone
+            except (ValueError, OSError):
+                continue
+        return snaps
+
+    # --- exposition ---
+
+    def render(self):
+        """All workers' metrics in the Prometheus text format (version 0.0.4)."""
+        counters, histograms, gauges = {}, {}, {}
+        for snap in self._snapshots():
+            if snap["buckets"] != list(self.buckets):
+                continue  # written by a worker running different code; skip until it restarts
+            for name, key, value in snap["counters"]:
+                k = (name, tuple(map(tuple, key)))
+                counters[k] = counters.get(k, 0) + value
+            for name, key, h in snap["histograms"]:
+                k = (name, tuple(map(tuple, key)))
+                acc = histograms.setdefault(k, [0] * len(h))
+                for i, v in enumerate(h):
+                    acc[i] += v
+            for name, key, value in snap["gauges"]:
+                k = (name, tuple(map(tuple, key)))
+                gauges[k] = gauges.get(k, 0) + value
+
+        lines = []
+        seen = set()
+
+        def header(name, default_kind):
+            if name in seen:
+                return
+            seen.add(name)
+            kind, help_text = self._help.get(name, (default_kind, ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+        for (name, key), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+        for (name, key), h in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), h[:-2] + [h[-1] - sum(h[:-2])]):
+                cumulative += n
+                lines.append(f"{name}_bucket{_fmt_labels(key, [('le', _fmt_value(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(h[-2])}")
+            lines.append(f"{name}_count{_fmt_labels(key)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestSampler:
+    def __init__(self, threshold, root=None, interval=0.01, max_stacks=5, logger=None):
+        """`root`: only frames from files under this directory are shown (plus the innermost one)."""
+        self.threshold = threshold
+        self.root = str(root) if root else None
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.log = logger or log
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> [start, Counter of stacks]
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._active = {}
+            self._thread = threading.Thread(target=self._run, name="slow-request-sampler", daemon=True)
+            self._thread.start()
+
+    def begin(self):
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = [time.perf_counter(), Counter()]
+
+    def end(self, description):
+        """Stop watching this thread's request; log it if it was slow. Returns True if slow."""
+        with self._lock:
+            entry = self._active.pop(threading.get_ident(), None)
+        if entry is None:
+            return False
+        elapsed = time.perf_counter() - entry[0]
+        if elapsed < self.threshold:
+            return False
+        samples = entry[1]
+        total = sum(samples.values())
+        lines = [f"slow request: {description} took {elapsed * 1000:.0f}ms"]
+        for stack, n in samples.most_common(self.max_stacks):
+            lines.append(f"  {n}/{total} samples at:\n{stack}")
+        self.log.warning("\n".join(lines))
+        return True
+
+    def _describe(self, frame):
+        frames = traceback.extract_stack(frame)
+        ours = [f for f in frames if not self.root or
+                (f.filename.startswith(self.root) and "site-packages" not in f.filename)][-6:]
+        # Our code says which call was slow; the innermost frame says what it was waiting on
+        if frames and (not ours or ours[-1] is not frames[-1]):
+            ours.append(frames[-1])
+        return "".join(traceback.format_list(ours))
+
+    def _run(self):
+        half = self.threshold / 2
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                watching = [(tid, e) for tid, e in self._active.items() if now - e[0] >= half]
+            if not watching:
+                continue
+            frames = sys._current_frames()
+            for tid, entry in watching:
+                frame = frames.get(tid)
+                if frame is not None:
+                    stack = self._describe(frame)
+                    with self._lock:
+                        if self._active.get(tid) is entry:
+                            entry[1][stack] += 1
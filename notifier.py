@@ -0,0 +1,150 @@
+"""
+Background Telegram notifications.
+
+The request path only enqueues a message; a worker thread drains the queue,
+coalesces bursts (e.g. several gifts marked within a few seconds) into one
+digest, and fans it out to every chat id concurrently over one keep-alive
+requests.Session, retrying failed sends with exponential backoff.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_STOP = object()
+
+
+class TelegramDispatcher:
+    def __init__(self, token, chat_ids, api_base="https://api.telegram.org",
+                 max_queue=100, coalesce_seconds=2.0, retries=3, backoff=1.0, timeout=5):
+        self.token = token
+        self.chat_ids = list(chat_ids)
+        self.api_base = api_base.rstrip("/")
+        self.coalesce_seconds = coalesce_seconds
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # Counters (best-effort, for debugging/metrics)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        # Optional on_send(seconds, outcome) hook, called from the worker after each chat's send
+        self.on_send = None
+        self.session = None
+        self._pool = None
+
+    @property
+    def url(self):
+        return f"{self.api_base}/bot{self.token}/sendMessage"
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so (re)start lazily in each gunicorn worker
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            # Imported here: requests is slow to import and only needed once there's something to send
+            import requests
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max(len(self.chat_ids), 1))
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self._pool = ThreadPoolExecutor(max_workers=max(len(self.chat_ids), 1))
+            self._thread = threading.Thread(target=self._run, name="telegram-dispatcher", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, message: str) -> bool:
+        """Queue a message without blocking. Returns False if it was dropped."""
+        if not (self.token and self.chat_ids):
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def shutdown(self, timeout=10):
+        """Send whatever is still queued (no coalescing delay) and stop the worker."""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            stopping = False
+            # Collect anything else that arrives within the coalescing window
+            deadline = time.monotonic() + self.coalesce_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._dispatch(self._digest(batch))
+            except Exception:
+                # never let a send error kill the worker
+                self.failed += 1
+            if stopping:
+                return
+
+    @staticmethod
+    def _digest(batch):
+        if len(batch) == 1:
+            return batch[0]
+        return f"🎁 {len(batch)} updates:\n\n" + "\n\n".join(batch)
+
+    def _dispatch(self, message):
+        futures = [self._pool.submit(self._send, chat_id, message) for chat_id in self.chat_ids]
+        for f in futures:
+            f.result()
+
+    def _send(self, chat_id, message):
+        t0 = time.perf_counter()
+        outcome = self._send_with_retries(chat_id, message)
+        if self.on_send:
+            self.on_send(time.perf_counter() - t0, outcome)
+
+    def _send_with_retries(self, chat_id, message):
+        for attempt in range(self.retries):
+            try:
+                resp = self.session.post(self.url, json={"chat_id": chat_id, "text": message},
+                                         timeout=self.timeout)
+                # 4xx (bad chat id, bad token) won't get better by retrying; 429/5xx might
+                if resp.status_code < 500 and resp.status_code != 429:
+                    if resp.ok:
+                        self.sent += 1
+                        return "sent"
+                    self.failed += 1
+                    return "rejected"
+            except Exception:
+                pass
+            if attempt + 1 < self.retries:
+                time.sleep(self.backoff * (2 ** attempt))
+        self.failed += 1
+        return "failed"
+
+    def register_shutdown(self):
+        atexit.register(self.shutdown)
+        return self
@@ -0,0 +1,273 @@
+"""
+Shared cache for retailer product pages.
+
+The price and image fetchers both read the same product page, so they go
+through one PageCache instead of calling requests.get themselves. Entries are
+keyed by a normalised URL, bounded by total size with LRU eviction, and
+optionally mirrored to disk so they survive restarts. Once an entry is older
+than the TTL it is revalidated with a conditional GET (If-None-Match /
+If-Modified-Since), so an unchanged page costs a 304 instead of a download.
+
+Downloads are streamed: chunks are decoded incrementally (gzip is handled by
+requests, the charset comes from the Content-Type header or a <meta charset>
+sniffed from the first chunk), reading stops at `max_page_bytes`, and callers
+can pass `stop_when` to end the download as soon as the part read so far has
+everything they need. Product pages are often several MB, but the structured
+data we want is usually near the top.
+
+`timeout` is also a deadline for the whole fetch: requests only limits each
+wait for the socket, so a server dripping a few bytes at a time could
+otherwise hold a fetch open indefinitely. Past the deadline the download is
+closed and requests.ReadTimeout raised.
+"""
+import codecs
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+USER_AGENT = "Mozilla/5.0"
+
+_CT_CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.I)
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", re.I)
+
+
+def detect_encoding(content_type: str, head: bytes) -> str:
+    """Charset from the header, else a BOM or <meta charset> in the first bytes, else UTF-8."""
+    candidates = []
+    m = _CT_CHARSET_RE.search(content_type or "")
+    if m:
+        candidates.append(m.group(1))
+    if head.startswith(codecs.BOM_UTF8):
+        candidates.append("utf-8-sig")
+    m = _META_CHARSET_RE.search(head[:4096])
+    if m:
+        candidates.append(m.group(1).decode("ascii", "ignore"))
+    for name in candidates:
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+def normalise_url(url: str) -> str:
+    """Cache key: lowercase scheme/host, no fragment, no utm_* tracking params."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if parts.port and not (parts.scheme == "http" and parts.port == 80) \
+            and not (parts.scheme == "https" and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                       if not k.lower().startswith("utm_")])
+    return urlunsplit((parts.scheme.lower(), host, parts.path or "/", query, ""))
+
+
+def _response_socket(resp):
+    """The socket a streamed requests response is reading from, or None."""
+    sock = getattr(getattr(resp.raw, "connection", None), "sock", None)
+    if sock is None:
+        # When the server closes after the response, http.client hands the socket over to the response's file
+        fp = getattr(getattr(resp.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    return sock
+
+
+class PageCache:
+    def __init__(self, ttl=3600, max_bytes=16 * 1024 * 1024, cache_dir=None, session=None,
+                 max_page_bytes=1024 * 1024, chunk_size=16 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_page_bytes = max_page_bytes
+        self.chunk_size = chunk_size
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._session = session
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> entry dict, least recently used first
+        self._bytes = 0
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.early_stops = 0
+        self.capped = 0
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_from_disk()
+
+    @property
+    def session(self):
+        # requests is slow to import; nothing needs it until the first fetch
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    # --- bookkeeping ---
+
+    def _disk_path(self, key):
+        return self.cache_dir / (hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _load_from_disk(self):
+        files = sorted(self.cache_dir.glob("*.json"), key=lambda f: f.stat().st_mtime)
+        for f in files:
+            try:
+                entry = json.loads(f.read_text(encoding="utf-8"))
+            except Exception:
+                f.unlink(missing_ok=True)
+                continue
+            self._insert(entry["key"], entry, persist=False)
+
+    def _insert(self, key, entry, persist=True):
+        entry["size"] = len(entry["text"].encode("utf-8"))  # bytes, like max_bytes; not characters
+        old = self._entries.pop(key, None)
+        if old:
+            self._bytes -= old["size"]
+        self._entries[key] = entry
+        self._bytes += entry["size"]
+        if persist and self.cache_dir:
+            try:
+                # Non-ASCII as UTF-8, not \u escapes, so the file is about `size` bytes too
+                self._disk_path(key).write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            except OSError:
+                pass
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old = self._entries.popitem(last=False)
+            self._bytes -= old["size"]
+            self.evictions += 1
+            if self.cache_dir:
+                self._disk_path(old_key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+                "early_stops": self.early_stops,
+                "capped": self.capped,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    # --- fetching ---
+
+    def _read(self, resp, stop_when, deadline=None):
+        """Stream and decode the body; returns (text, stopped_early)."""
+        import requests
+
+        expired = threading.Event()
+        watchdog = None
+        if deadline is not None:
+            def expire():
+                expired.set()
+                # Closing the response alone doesn't wake a read blocked on the socket; shutting it down does
+                sock = _response_socket(resp)
+                try:
+                    if sock is not None:
+                        sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                resp.close()
+
+            watchdog = threading.Timer(max(deadline - time.monotonic(), 0), expire)
+            watchdog.daemon = True
+            watchdog.start()
+        decoder = None
+        parts = []
+        size = 0
+        next_check = self.chunk_size * 4
+        stopped = False
+        try:
+            for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                if decoder is None:
+                    encoding = detect_encoding(resp.headers.get("Content-Type", ""), chunk)
+                    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+                parts.append(decoder.decode(chunk))
+                size += len(chunk)
+                if size >= self.max_page_bytes:
+                    self.capped += 1
+                    stopped = True
+                    break
+                # Check at doubling sizes so the total re-scan cost stays linear
+                if stop_when and size >= next_check:
+                    next_check *= 2
+                    text = "".join(parts)
+                    parts = [text]
+                    if stop_when(text):
+                        self.early_stops += 1
+                        stopped = True
+                        break
+            if decoder:
+                parts.append(decoder.decode(b"", final=True))
+        except Exception:
+            if not expired.is_set():
+                raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            resp.close()
+        # Closing the response may just look like the end of the body, so check either way
+        if expired.is_set():
+            raise requests.ReadTimeout(f"{resp.url}: body not read within the timeout")
+        return "".join(parts), stopped
+
+    def get_text(self, url: str, timeout=6, stop_when=None) -> str:
+        """
+        Return the page body for url, from cache when fresh. Raises like
+        requests would (timeouts, HTTP errors), so callers keep their try/except;
+        `timeout` (seconds) bounds the whole fetch, body included.
+        `stop_when(text_so_far)` may end the download early; the cached body is
+        then just the part that was read.
+        """
+        key = normalise_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                if time.time() - entry["fetched_at"] < self.ttl:
+                    self.hits += 1
+                    self.bytes_saved += entry["size"]
+                    return entry["text"]
+
+        headers = {"User-Agent": USER_AGENT}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        deadline = time.monotonic() + timeout
+        resp = self.session.get(url, timeout=timeout, headers=headers, stream=True)
+        if entry and resp.status_code == 304:
+            resp.close()
+            with self._lock:
+                self.revalidated += 1
+                self.bytes_saved += entry["size"]
+                entry["fetched_at"] = time.time()
+                self._insert(key, entry)
+                return entry["text"]
+        if not resp.ok:
+            resp.close()
+            resp.raise_for_status()
+        text, partial = self._read(resp, stop_when, deadline)
+        with self._lock:
+            self.misses += 1
+            self._insert(key, {
+                "key": key,
+                "text": text,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "partial": partial,
+            })
+            return text
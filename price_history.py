@@ -0,0 +1,343 @@
+"""
+Per-product price history, kept out of products.json.
+
+Every observed price goes into data/price_history/<product id>.bin as one
+15-byte record: unix time (uint32), price (float64) and ISO currency code
+(3 ASCII bytes, blank when unknown), little-endian. Files are only appended
+to, one O_APPEND write per batch so workers can't interleave half records,
+except when downsample() rewrites one (temp file + rename, under an flock
+that appends share).
+
+In memory a product's history is a PriceSeries: array columns plus running
+low/high/latest, so those answers never scan the history. Series are loaded
+on first use, kept in an LRU of `max_series`, and caught up by reading only
+the records other workers appended since (the file's inode and size tell).
+
+Past `raw_days`, each day keeps only its lowest and highest observation, so
+extremes and the overall shape survive while an item checked twice a day for
+a year stays a few kilobytes. That happens once a series has grown by
+`downsample_after` points since it was last downsampled.
+
+record_many() reports price drops: an observation at least `drop_percent`
+below the previous one in the same currency. delete() removes a product's
+file when the product is deleted.
+
+The JSON-lines file of earlier versions (price_history.jsonl) is imported on
+first use and renamed to price_history.jsonl.imported.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from extract import parse_price
+
+RECORD = struct.Struct("<Id3s")
+DAY = 86400
+_SAFE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_SYMBOLS = {"GBP": "£", "EUR": "€", "USD": "$"}
+
+
+def format_money(value, currency=None):
+    symbol = _SYMBOLS.get(currency)
+    if symbol:
+        return f"{symbol}{value:,.2f}"
+    return f"{currency} {value:,.2f}" if currency else f"{value:,.2f}"
+
+
+class PriceSeries:
+    """One product's observations as columns, oldest first, with running extremes."""
+
+    def __init__(self):
+        self.times = array("I")
+        self.prices = array("d")
+        self.currency_ids = array("B")  # index into self.currencies
+        self.currencies = []
+        self._low = self._high = None  # indexes
+        self.downsampled_len = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, t, price, currency=None):
+        if currency not in self.currencies:
+            self.currencies.append(currency)
+        self.times.append(int(t))
+        self.prices.append(price)
+        self.currency_ids.append(self.currencies.index(currency))
+        i = len(self.prices) - 1
+        if self._low is None or price < self.prices[self._low]:
+            self._low = i
+        if self._high is None or price > self.prices[self._high]:
+            self._high = i
+
+    def extend_bytes(self, data):
+        for t, price, code in RECORD.iter_unpack(data):
+            self.append(t, price, code.decode("ascii").strip() or None)
+
+    def point(self, i):
+        """(time, price, currency) of observation i."""
+        return self.times[i], self.prices[i], self.currencies[self.currency_ids[i]]
+
+    @property
+    def latest(self):
+        return self.point(len(self) - 1) if len(self) else None
+
+    @property
+    def low(self):
+        return None if self._low is None else self.point(self._low)
+
+    @property
+    def high(self):
+        return None if self._high is None else self.point(self._high)
+
+    def points(self, max_points=None):
+        """[(time, price)] oldest first; with `max_points`, the low and high of equal slices."""
+        n = len(self)
+        if not max_points or n <= max_points:
+            return list(zip(self.times, self.prices))
+        out = []
+        buckets = max(1, max_points // 2)
+        for b in range(buckets):
+            lo, hi = b * n // buckets, (b + 1) * n // buckets
+            if lo == hi:
+                continue
+            seg = range(lo, hi)
+            i_min = min(seg, key=self.prices.__getitem__)
+            i_max = max(seg, key=self.prices.__getitem__)
+            out.extend((self.times[i], self.prices[i]) for i in sorted({i_min, i_max}))
+        return out
+
+    def to_bytes(self):
+        return b"".join(RECORD.pack(*self._packable(i)) for i in range(len(self)))
+
+    def _packable(self, i):
+        t, price, currency = self.point(i)
+        return t, price, (currency or "").encode("ascii")[:3].ljust(3)
+
+
+def downsampled(series, cutoff):
+    """A new PriceSeries where points before `cutoff` are reduced to each day's low and high."""
+    out = PriceSeries()
+    days = defaultdict(list)
+    recent = []
+    for i in range(len(series)):
+        if series.times[i] < cutoff:
+            days[series.times[i] // DAY].append(i)
+        else:
+            recent.append(i)
+    keep = []
+    for idx in days.values():
+        keep += {min(idx, key=series.prices.__getitem__), max(idx, key=series.prices.__getitem__)}
+    for i in sorted(keep, key=lambda i: (series.times[i], i)) + recent:
+        out.append(*series.point(i))
+    out.downsampled_len = len(out)
+    return out
+
+
+class PriceHistory:
+    def __init__(self, directory, raw_days=30, downsample_after=500, drop_percent=10.0, max_series=2000,
+                 legacy_path=None):
+        self.dir = Path(directory)
+        self.raw_days = raw_days
+        self.downsample_after = downsample_after
+        self.drop_percent = drop_percent
+        self.max_series = max_series
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self._lock = threading.RLock()
+        self._series = OrderedDict()  # product id -> ((inode, bytes read), PriceSeries), least recently used first
+        self._migrated = False
+
+    def _path(self, product_id):
+        name = product_id if _SAFE_ID_RE.match(product_id) else hashlib.sha1(product_id.encode()).hexdigest()
+        return self.dir / f"{name}.bin"
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # --- writing ---
+
+    def record_many(self, observations):
+        """
+        Append (product_id, price, timestamp) tuples; `price` is a number or
+        a price string ("£12.50"), timestamp None means now. Returns the
+        price drops as [{"id", "old", "new", "currency", "percent", "lowest"}].
+        """
+        self._migrate_legacy()
+        parsed = defaultdict(list)
+        for pid, price, ts in observations:
+            value, currency = parse_price(price)
+            if value is not None:
+                parsed[pid].append((int(ts or time.time()), value, currency))
+        drops = []
+        with self._lock:
+            for pid, points in parsed.items():
+                series = self._load(pid)
+                prev = series.latest if series else None
+                low = series.low if series else None
+                for t, value, currency in points:
+                    drop = self._drop(pid, prev, low, value, currency)
+                    if drop:
+                        drops.append(drop)
+                    prev = (t, value, currency)
+                    if low is None or value < low[1]:
+                        low = prev
+                self._append(pid, points)
+                series = self._load(pid)
+                if series and len(series) - series.downsampled_len >= self.downsample_after:
+                    self.downsample(pid)
+        return drops
+
+    def record(self, product_id, price, ts=None):
+        return self.record_many([(product_id, price, ts)])
+
+    def _drop(self, pid, prev, low, value, currency):
+        if not self.drop_percent or prev is None or prev[2] != currency or prev[1] <= 0:
+            return None
+        percent = (prev[1] - value) / prev[1] * 100
+        if percent < self.drop_percent:
+            return None
+        return {"id": pid, "old": prev[1], "new": value, "currency": currency, "percent": round(percent),
+                "lowest": low is None or value < low[1]}
+
+    def _append(self, pid, points):
+        data = b"".join(RECORD.pack(t, value, (currency or "").encode("ascii")[:3].ljust(3))
+                        for t, value, currency in points)
+        with self._file_lock(exclusive=False):
+            fd = os.open(self._path(pid), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def delete(self, product_id):
+        """Drop a product's history, for when the product itself is deleted."""
+        self._migrate_legacy()
+        with self._lock, self._file_lock(exclusive=True):
+            self._path(product_id).unlink(missing_ok=True)
+            self._series.pop(product_id, None)
+
+    def downsample(self, product_id, now=None):
+        """Rewrite a product's history with points older than `raw_days` reduced to a daily low and high."""
+        cutoff = (now or time.time()) - self.raw_days * DAY
+        with self._lock, self._file_lock(exclusive=True):
+            series = self._load(product_id)
+            if series is None:
+                return
+            out = downsampled(series, cutoff)
+            if len(out) < len(series):
+                path = self._path(product_id)
+                tmp = path.with_name(path.name + ".tmp")
+                tmp.write_bytes(out.to_bytes())
+                os.replace(tmp, path)
+                series = self._load(product_id)
+            series.downsampled_len = len(series)
+
+    def _migrate_legacy(self):
+        """Import price_history.jsonl from before the binary format, once."""
+        if self._migrated or self.legacy_path is None:
+            return
+        with self._lock:
+            if self._migrated:
+                return
+            if self.legacy_path.exists():
+                with self._file_lock(exclusive=True):
+                    # Another worker may have done it while we waited
+                    if self.legacy_path.exists():
+                        self._import_jsonl(self.legacy_path)
+            self._migrated = True
+
+    def _import_jsonl(self, path):
+        points = defaultdict(list)
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    value, currency = parse_price(rec["p"])
+                    if value is not None:
+                        points[rec["id"]].append((int(rec["t"]), value, currency))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        for pid, pts in points.items():
+            data = b"".join(RECORD.pack(t, v, (c or "").encode("ascii")[:3].ljust(3)) for t, v, c in pts)
+            with open(self._path(pid), "ab") as out:
+                out.write(data)
+        os.replace(path, path.with_name(path.name + ".imported"))
+
+    # --- reading ---
+
+    def _load(self, pid):
+        """The product's series, caught up with the file; None if it has no history."""
+        with self._lock:
+            path = self._path(pid)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                self._series.pop(pid, None)
+                return None
+            entry = self._series.get(pid)
+            if entry and entry[0] == (st.st_ino, st.st_size):
+                self._series.move_to_end(pid)
+                return entry[1]
+            if entry and entry[0][0] == st.st_ino and st.st_size > entry[0][1]:
+                # Only the records appended since we last looked
+                (ino, pos), series = entry
+            else:
+                ino, pos, series = st.st_ino, 0, PriceSeries()
+            with open(path, "rb") as f:
+                f.seek(pos)
+                data = f.read()
+            # A concurrent append may still be in flight; take whole records only
+            data = data[:len(data) - len(data) % RECORD.size]
+            series.extend_bytes(data)
+            self._series[pid] = ((ino, pos + len(data)), series)
+            self._series.move_to_end(pid)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+            return series
+
+    def series(self, product_id):
+        """The product's PriceSeries, or None if no price has been recorded for it."""
+        self._migrate_legacy()
+        return self._load(product_id)
+
+    def summary(self, product_id, max_points=40):
+        """{"count", "latest", "low", "high", "points"} for a product, or None without history."""
+        series = self.series(product_id)
+        if not series:
+            return None
+        return {"count": len(series), "latest": series.latest, "low": series.low, "high": series.high,
+                "points": series.points(max_points)}
+
+
+def sparkline_points(points, width=120, height=24, pad=2):
+    """SVG polyline points for [(time, price)], scaled to fit width x height."""
+    if len(points) < 2:
+        return ""
+    t0, t1 = points[0][0], points[-1][0]
+    lo = min(p for _, p in points)
+    hi = max(p for _, p in points)
+    span_t = (t1 - t0) or 1
+    span_p = (hi - lo) or 1
+    coords = []
+    for i, (t, p) in enumerate(points):
+        # Equal spacing when all points share a timestamp
+        x = pad + (width - 2 * pad) * ((t - t0) / span_t if t1 > t0 else i / (len(points) - 1))
+        y = height - pad - (height - 2 * pad) * ((p - lo) / span_p if hi > lo else 0.5)
+        coords.append(f"{x:.1f},{y:.1f}")
+    return " ".join(coords)
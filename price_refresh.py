@@ -0,0 +1,144 @@
+"""
+Background price refresh.
+
+refresh_prices() re-fetches prices for every visible, unpurchased product
+that hasn't been checked within `min_age`, using a thread pool with at most
+`per_host` requests in flight per retailer host and at least `delay` seconds
+between requests to the same host. Results are written with one batched
+store.update_many(), which sets only price and price_checked_at on the latest
+version of each product, so a purchase, edit or hide made while we were
+fetching is kept. Each observation goes into the price history, which reports
+any price drops back in the summary.
+
+Run it with `flask refresh-prices`, or set PRICE_REFRESH_INTERVAL to have a
+background thread do it periodically. Only one process refreshes at a time
+(flock on data/price_refresh.lock), so this is safe with several workers.
+"""
+import fcntl
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+class HostLimiter:
+    """Per-host concurrency cap plus a minimum gap between request starts."""
+
+    def __init__(self, per_host=2, delay=1.0):
+        self.per_host = per_host
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> [semaphore, next allowed start time]
+
+    def _slot(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = [threading.BoundedSemaphore(self.per_host), 0.0]
+            return self._hosts[host]
+
+    def run(self, host, fn, *args):
+        slot = self._slot(host)
+        with slot[0]:
+            with self._lock:
+                start = max(time.monotonic(), slot[1])
+                slot[1] = start + self.delay
+            wait = start - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            return fn(*args)
+
+
+def _is_due(p, cutoff):
+    checked = p.get("price_checked_at")
+    if not checked:
+        return True
+    try:
+        return datetime.fromisoformat(checked) < cutoff
+    except ValueError:
+        return True
+
+
+def refresh_prices(store, fetch_price, history=None, min_age=timedelta(hours=12),
+                   max_workers=8, per_host=2, delay=1.0) -> dict:
+    """Refresh due prices; returns a summary dict for logging."""
+    started = time.monotonic()
+    cutoff = datetime.utcnow() - min_age
+    due = [p for p in store.all()
+           if p.get("visible", True) and not p.get("purchased") and p.get("link") and _is_due(p, cutoff)]
+
+    limiter = HostLimiter(per_host=per_host, delay=delay)
+
+    def fetch(p):
+        host = (urlparse(p["link"]).hostname or "").lower()
+        return p["id"], limiter.run(host, fetch_price, p["link"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(fetch, due))
+
+    checked_at = datetime.utcnow().isoformat()
+    changes, observations = {}, []
+    for pid, price in results:
+        if not price:
+            continue
+        # Applied under the store's write lock to whatever the product is by then
+        changes[pid] = lambda p, price=price: dict(p, price=price, price_checked_at=checked_at)
+        observations.append((pid, price, None))
+
+    # History first: a card rendered once the products are written should already show the new point
+    drops = []
+    if history is not None:
+        drops = history.record_many(observations)
+    updated = store.update_many(changes)
+
+    return {
+        "due": len(due),
+        "updated": len(updated),
+        "failed": len(due) - len(updated),
+        "drops": drops,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+class PriceRefreshScheduler:
+    """Runs `job` every `interval` seconds on a daemon thread, one process at a time."""
+
+    def __init__(self, job, interval, lock_path):
+        self.job = job
+        self.interval = interval
+        self.lock_path = Path(lock_path)
+        self._thread = None
+        self._pid = None
+
+    def run_once(self, job=None):
+        """Run `job` (default: the scheduled one) unless another process is mid-refresh."""
+        with open(self.lock_path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another worker is already refreshing
+                return None
+            try:
+                return (job or self.job)()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                # keep the scheduler alive; the next run will retry
+                pass
+
+    def start(self):
+        """Start the thread in this process (safe to call on every request)."""
+        if self.interval <= 0 or self._pid == os.getpid():
+            return self
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name="price-refresh", daemon=True)
+        self._thread.start()
+        return self
@@ -0,0 +1,151 @@
+"""
+Several gift lists ("registries") served by one app.
+
+The original list is the default registry: same URLs, same DATA_FILE and
+ADMIN_* settings as before. Every other registry lives in its own directory,
+data/registries/<slug>/, with a registry.json of settings next to its own
+products.json (or products.db), price history and live-update sockets, and is
+served under /r/<slug>/.
+
+RegistryDispatcher moves /r/<slug> from PATH_INFO to SCRIPT_NAME before Flask
+sees the request, so the same routes serve every registry and url_for() links
+stay inside the registry the page belongs to.
+
+RegistryPool opens a registry the first time it is asked for and keeps at
+most `max_open` of them, closing the least recently used, so memory doesn't
+grow with the number of registries on disk. The default registry is never
+closed. Each registry has its own store (own files, own locks), so a busy
+registry's writes never wait on another's.
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+SLUG_RE = re.compile(r"^[a-z0-9][a-z0-9-]{0,39}$")
+ENVIRON_KEY = "babylist.registry"
+_PATH_RE = re.compile(r"^/r/([^/]+)(/.*)?$")
+
+
+class Registry:
+    """One gift list: its settings and the services bound to its data."""
+
+    def __init__(self, slug, settings, store, index, live_updates, price_history):
+        self.slug = slug  # None for the default registry
+        self.settings = settings
+        self.store = store
+        self.index = index
+        self.live_updates = live_updates
+        self.price_history = price_history
+
+    @property
+    def title(self):
+        return self.settings.get("title")
+
+    @property
+    def session_key(self):
+        # The default registry keeps the key existing sessions already have
+        return "logged_in" if self.slug is None else f"logged_in:{self.slug}"
+
+    def check_login(self, username, password):
+        expected = self.settings.get("admin_password")
+        return bool(expected) and username == self.settings.get("admin_username", "admin") and password == expected
+
+    def close(self):
+        self.live_updates.close()
+
+
+def settings_path(root, slug):
+    return Path(root) / slug / "registry.json"
+
+
+def create_registry(root, slug, settings):
+    """Write data/registries/<slug>/registry.json; ValueError for a bad or taken slug."""
+    if not SLUG_RE.match(slug or ""):
+        raise ValueError("slugs are 1-40 lowercase letters, digits and dashes")
+    path = settings_path(root, slug)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(path, "x") as f:
+            json.dump(settings, f, indent=2)
+    except FileExistsError:
+        raise ValueError(f"registry {slug!r} already exists") from None
+    os.chmod(path, 0o600)  # holds the admin password
+    return path
+
+
+class RegistryPool:
+    def __init__(self, default, root, open_registry, max_open=16):
+        """`open_registry(slug, settings, data_dir)` builds a Registry for a directory under `root`."""
+        self.default = default
+        self.root = Path(root)
+        self.open_registry = open_registry
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._open = OrderedDict()  # slug -> Registry, least recently used first
+        # Counters
+        self.opened = 0
+        self.closed = 0
+
+    def get(self, slug=None):
+        """The registry for `slug` (None = default), opening it if needed; None if there's no such registry."""
+        if slug is None:
+            return self.default
+        with self._lock:
+            reg = self._open.get(slug)
+            if reg is not None:
+                self._open.move_to_end(slug)
+                return reg
+        if not SLUG_RE.match(slug):
+            return None
+        try:
+            with open(settings_path(self.root, slug)) as f:
+                settings = json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        # Parsing the catalog happens outside the lock, so other registries aren't held up
+        reg = self.open_registry(slug, settings, self.root / slug)
+        evicted = []
+        with self._lock:
+            if slug in self._open:
+                # Another thread opened it meanwhile; use theirs
+                evicted.append(reg)
+                reg = self._open[slug]
+                self._open.move_to_end(slug)
+            else:
+                self._open[slug] = reg
+                self.opened += 1
+                while len(self._open) > self.max_open:
+                    evicted.append(self._open.popitem(last=False)[1])
+                    self.closed += 1
+        for old in evicted:
+            old.close()
+        return reg
+
+    def open_registries(self):
+        with self._lock:
+            return [self.default, *self._open.values()]
+
+    def slugs(self):
+        """Slugs of every registry on disk (open or not), sorted."""
+        try:
+            return sorted(p.parent.name for p in self.root.glob("*/registry.json") if SLUG_RE.match(p.parent.name))
+        except OSError:
+            return []
+
+
+class RegistryDispatcher:
+    """WSGI middleware: /r/<slug>/path is served as /path of registry <slug>."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        m = _PATH_RE.match(environ.get("PATH_INFO", ""))
+        if m:
+            environ[ENVIRON_KEY] = m.group(1)
+            environ["SCRIPT_NAME"] = f"{environ.get('SCRIPT_NAME', '')}/r/{m.group(1)}"
+            environ["PATH_INFO"] = m.group(2) or "/"
+        return self.app(environ, start_response)
@@ -0,0 +1,167 @@
+"""
+Retailer registry.
+
+Retailers are plain data: a display name, the domains they trade on, and
+optional extraction rules that the price/image fetchers try before the
+generic structured-data extractor. Extra shops can be added without code by
+listing them in data/retailers.json (same shape as RETAILERS below).
+
+Lookup walks the hostname's suffixes ("www.amazon.co.uk", "amazon.co.uk",
+"co.uk", "uk") against a dict built once at import, so it costs a handful of
+dict lookups regardless of how many retailers there are, and is memoised.
+
+Rules, per field ("price" / "image"), tried in order until one matches:
+  {"tag": "img", "attrs": {"id": "landingImage"}, "attr": "src"}
+      first <img id="landingImage"> on the page, value of its src attribute
+      ("class" in attrs matches one class token; other attrs match exactly)
+  {"tag": "span", "attrs": {"class": "price"}, "text": true}
+      the text directly inside the first matching tag
+  {"json": "props.pageProps.product.price", "script_id": "__NEXT_DATA__"}
+      a dotted path into the JSON of <script id="__NEXT_DATA__">
+"""
+import html as htmllib
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlparse
+
+from extract import parse_attrs
+
+RETAILERS = [
+    {
+        "name": "Amazon",
+        "domains": ["amazon.co.uk", "amazon.com"],
+        "rules": {
+            "image": [
+                {"tag": "img", "attrs": {"id": "landingImage"}, "attr": "data-old-hires"},
+                {"tag": "img", "attrs": {"id": "landingImage"}, "attr": "src"},
+            ],
+            "price": [
+                {"tag": "span", "attrs": {"class": "a-offscreen"}, "text": True},
+            ],
+        },
+    },
+    {"name": "Argos", "domains": ["argos.co.uk"]},
+    {"name": "Boots", "domains": ["boots.com"]},
+    {"name": "John Lewis", "domains": ["johnlewis.com"]},
+    {"name": "Mamas & Papas", "domains": ["mamasandpapas.com"]},
+    {"name": "Mabel & Fox", "domains": ["mabelandfox.com"]},
+    {"name": "Pippeta", "domains": ["pippeta.com"]},
+    {"name": "Currys", "domains": ["currys.co.uk"]},
+    {"name": "Sainsburys", "domains": ["sainsburys.co.uk"]},
+]
+
+
+def _tag_rule_re(rule):
+    tag = re.escape(rule["tag"]) if rule.get("tag") else "[a-z][a-z0-9]*"
+    lookaheads = ""
+    for attr, value in (rule.get("attrs") or {}).items():
+        if attr == "class":
+            val = rf"""["'][^"']*(?<![\w-]){re.escape(value)}(?![\w-])[^"']*["']"""
+        else:
+            val = rf"""["']{re.escape(value)}["']"""
+        lookaheads += rf"(?=[^>]*\b{re.escape(attr)}\s*={val})"
+    return re.compile(rf"<{tag}\b{lookaheads}([^>]*)>([^<]*)", re.I)
+
+
+class Retailer:
+    def __init__(self, name, domains, rules=None):
+        self.name = name
+        self.domains = [d.lower().lstrip(".") for d in domains]
+        self.rules = {}
+        for field, field_rules in (rules or {}).items():
+            compiled = []
+            for rule in field_rules:
+                if "json" in rule:
+                    compiled.append(("json", rule))
+                else:
+                    compiled.append(("tag", rule, _tag_rule_re(rule)))
+            self.rules[field] = compiled
+
+    def __repr__(self):
+        return f"Retailer({self.name!r})"
+
+    def extract(self, field, html):
+        """Value for `field` from this retailer's own rules, or None."""
+        for kind, rule, *rest in self.rules.get(field, ()):
+            value = _json_rule(rule, html) if kind == "json" else _tag_rule(rule, rest[0], html)
+            if value:
+                return value
+        return None
+
+    def complete(self, html):
+        """
+        True once `html` (possibly just the start of a page) holds a match for
+        the first rule of every field, so reading further can't change what
+        extract() returns. Text after the last "<" is ignored: it may be cut
+        off mid-value.
+        """
+        html = html[:max(html.rfind("<"), 0)]
+        for kind, rule, *rest in (rules[0] for rules in self.rules.values() if rules):
+            if not (_json_rule(rule, html) if kind == "json" else _tag_rule(rule, rest[0], html)):
+                return False
+        return True
+
+
+def _tag_rule(rule, rx, html):
+    m = rx.search(html)
+    if not m:
+        return None
+    if rule.get("text"):
+        return htmllib.unescape(m.group(2)).strip() or None
+    return parse_attrs(m.group(1)).get(rule.get("attr", "content"))
+
+
+def _json_rule(rule, html):
+    sid = re.escape(rule.get("script_id", "__NEXT_DATA__"))
+    m = re.search(rf"""<script[^>]*\bid=["']{sid}["'][^>]*>(.*?)</script""", html, re.I | re.S)
+    if not m:
+        return None
+    try:
+        node = json.loads(m.group(1))
+        for key in rule["json"].split("."):
+            node = node[int(key)] if isinstance(node, list) else node[key]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    return str(node) if node not in (None, "") else None
+
+
+class RetailerRegistry:
+    def __init__(self, records):
+        self._by_domain = {}
+        for rec in records:
+            retailer = Retailer(rec["name"], rec.get("domains", []), rec.get("rules"))
+            for domain in retailer.domains:
+                self._by_domain[domain] = retailer
+        # per-instance memo of hostname -> Retailer/None
+        self.lookup_host = lru_cache(maxsize=2048)(self._lookup_host)
+
+    @classmethod
+    def load(cls, extra_path=None):
+        """Built-in RETAILERS plus any entries in extra_path (later ones win)."""
+        records = list(RETAILERS)
+        if extra_path and Path(extra_path).exists():
+            with open(extra_path) as f:
+                records += json.load(f)
+        return cls(records)
+
+    def _lookup_host(self, hostname):
+        labels = hostname.lower().rstrip(".").split(".")
+        for i in range(len(labels)):
+            retailer = self._by_domain.get(".".join(labels[i:]))
+            if retailer:
+                return retailer
+        return None
+
+    def lookup(self, url):
+        """Retailer for a URL (scheme optional), or None if it isn't registered."""
+        if not url:
+            return None
+        if "://" not in url:
+            url = "http://" + url
+        try:
+            hostname = urlparse(url).hostname or ""
+        except ValueError:
+            return None
+        return self.lookup_host(hostname) if hostname else None
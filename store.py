@@ -0,0 +1,542 @@
+"""
+Product catalog storage.
+
+The catalog is parsed once and kept in memory as an id -> product dict (which
+also preserves list order). Before every read we stat the files on disk and
+only re-read what changed, so a page view with nothing changed costs two
+stat() calls instead of a full json.load.
+
+On disk the catalog is a snapshot (products.json) plus an append-only journal
+(products.journal). Each mutation appends one compact JSON line to the
+journal and fsyncs it, so a write costs the size of the change rather than
+the size of the catalog. Once the journal passes `compact_bytes` it is folded
+into a fresh snapshot in the background (write temp file, fsync, rename), so a
+crash can never leave a half-written products.json. Writers in different
+processes (gunicorn workers) serialise on an flock()ed products.lock file.
+
+Every write is stamped with the next catalog version, which is stored on the
+product as "rev" (deletions are remembered as tombstones), so changes(since)
+can answer "what changed after version N" for the JSON API. Compaction drops
+tombstones and starts the new journal with a "floor" record: deltas are only
+available from that version on, and older clients get the full list instead.
+
+update(id, change) is a compare-and-set on one product: the change is
+applied to the latest version under the same lock writers take, so two
+workers acting on the same product can't overwrite each other.
+update_many() does the same for several products in one write.
+
+Writes also store the price parsed into a number (price_value) and currency,
+so sorting and filtering by price never has to parse the display string.
+
+With DATA_BACKEND=sqlite the same interface is served by SqliteProductStore
+instead (see open_store()).
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from extract import parse_price
+
+
+def with_price_fields(p: dict) -> dict:
+    # Numeric price_value + currency, parsed from the free-form price once per write
+    p["price_value"], p["currency"] = parse_price(p.get("price"))
+    return p
+
+
+def normalise_product(p: dict) -> dict:
+    # Normalise new keys for older data
+    p.setdefault("visible", True)
+    p.setdefault("reserved", False)
+    if "price_value" not in p:
+        with_price_fields(p)
+    return p
+
+
+def _no_timer(op):
+    return nullcontext()
+
+
+def _stat(path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class ProductStore:
+    def __init__(self, path, compact_bytes=256 * 1024, timer=None):
+        self.path = Path(path)
+        # timer(op) -> context manager around disk reads/writes (for metrics)
+        self.timer = timer or _no_timer
+        self.journal_path = self.path.with_suffix(".journal")
+        self.lock_path = self.path.with_suffix(".lock")
+        self.compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._index = {}
+        self._snap_stamp = ()  # (mtime_ns, size, inode) of the snapshot we last parsed
+        self._journal_pos = 0  # bytes of the journal already applied
+        self._compacting = False
+        # Catalog version: highest rev written so far (persisted, same in every process)
+        self._version = 0
+        self._floor = 0  # changes(since) is complete for since >= floor
+        self._deleted = {}  # id -> rev of its deletion, since the last compaction
+
+    @contextmanager
+    def _file_lock(self, exclusive=True):
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # --- reading ---
+
+    def _journal_size(self):
+        try:
+            return self.journal_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self, locked=False):
+        snap = _stat(self.path)
+        size = self._journal_size()
+        if snap == self._snap_stamp and size == self._journal_pos:
+            return
+        if snap == self._snap_stamp and size > self._journal_pos:
+            # Only new journal records since we last looked
+            self._replay(self._journal_pos)
+            return
+        # Snapshot replaced (compaction/hand edit) or journal truncated:
+        # read both under a shared lock so we don't see them mid-compaction
+        if locked:
+            self._reload()
+        else:
+            with self._file_lock(exclusive=False):
+                self._reload()
+
+    def _reload(self):
+        self._snap_stamp = _stat(self.path)
+        products = []
+        if self._snap_stamp is not None:
+            with self.timer("load"), open(self.path, "r") as f:
+                products = json.load(f)
+        self._index = {p.get("id"): normalise_product(p) for p in products}
+        self._version = self._floor = max((p.get("rev", 0) for p in products), default=0)
+        self._deleted = {}
+        self._journal_pos = 0
+        self._replay(0)
+
+    def _replay(self, pos):
+        with self.timer("replay"):
+            self._replay_from(pos)
+
+    def _replay_from(self, pos):
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(pos)
+                data = f.read()
+        except FileNotFoundError:
+            self._journal_pos = 0
+            return
+        # Only consume complete lines; a concurrent append may still be in flight
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # torn record from a crash mid-append
+                continue
+            self._apply(rec)
+        self._journal_pos = pos + end
+
+    def _apply(self, rec):
+        v = rec.get("v") or self._version + 1
+        op = rec.get("op")
+        if op == "put":
+            p = normalise_product(rec["p"])
+            p["rev"] = v
+            self._index[p.get("id")] = p
+            self._deleted.pop(p.get("id"), None)
+        elif op == "del":
+            self._index.pop(rec.get("id"), None)
+            self._deleted[rec.get("id")] = v
+        elif op == "floor":
+            self._floor = max(self._floor, v)
+        self._version = max(self._version, v)
+
+    def all(self):
+        """Return the catalog as a new list (the product dicts are shared)."""
+        with self._lock:
+            self._refresh()
+            return list(self._index.values())
+
+    def get(self, product_id):
+        """O(1) lookup by id; None if there is no such product."""
+        with self._lock:
+            self._refresh()
+            return self._index.get(product_id)
+
+    def cache_key(self) -> str:
+        """Changes whenever the catalog on disk changes; the same in every process."""
+        with self._lock:
+            self._refresh()
+            return "-".join(str(x) for x in (self._snap_stamp or ())) + f"-{self._journal_pos}"
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._version
+
+    def changes(self, since=None) -> dict:
+        """
+        Products changed and ids deleted after version `since`.
+        With no usable `since` (missing, too old, or from the future) returns
+        the whole catalog with "full": True.
+        """
+        with self._lock:
+            self._refresh()
+            if since is None or since <= 0 or since < self._floor or since > self._version:
+                return {"version": self._version, "full": True, "products": list(self._index.values()), "deleted": []}
+            return {
+                "version": self._version,
+                "full": False,
+                "products": [p for p in self._index.values() if p.get("rev", 0) > since],
+                "deleted": [pid for pid, rev in self._deleted.items() if rev > since],
+            }
+
+    def public_split(self):
+        """Visible products as (unpurchased, purchased), in catalog order."""
+        visible = [p for p in self.all() if p.get("visible", True)]
+        unpurchased = [p for p in visible if not p.get("purchased", False)]
+        purchased = [p for p in visible if p.get("purchased", False)]
+        return unpurchased, purchased
+
+    # --- writing ---
+
+    def _append(self, *recs):
+        line = b"".join(json.dumps(rec, separators=(",", ":")).encode() + b"\n" for rec in recs)
+        with self.timer("append"):
+            self._append_line(line)
+
+    def _append_line(self, line):
+        fd = os.open(self.journal_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # If a crash left a torn last line, start ours on a fresh one
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                line = b"\n" + line
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write(self, *recs):
+        with self._lock, self._file_lock():
+            # Catch up with other workers first so our version numbers follow theirs
+            self._refresh(locked=True)
+            self._write_locked(*recs)
+
+    def _write_locked(self, *recs):
+        recs = [dict(rec, v=self._version + i) for i, rec in enumerate(recs, 1)]
+        self._append(*recs)
+        # Picks up our record plus anything other workers appended
+        self._refresh(locked=True)
+        if self._journal_pos > self.compact_bytes and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def put(self, product: dict):
+        """Insert or replace a product (matched by id); returns it as stored (with its rev)."""
+        self._write({"op": "put", "p": with_price_fields(product)})
+        return self._index.get(product.get("id"))
+
+    def update(self, product_id, change):
+        """
+        Atomic read-modify-write of one product. `change(product)` is called
+        with a copy of the latest version while every other writer (thread or
+        worker) waits, and returns the product to store, or None to leave it
+        as it is. Returns (product as stored, whether it was written); the
+        product is None if there is no such id.
+        """
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            current = self._index.get(product_id)
+            if current is None:
+                return None, False
+            new = change(dict(current))
+            if new is None:
+                return current, False
+            self._write_locked({"op": "put", "p": with_price_fields(new)})
+            return self._index.get(product_id), True
+
+    def update_many(self, changes):
+        """
+        update() for several products in one journal write: `changes` maps
+        product id -> change(product). Missing ids are skipped. Returns the
+        products that were written, as stored.
+        """
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            recs = []
+            for pid, change in changes.items():
+                current = self._index.get(pid)
+                new = change(dict(current)) if current is not None else None
+                if new is not None:
+                    recs.append({"op": "put", "p": with_price_fields(new)})
+            if recs:
+                self._write_locked(*recs)
+            return [self._index[rec["p"]["id"]] for rec in recs]
+
+    def put_many(self, products):
+        """Insert or replace several products with one journal write and fsync."""
+        if products:
+            self._write(*({"op": "put", "p": with_price_fields(p)} for p in products))
+
+    def delete(self, product_id):
+        self._write({"op": "del", "id": product_id})
+
+    def _write_snapshot(self, products, floor):
+        with self.timer("snapshot"):
+            self._write_snapshot_files(products, floor)
+
+    def _write_snapshot_files(self, products, floor):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(products, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # The snapshot now holds every journal record, so start the journal over.
+        # Replaying it after a crash in between is harmless: records are idempotent.
+        with open(self.journal_path, "wb") as f:
+            f.write(json.dumps({"op": "floor", "v": floor}).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, products):
+        """Replace the whole catalog with an atomic snapshot."""
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            # Everyone's delta is invalid now; bump the version so they refetch
+            floor = self._version + 1
+            self._write_snapshot([with_price_fields(dict(p, rev=floor)) for p in products], floor)
+            self._reload()
+
+    def compact(self):
+        """Fold the journal into a new snapshot."""
+        try:
+            with self._lock, self._file_lock():
+                self._refresh(locked=True)
+                self._write_snapshot(list(self._index.values()), self._version)
+                self._reload()
+        finally:
+            self._compacting = False
+
+
+class SqliteProductStore:
+    """
+    Products in a local SQLite database (WAL mode), one row per product.
+
+    The product dict is kept as JSON in `data`; `visible` and `purchased` are
+    mirrored into indexed columns so the public page split runs as queries.
+    `seq` keeps insertion order the same as the JSON store, `rev` is the
+    catalog version of the row's last write and deletions leave a row in
+    `tombstones`, for changes(since). Safe to share between gunicorn workers;
+    each thread gets its own connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS products (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            visible INTEGER NOT NULL DEFAULT 1,
+            purchased INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS products_visible_purchased ON products (visible, purchased);
+        CREATE INDEX IF NOT EXISTS products_purchased ON products (purchased);
+        CREATE TABLE IF NOT EXISTS tombstones (id TEXT PRIMARY KEY, rev INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('floor', 0);
+    """
+
+    def __init__(self, path, timer=None):
+        self.path = Path(path)
+        self.timer = timer or _no_timer
+        self._local = threading.local()
+        self._forked = []
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+            # Databases created before change tracking have no rev column
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+            if "rev" not in columns:
+                conn.execute("ALTER TABLE products ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS products_rev ON products (rev)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            if conn is not None:
+                # Opened before a fork (gunicorn --preload). Never use or close it here:
+                # closing would drop the parent's locks. Keep it referenced so GC doesn't either.
+                self._forked.append(conn)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _row(data, rev):
+        p = normalise_product(json.loads(data))
+        p["rev"] = rev
+        return p
+
+    def _select(self, where="", args=()):
+        with self.timer("select"):
+            rows = self._conn().execute(f"SELECT data, rev FROM products {where} ORDER BY seq", args)
+            return [self._row(data, rev) for data, rev in rows]
+
+    def _meta(self, key, conn=None):
+        return (conn or self._conn()).execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @property
+    def version(self):
+        return self._meta("version")
+
+    def cache_key(self) -> str:
+        return str(self.version)
+
+    def all(self):
+        return self._select()
+
+    def get(self, product_id):
+        row = self._conn().execute("SELECT data, rev FROM products WHERE id = ?", (product_id,)).fetchone()
+        return self._row(*row) if row else None
+
+    def changes(self, since=None) -> dict:
+        conn = self._conn()
+        with conn:  # COMMITs on the way out
+            # sqlite3 doesn't open a transaction for SELECTs; without one each query could see a different version
+            conn.execute("BEGIN")
+            version, floor = self._meta("version", conn), self._meta("floor", conn)
+            if since is None or since <= 0 or since < floor or since > version:
+                return {"version": version, "full": True, "products": self._select(), "deleted": []}
+            deleted = [pid for (pid,) in conn.execute("SELECT id FROM tombstones WHERE rev > ?", (since,))]
+            return {
+                "version": version,
+                "full": False,
+                "products": self._select("WHERE rev > ?", (since,)),
+                "deleted": deleted,
+            }
+
+    def public_split(self):
+        return (
+            self._select("WHERE visible = 1 AND purchased = 0"),
+            self._select("WHERE visible = 1 AND purchased = 1"),
+        )
+
+    def _upsert(self, conn, p, rev):
+        p = with_price_fields({k: v for k, v in p.items() if k != "rev"})
+        conn.execute(
+            """
+            INSERT INTO products (id, visible, purchased, data, rev) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                visible = excluded.visible, purchased = excluded.purchased,
+                data = excluded.data, rev = excluded.rev
+            """,
+            (p["id"], bool(p.get("visible", True)), bool(p.get("purchased", False)),
+             json.dumps(p, separators=(",", ":")), rev),
+        )
+        conn.execute("DELETE FROM tombstones WHERE id = ?", (p["id"],))
+
+    def _bump(self, conn):
+        """Next catalog version; the UPDATE takes the write lock, so it's unique across workers."""
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return self._meta("version", conn)
+
+    def put(self, product: dict):
+        self.put_many([product])
+        return self.get(product["id"])
+
+    def update(self, product_id, change):
+        """Same as ProductStore.update(); BEGIN IMMEDIATE holds the database write lock throughout."""
+        with self.timer("write"), self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data, rev FROM products WHERE id = ?", (product_id,)).fetchone()
+            if row is None:
+                return None, False
+            current = self._row(*row)
+            new = change(dict(current))
+            if new is None:
+                return current, False
+            self._upsert(conn, new, self._bump(conn))
+        return self.get(product_id), True
+
+    def update_many(self, changes):
+        """Same as ProductStore.update_many(); one transaction and one rev for the lot."""
+        written = []
+        with self.timer("write"), self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for pid, change in changes.items():
+                row = conn.execute("SELECT data, rev FROM products WHERE id = ?", (pid,)).fetchone()
+                new = change(dict(self._row(*row))) if row else None
+                if new is not None:
+                    written.append(new)
+            if written:
+                rev = self._bump(conn)
+                for p in written:
+                    self._upsert(conn, p, rev)
+        return [self.get(p["id"]) for p in written]
+
+    def put_many(self, products):
+        if not products:
+            return
+        with self.timer("write"), self._conn() as conn:
+            rev = self._bump(conn)
+            for p in products:
+                self._upsert(conn, p, rev)
+
+    def delete(self, product_id):
+        with self.timer("write"), self._conn() as conn:
+            rev = self._bump(conn)
+            conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            conn.execute("INSERT OR REPLACE INTO tombstones (id, rev) VALUES (?, ?)", (product_id, rev))
+
+    def save(self, products):
+        with self.timer("write"), self._conn() as conn:
+            rev = self._bump(conn)
+            conn.execute("DELETE FROM products")
+            conn.execute("DELETE FROM tombstones")
+            for p in products:
+                self._upsert(conn, p, rev)
+            # Deltas from before a full replace can't be answered
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'floor'", (rev,))
+
+
+def migrate_json_to_sqlite(json_path, db_path) -> int:
+    """One-shot copy of products.json (+ journal) into the SQLite store."""
+    products = ProductStore(json_path).all()
+    SqliteProductStore(db_path).save(products)
+    return len(products)
+
+
+def open_store(backend, data_file, sqlite_file, compact_bytes=256 * 1024, timer=None):
+    """Build the store selected by DATA_BACKEND ("json" or "sqlite")."""
+    if backend == "sqlite":
+        return SqliteProductStore(sqlite_file, timer=timer)
+    if backend in ("", "json"):
+        return ProductStore(data_file, compact_bytes=compact_bytes, timer=timer)
+    raise ValueError(f"Unknown DATA_BACKEND: {backend!r}")
@@ -0,0 +1,215 @@
+"""
+Local thumbnails for product images.
+
+Product cards used to hotlink full-size retailer images. ThumbnailCache
+downloads each image once, stores resized WebP (or JPEG) copies at a few
+widths on disk, and the /img route serves them with long cache headers.
+
+Files are content-addressed: data/thumbs/<sha256 of the source>-<width>.<ext>,
+plus a small pointer file per source URL (by-url/<sha1 of url>), so duplicated
+products sharing an image share its thumbnails. The directory is kept under
+`max_bytes` by deleting the least recently served files.
+
+Pillow is optional; without it thumbnails are disabled and cards keep
+hotlinking the original image. Pillow and requests are only imported once a
+thumbnail actually has to be built or served.
+"""
+import hashlib
+import importlib.util
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from pathlib import Path
+
+USER_AGENT = "Mozilla/5.0"
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, widths=(240, 480), max_bytes=100 * 1024 * 1024,
+                 max_source_bytes=10 * 1024 * 1024, timeout=8):
+        self.cache_dir = Path(cache_dir)
+        self.widths = tuple(sorted(widths))
+        self.max_bytes = max_bytes
+        self.max_source_bytes = max_source_bytes
+        self.timeout = timeout
+        self.enabled = importlib.util.find_spec("PIL") is not None
+        self._lock = threading.Lock()
+        self._inflight = {}  # url -> Event, so concurrent requests download once
+        self._failed = {}  # url -> time of last failure; not retried for `retry_after`
+        self.retry_after = 600
+        self._pool = None
+        self._pool_pid = None
+        self._bytes = None
+
+    @cached_property
+    def _output(self):
+        """(file extension, Pillow format, mimetype): WebP if this Pillow can write it."""
+        from PIL import features
+        if features.check("webp"):
+            return "webp", "WEBP", "image/webp"
+        return "jpg", "JPEG", "image/jpeg"
+
+    @property
+    def ext(self):
+        return self._output[0]
+
+    @property
+    def format(self):
+        return self._output[1]
+
+    @property
+    def mimetype(self):
+        return self._output[2]
+
+    @cached_property
+    def session(self):
+        import requests
+        return requests.Session()
+
+    # --- paths ---
+
+    def _pointer(self, url):
+        return self.cache_dir / "by-url" / url_key(url)
+
+    def _thumb_path(self, digest, width):
+        return self.cache_dir / f"{digest}-{width}.{self.ext}"
+
+    def _lookup(self, url, width):
+        try:
+            digest = self._pointer(url).read_text().strip()
+        except OSError:
+            return None
+        path = self._thumb_path(digest, width)
+        return path if path.exists() else None
+
+    # --- building ---
+
+    def _download(self, url):
+        resp = self.session.get(url, timeout=self.timeout, stream=True, headers={"User-Agent": USER_AGENT})
+        try:
+            resp.raise_for_status()
+            data = bytearray()
+            for chunk in resp.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > self.max_source_bytes:
+                    raise ValueError("image too large")
+            return bytes(data)
+        finally:
+            resp.close()
+
+    def _render(self, img, width):
+        thumb = img.copy()
+        thumb.thumbnail((width, width * 4))
+        if self.format == "JPEG" and thumb.mode not in ("RGB", "L"):
+            thumb = thumb.convert("RGB")
+        elif thumb.mode not in ("RGB", "RGBA", "L"):
+            thumb = thumb.convert("RGBA")
+        buf = io.BytesIO()
+        if self.format == "WEBP":
+            thumb.save(buf, "WEBP", quality=80, method=4)
+        else:
+            thumb.save(buf, "JPEG", quality=82, optimize=True, progressive=True)
+        return buf.getvalue()
+
+    def _write(self, path, data):
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _build(self, url):
+        from PIL import Image, ImageOps
+        source = self._download(url)
+        digest = hashlib.sha256(source).hexdigest()[:32]
+        (self.cache_dir / "by-url").mkdir(parents=True, exist_ok=True)
+        if not all(self._thumb_path(digest, w).exists() for w in self.widths):
+            img = Image.open(io.BytesIO(source))
+            img = ImageOps.exif_transpose(img)
+            for w in self.widths:
+                data = self._render(img, w)
+                self._write(self._thumb_path(digest, w), data)
+                self._account(len(data))
+        self._write(self._pointer(url), digest.encode())
+
+    def ensure(self, url):
+        """Build thumbnails for url unless they exist. Raises on download/decode errors."""
+        if all(self._lookup(url, w) for w in self.widths):
+            return
+        with self._lock:
+            event = self._inflight.get(url)
+            owner = event is None
+            if owner:
+                event = self._inflight[url] = threading.Event()
+        if not owner:
+            event.wait(self.timeout * 2)
+            return
+        try:
+            self._build(url)
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            event.set()
+        self._evict()
+
+    def get(self, url, width):
+        """Path of the thumbnail of url at width, building it if needed; None on failure."""
+        if not self.enabled or width not in self.widths or not url:
+            return None
+        path = self._lookup(url, width)
+        if path is None:
+            if time.time() - self._failed.get(url, 0) < self.retry_after:
+                return None
+            try:
+                self.ensure(url)
+            except Exception:
+                self._failed[url] = time.time()
+                return None
+            path = self._lookup(url, width)
+        if path is not None:
+            # mtime doubles as "last served" for LRU eviction
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def prewarm(self, url):
+        """Build thumbnails in the background (e.g. right after an item is saved)."""
+        if not (self.enabled and url):
+            return
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbs")
+                self._pool_pid = os.getpid()
+        self._pool.submit(self.get, url, self.widths[0])
+
+    # --- size bound ---
+
+    def _files(self):
+        return [f for f in self.cache_dir.glob(f"*.{self.ext}") if f.is_file()]
+
+    def _account(self, n):
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += n
+
+    def _evict(self):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(f.stat().st_size for f in self._files())
+            if self._bytes <= self.max_bytes:
+                return
+            files = sorted(self._files(), key=lambda f: f.stat().st_mtime)
+            for f in files:
+                if self._bytes <= self.max_bytes * 0.9:
+                    break
+                size = f.stat().st_size
+                f.unlink(missing_ok=True)
+                self._bytes -= size
+            # Pointers whose thumbnails are gone just get rebuilt on next request